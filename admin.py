@@ -4,12 +4,17 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.constants import ParseMode
-import asyncio
 import logging
 import re
+from datetime import datetime
 
+from cache import caches
 from config import *
-from database import db
+from database import db, analytics
+from broadcasts import broadcaster
+from ledger import ledger
+from outbox import outbox
+from storage_gc import storage_gc
 from utils import *
 from texts import *
 
@@ -41,8 +46,13 @@ async def admin_stats_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     if not is_admin(query.from_user.id):
         return
 
-    stats = db.get_global_stats()
-    stats_text = format_admin_stats(stats)
+    stats = await analytics.get_global_stats()
+    stats_text = (
+        format_admin_stats(stats)
+        + format_send_lanes(context.bot.rate_limiter)
+        + format_notification_savings(outbox)
+        + format_cache_stats(caches)
+    )
 
     buttons = [
         [InlineKeyboardButton("🔄 بروزرسانی", callback_data="admin_stats")],
@@ -69,6 +79,7 @@ async def admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     total_users = len(db.data['users'])
     banned_users = len([u for u in db.data['users'].values() if u.get('banned')])
     premium_users = len([u for u in db.data['users'].values() if u.get('premium')])
+    unreachable_users = db.count_unreachable_users()
 
     message = f"""
 👥 **مدیریت کاربران**
@@ -76,6 +87,7 @@ async def admin_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
 📊 کل کاربرها: {total_users}
 💎 پریمیوم: {premium_users}
 ⛔️ بن شده: {banned_users}
+🚫 ربات رو بلاک کردن: {unreachable_users}
 
 از دکمه‌های زیر استفاده کن:
 """
@@ -192,8 +204,10 @@ async def admin_unban_callback(update: Update, context: ContextTypes.DEFAULT_TYP
 def build_admin_premium_overview():
     """Create premium overview text and keyboard"""
     premium_users = [u for u in db.data['users'].values() if u.get('premium')]
-    revenue = sum(u.get('premium_price', 0) or 0 for u in premium_users)
+    revenue = ledger.summary()
     plans = db.get_premium_plans()
+    plan_titles = {plan['id']: plan['title'] for plan in plans}
+    plan_titles['manual'] = "اهدایی ادمین"
 
     if plans:
         plan_lines = "\n".join(
@@ -209,8 +223,9 @@ def build_admin_premium_overview():
 💎 **مدیریت پریمیوم**
 
 📊 کاربران پریمیوم: {len(premium_users)}
-💰 درآمد کل: {format_number(revenue)} تومان
-
+💰 درآمد کل: {format_number(revenue['revenue'])} تومان
+📅 این ماه: {format_number(revenue['revenue_month'])} تومان | امروز: {format_number(revenue['revenue_today'])} تومان
+{format_revenue_by_plan(ledger.revenue_by_plan(datetime.now().strftime('%Y-%m')), plan_titles)}
 **پلن‌های فعال:**
 {plan_lines}
 
@@ -296,7 +311,7 @@ async def admin_give_premium_days(update: Update, context: ContextTypes.DEFAULT_
         user_id = context.user_data['premium_user_id']
 
         # Activate premium
-        db.activate_premium(user_id, days=days, plan_id='manual', price=0)
+        db.activate_premium(user_id, days=days, plan_id='manual', price=0, kind='grant')
 
         user = db.get_user(user_id)
         await update.message.reply_text(
@@ -895,46 +910,23 @@ async def admin_broadcast_type(update: Update, context: ContextTypes.DEFAULT_TYP
 
 
 async def admin_broadcast_send(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Send broadcast message"""
+    """Queue broadcast message; the broadcast worker sends it in the background"""
     message_text = update.message.text
-    broadcast_type = context.user_data.get('broadcast_type', 'all')
+    broadcast_type = context.user_data.pop('broadcast_type', 'all')
 
-    # Get target users
-    if broadcast_type == 'all':
-        target_users = [u for u in db.data['users'].values() if not u.get('banned')]
-    elif broadcast_type == 'premium':
-        target_users = [u for u in db.data['users'].values() if u.get('premium') and not u.get('banned')]
-    else:  # free
-        target_users = [u for u in db.data['users'].values() if not u.get('premium') and not u.get('banned')]
+    job = db.create_broadcast(update.effective_user.id, message_text, broadcast_type)
 
-    await update.message.reply_text(
-        f"در حال ارسال به {len(target_users)} کاربر...\n"
-        f"این ممکنه چند دقیقه طول بکشه ⏳"
+    status_message = await update.message.reply_text(
+        BROADCAST_QUEUED.format(total=format_number(job['total']))
     )
-
-    # Send to all
-    success = 0
-    failed = 0
-
-    for user in target_users:
-        try:
-            await context.bot.send_message(
-                chat_id=int(user['user_id']),
-                text=f"📢 **پیام از ادمین:**\n\n{message_text}",
-                parse_mode=ParseMode.MARKDOWN
-            )
-            success += 1
-            await asyncio.sleep(0.1)  # Avoid rate limits
-        except Exception as e:
-            failed += 1
-            logger.error(f"Failed to send broadcast to {user['user_id']}: {e}")
-
-    await update.message.reply_text(
-        f"✅ ارسال تموم شد!\n\n"
-        f"موفق: {success}\n"
-        f"ناموفق: {failed}"
+    db.update_broadcast(
+        job['id'],
+        status_chat_id=status_message.chat_id,
+        status_message_id=status_message.message_id,
     )
 
+    broadcaster.submit(context.application, job['id'])
+
     return ConversationHandler.END
 
 
@@ -957,28 +949,7 @@ async def admin_delete_playlist(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("پلی‌لیست پیدا نشد!")
         return
 
-    deleted_messages = db.delete_playlist(playlist_id)
-
-    for channel_id, message_id in deleted_messages:
-        try:
-            await context.bot.delete_message(
-                chat_id=channel_id,
-                message_id=message_id,
-            )
-        except BadRequest as exc:
-            logger.warning(
-                "BadRequest while deleting storage message %s from channel %s: %s",
-                message_id,
-                channel_id,
-                exc,
-            )
-        except Exception as exc:
-            logger.error(
-                "Failed to delete storage message %s from channel %s: %s",
-                message_id,
-                channel_id,
-                exc,
-            )
+    storage_gc.enqueue(db.delete_playlist(playlist_id))
 
     await update.message.reply_text(
         f"✅ پلی‌لیست حذف شد!\n\n"
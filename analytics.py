@@ -0,0 +1,465 @@
+# analytics.py - Offloaded Aggregate Queries
+# محاسبات سنگین آماری در پروسس جداگانه
+
+import asyncio
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache import CATALOG, PLAYLISTS, USERS, caches
+from config import *
+from ledger import ledger
+
+
+# ===== SNAPSHOT EXPORT =====
+
+USER_COLUMNS = (
+    'user_id',
+    'first_name',
+    'username',
+    'banned',
+    'premium',
+    'premium_until',
+    'likes',
+    'plays',
+    'songs',
+    'playlists',
+    'followers',
+    'join_date',
+    'last_seen',
+)
+
+PLAYLIST_COLUMNS = (
+    'id',
+    'name_lower',
+    'status',
+    'is_private',
+    'mood',
+    'created_at',
+    'plays',
+    'likes',
+)
+
+
+def build_playlist_columns(data: Dict) -> Dict[str, List]:
+    """Export only the playlist columns (enough for trending and search)"""
+    playlists = {column: [] for column in PLAYLIST_COLUMNS}
+
+    for playlist_id, playlist in data.get('playlists', {}).items():
+        playlists['id'].append(playlist_id)
+        playlists['name_lower'].append((playlist.get('name') or '').lower())
+        playlists['status'].append(playlist.get('status'))
+        playlists['is_private'].append(bool(playlist.get('is_private')))
+        playlists['mood'].append(playlist.get('mood'))
+        playlists['created_at'].append(playlist.get('created_at'))
+        playlists['plays'].append(playlist.get('plays', 0))
+        playlists['likes'].append(len(playlist.get('likes', [])))
+
+    return playlists
+
+
+def build_snapshot(data: Dict) -> Dict[str, Any]:
+    """Export database content into read-only columnar lists"""
+    users = {column: [] for column in USER_COLUMNS}
+
+    for user_id, user in data.get('users', {}).items():
+        users['user_id'].append(user_id)
+        users['first_name'].append(user.get('first_name') or '')
+        users['username'].append(user.get('username') or '')
+        users['banned'].append(bool(user.get('banned')))
+        users['premium'].append(bool(user.get('premium')))
+        users['premium_until'].append(user.get('premium_until'))
+        users['likes'].append(user.get('total_likes_received', 0))
+        users['plays'].append(user.get('total_plays', 0))
+        users['songs'].append(user.get('total_songs_uploaded', 0))
+        users['playlists'].append(len(user.get('playlists', [])))
+        users['followers'].append(len(user.get('followers', [])))
+        users['join_date'].append(user.get('join_date'))
+        users['last_seen'].append(user.get('last_seen'))
+
+    stats = data.get('stats', {})
+
+    return {
+        'users': users,
+        'playlists': build_playlist_columns(data),
+        'total_songs': len(data.get('songs', {})),
+        'total_likes': stats.get('total_likes', 0),
+        'total_plays': stats.get('total_plays', 0),
+        'exported_at': datetime.now().isoformat(),
+    }
+
+
+# ===== AGGREGATIONS =====
+# These run both in-process (Database wrappers) and inside pool workers,
+# so they only ever touch the columnar snapshot.
+
+def _score(likes: int, plays: int, songs: int) -> int:
+    """Weighted score, mirrors utils.calculate_score"""
+    return (likes * 10) + (plays * 2) + songs
+
+
+def compute_leaderboard(snapshot: Dict, sort_by: str = 'likes', limit: Optional[int] = 20) -> List[Dict]:
+    """Rank users from snapshot columns"""
+    cols = snapshot['users']
+    rows: List[Tuple[tuple, Dict]] = []
+
+    for index, user_id in enumerate(cols['user_id']):
+        if cols['banned'][index]:
+            continue
+
+        likes = cols['likes'][index]
+        plays = cols['plays'][index]
+        songs = cols['songs'][index]
+        followers_count = cols['followers'][index]
+        join_date_raw = cols['join_date'][index]
+
+        try:
+            join_timestamp = datetime.fromisoformat(join_date_raw).timestamp() if join_date_raw else float('inf')
+        except Exception:
+            join_timestamp = float('inf')
+
+        composite_score = _score(likes, plays, songs)
+
+        if sort_by == 'likes':
+            primary_metric = likes
+        elif sort_by == 'plays':
+            primary_metric = plays
+        elif sort_by == 'songs':
+            primary_metric = songs
+        else:
+            primary_metric = composite_score
+
+        first_name = cols['first_name'][index]
+        username = cols['username'][index]
+
+        if first_name and first_name.lower() != 'unknown':
+            display_name = first_name
+        elif username:
+            display_name = f"@{username}"
+        else:
+            display_name = f"کاربر {user_id[-4:]}"
+
+        sort_key = (
+            -primary_metric,
+            -composite_score,
+            -likes,
+            -plays,
+            -songs,
+            -followers_count,
+            join_timestamp,
+        )
+
+        rows.append((sort_key, {
+            'user_id': user_id,
+            'name': display_name,
+            'username': username,
+            'score': composite_score,
+            'likes': likes,
+            'plays': plays,
+            'songs': songs,
+            'playlists': cols['playlists'][index],
+            'followers': followers_count,
+            'is_premium': cols['premium'][index],
+        }))
+
+    rows.sort(key=lambda row: row[0])
+    users = [entry for _, entry in rows]
+
+    if limit is None or limit <= 0:
+        return users
+
+    return users[:limit]
+
+
+def compute_global_stats(snapshot: Dict, now: Optional[datetime] = None) -> Dict:
+    """Compute admin dashboard stats, plus ids whose premium has expired"""
+    now = now or datetime.now()
+    users = snapshot['users']
+    playlists = snapshot['playlists']
+
+    total_playlists = sum(1 for status in playlists['status'] if status == 'published')
+    total_users = len(users['user_id'])
+    banned_users = sum(1 for banned in users['banned'] if banned)
+    active_users = total_users - banned_users
+
+    today = now.date()
+    seven_days_ago = today - timedelta(days=6)
+
+    new_today = 0
+    new_last_week = 0
+    active_today = 0
+    premium_users = 0
+    expired_premium_ids: List[str] = []
+
+    for index, user_id in enumerate(users['user_id']):
+        if users['banned'][index]:
+            continue
+
+        join_date_raw = users['join_date'][index]
+        last_seen_raw = users['last_seen'][index]
+
+        try:
+            join_date = datetime.fromisoformat(join_date_raw).date() if join_date_raw else None
+        except Exception:
+            join_date = None
+
+        try:
+            last_seen = datetime.fromisoformat(last_seen_raw).date() if last_seen_raw else None
+        except Exception:
+            last_seen = None
+
+        if join_date:
+            if join_date == today:
+                new_today += 1
+            if join_date >= seven_days_ago:
+                new_last_week += 1
+
+        if last_seen and last_seen == today:
+            active_today += 1
+
+        if users['premium'][index]:
+            premium_until_raw = users['premium_until'][index]
+            has_active_premium = True
+
+            if premium_until_raw:
+                try:
+                    expiry = datetime.fromisoformat(premium_until_raw)
+                    if now > expiry:
+                        has_active_premium = False
+                except Exception:
+                    has_active_premium = False
+
+            if has_active_premium:
+                premium_users += 1
+            else:
+                expired_premium_ids.append(user_id)
+
+    return {
+        'total_users': total_users,
+        'active_users': active_users,
+        'banned_users': banned_users,
+        'active_today': active_today,
+        'new_today': new_today,
+        'new_last_week': new_last_week,
+        'total_playlists': total_playlists,
+        'total_songs': snapshot['total_songs'],
+        'total_likes': snapshot['total_likes'],
+        'total_plays': snapshot['total_plays'],
+        'premium_users': premium_users,
+        'premium_ratio': (premium_users / active_users) if active_users else 0,
+        'expired_premium_ids': expired_premium_ids,
+    }
+
+
+def _public_playlist_indexes(playlists: Dict) -> List[int]:
+    """Indexes of published, non-private playlists in snapshot order"""
+    return [
+        index
+        for index, status in enumerate(playlists['status'])
+        if status == 'published' and not playlists['is_private'][index]
+    ]
+
+
+def compute_trending(snapshot: Dict, days: int = 7, limit: int = 20, now: Optional[datetime] = None) -> List[str]:
+    """Return ids of the most played playlists created in the last days"""
+    playlists = snapshot['playlists']
+    cutoff = (now or datetime.now()) - timedelta(days=days)
+    candidates = []
+
+    for index in _public_playlist_indexes(playlists):
+        if datetime.fromisoformat(playlists['created_at'][index]) > cutoff:
+            candidates.append(index)
+
+    candidates.sort(key=lambda i: playlists['plays'][i], reverse=True)
+    return [playlists['id'][i] for i in candidates[:limit]]
+
+
+def compute_search(snapshot: Dict, query: str) -> List[str]:
+    """Return ids of public playlists whose name contains query"""
+    playlists = snapshot['playlists']
+    query = query.lower()
+    return [
+        playlists['id'][index]
+        for index in _public_playlist_indexes(playlists)
+        if query in playlists['name_lower'][index]
+    ]
+
+
+# ===== WORKER SIDE =====
+
+_worker_snapshot: Optional[Dict] = None
+_worker_version: Optional[int] = None
+
+
+def _load_snapshot(path: str, version: int) -> Dict:
+    """Load exported snapshot once per version inside a worker"""
+    global _worker_snapshot, _worker_version
+
+    if _worker_snapshot is None or _worker_version != version:
+        with open(path, 'rb') as f:
+            _worker_snapshot = pickle.load(f)
+        _worker_version = version
+
+    return _worker_snapshot
+
+
+def _leaderboard_task(path: str, version: int, sort_by: str, limit: Optional[int]) -> List[Dict]:
+    return compute_leaderboard(_load_snapshot(path, version), sort_by=sort_by, limit=limit)
+
+
+def _global_stats_task(path: str, version: int, now_iso: str) -> Dict:
+    return compute_global_stats(_load_snapshot(path, version), now=datetime.fromisoformat(now_iso))
+
+
+def _trending_task(path: str, version: int, days: int, limit: int, now_iso: str) -> List[str]:
+    return compute_trending(
+        _load_snapshot(path, version),
+        days=days,
+        limit=limit,
+        now=datetime.fromisoformat(now_iso),
+    )
+
+
+def _search_task(path: str, version: int, query: str) -> List[str]:
+    return compute_search(_load_snapshot(path, version), query)
+
+
+# ===== POOL =====
+
+class AnalyticsPool:
+    """Run aggregate queries in a process pool against an exported snapshot"""
+
+    def __init__(
+        self,
+        database,
+        snapshot_path: str = ANALYTICS_SNAPSHOT_PATH,
+        workers: int = ANALYTICS_WORKERS,
+        max_age: float = ANALYTICS_SNAPSHOT_INTERVAL,
+    ):
+        self.db = database
+        self.snapshot_path = snapshot_path
+        self.workers = workers
+        self.max_age = max_age
+        self.version = 0
+        self._exported_at = 0.0
+        self._data_versions: Dict[str, int] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._export_lock: Optional[asyncio.Lock] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    @staticmethod
+    def _write_snapshot(path: str, snapshot: Dict):
+        """Atomically write snapshot so workers never read a partial file"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    async def export_snapshot(self, depends: Optional[Tuple[str, ...]] = None):
+        """Build columns on the event loop, write them from a thread
+
+        With `depends`, only export if the snapshot is stale for them.
+        """
+        if self._export_lock is None:
+            self._export_lock = asyncio.Lock()
+
+        async with self._export_lock:
+            if depends is not None and not self._is_stale(depends):
+                # Another query re-exported while this one waited
+                return
+
+            data_versions = {namespace: caches.version(namespace) for namespace in (CATALOG, PLAYLISTS, USERS)}
+            snapshot = build_snapshot(self.db.data)
+            await asyncio.to_thread(self._write_snapshot, self.snapshot_path, snapshot)
+            self.version += 1
+            self._exported_at = time.monotonic()
+            self._data_versions = data_versions
+
+    def _is_stale(self, depends: Tuple[str, ...]) -> bool:
+        # The repeating job normally keeps the snapshot fresh; this covers
+        # startup and deployments without the job-queue extra.
+        if not self.version or time.monotonic() - self._exported_at > self.max_age * 2:
+            return True
+        return any(caches.version(namespace) != self._data_versions.get(namespace) for namespace in depends)
+
+    async def _run(self, func, *args, depends: Tuple[str, ...] = ()):
+        # Queries listing `depends` re-export after those namespaces change,
+        # e.g. search must find a playlist published a moment ago; play and
+        # like counts may lag until the next scheduled export
+        if self._is_stale(depends):
+            await self.export_snapshot(depends)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(),
+            func,
+            self.snapshot_path,
+            self.version,
+            *args,
+        )
+
+    async def _ranking(self, sort_by: str) -> List[Dict]:
+        """Full ranking, computed off the event loop once per snapshot version"""
+        if self._is_stale(()):
+            await self.export_snapshot(())
+
+        cache = caches.get('leaderboard', maxsize=LEADERBOARD_CACHE_SIZE)
+        versions = (self.version,)
+        ranking = cache.get(sort_by, versions)
+        if ranking is None:
+            ranking = await self._run(_leaderboard_task, sort_by, 0)
+            cache.set(sort_by, ranking, versions)
+        return ranking
+
+    async def get_leaderboard(self, sort_by: str = 'likes', limit: Optional[int] = 20) -> List[Dict]:
+        """Leaderboard entries (all of them if `limit` is 0 or None)"""
+        ranking = await self._ranking(sort_by)
+        return list(ranking) if not limit or limit <= 0 else ranking[:limit]
+
+    async def get_user_rank(self, user_id: int, sort_by: str = 'likes') -> int:
+        """1-based leaderboard position of user (0 if unranked)"""
+        user_id = str(user_id)
+        for i, entry in enumerate(await self._ranking(sort_by), 1):
+            if entry['user_id'] == user_id:
+                return i
+        return 0
+
+    async def get_global_stats(self) -> Dict:
+        """Admin stats; expired premium flags are applied back on the loop, revenue comes from the ledger"""
+        stats = await self._run(_global_stats_task, datetime.now().isoformat())
+        self.db.expire_premium_users(stats.pop('expired_premium_ids', []))
+        stats.update(ledger.summary())
+        return stats
+
+    def _resolve_playlists(self, playlist_ids: List[str]) -> List[Dict]:
+        """Map snapshot ids to live playlists, dropping ones gone stale"""
+        playlists = []
+        for playlist_id in playlist_ids:
+            playlist = self.db.get_playlist(playlist_id)
+            if not playlist or playlist.get('is_private') or playlist.get('status') != 'published':
+                continue
+            playlists.append(playlist)
+        return playlists
+
+    async def get_trending_playlists(self, days: int = 7, limit: int = 20) -> List[Dict]:
+        """Trending playlists, computed off the event loop"""
+        ids = await self._run(_trending_task, days, limit, datetime.now().isoformat(), depends=(CATALOG,))
+        return self._resolve_playlists(ids)
+
+    async def search_playlists(self, query: str) -> List[Dict]:
+        """Full-catalog search, computed off the event loop"""
+        ids = await self._run(_search_task, query, depends=(CATALOG,))
+        return self._resolve_playlists(ids)
+
+    def shutdown(self):
+        """Stop worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,146 @@
+# bench_rendering.py - Message Rendering Benchmark
+# مقایسه‌ی سرعت ساخت پیام‌ها با روش قبلی
+#
+#   python bench_rendering.py --number 2000
+#
+# Renders a 10-item browse screen and a 100-song playlist summary with the
+# old per-character str.replace escaping and f-string concatenation, then
+# with rendering.py's escaping and precompiled templates, and checks both
+# produce the same text.
+
+import argparse
+import timeit
+
+from rendering import Template, escape_markdown
+from texts import (
+    BROWSE_ROW,
+    PLAYLIST_NO_SONGS,
+    PLAYLIST_SONG_LINE,
+    PLAYLIST_SONG_LINE_PERFORMER,
+    PLAYLIST_SUMMARY,
+    TOP_PLAYLISTS_HEADER,
+)
+
+
+def legacy_escape_markdown(text: str) -> str:
+    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
+    for char in special_chars:
+        text = text.replace(char, f'\\{char}')
+    return text
+
+
+def sample_playlists(count: int = 10):
+    names = ["آهنگای شب", "Chill vibes", "My Playlist - vol.2", "رانندگی تو جاده", "Lo-fi (study)"]
+    owners = ["علی", "Sara_M", "مهسا", "reza.k", "نگار"]
+    return [
+        {
+            'name': names[i % len(names)],
+            'owner_name': owners[i % len(owners)],
+            'likes': list(range(i * 7)),
+            'plays': i * 31,
+        }
+        for i in range(count)
+    ]
+
+
+def sample_songs(count: int = 100):
+    titles = ["دلتنگی", "Shape of You", "Bohemian Rhapsody (Remastered 2011)", "گل گندم", "Track_07"]
+    performers = ["محسن چاوشی", "Ed Sheeran", "Queen", "Unknown", "گوگوش"]
+    return [
+        {
+            'title': titles[i % len(titles)],
+            'performer': performers[i % len(performers)],
+            'duration': f"{3 + i % 4}:{i % 60:02d}",
+        }
+        for i in range(count)
+    ]
+
+
+def legacy_browse(playlists) -> str:
+    message = TOP_PLAYLISTS_HEADER
+    for i, pl in enumerate(playlists, 1):
+        name = legacy_escape_markdown(pl['name'])
+        owner = legacy_escape_markdown(pl['owner_name'])
+        message += f"{i}. **{name}** by {owner}\n"
+        message += f"   ❤️ {len(pl['likes'])} | ▶️ {pl['plays']}\n\n"
+    return message
+
+
+BROWSE_ROW_TEMPLATE = Template(BROWSE_ROW, raw=('icon', 'plays', 'likes'))
+
+
+def template_browse(playlists) -> str:
+    lines = [TOP_PLAYLISTS_HEADER]
+    for i, pl in enumerate(playlists, 1):
+        lines.append(BROWSE_ROW_TEMPLATE.render(
+            icon=f"{i}.", name=pl['name'], owner=pl['owner_name'], likes=len(pl['likes']), plays=pl['plays'],
+        ))
+    return "".join(lines)
+
+
+def legacy_summary(name: str, mood: str, songs) -> str:
+    lines = []
+    for index, song in enumerate(songs, 1):
+        title_md = legacy_escape_markdown(str(song['title']))
+        performer = song['performer']
+        performer_md = legacy_escape_markdown(str(performer)) if performer.lower() != 'unknown' else ''
+        if performer_md:
+            lines.append(f"{index}. {title_md} — {performer_md} ({song['duration']})")
+        else:
+            lines.append(f"{index}. {title_md} ({song['duration']})")
+
+    songs_text = "\n".join(lines) if lines else PLAYLIST_NO_SONGS
+    return (
+        f"🎧 **{legacy_escape_markdown(name)}**\n"
+        f"📂 دسته‌بندی: {legacy_escape_markdown(mood)}\n"
+        f"🎵 تعداد آهنگ‌ها: {len(songs)}\n\n"
+        f"{songs_text}"
+    )
+
+
+SUMMARY_TEMPLATE = Template(PLAYLIST_SUMMARY, raw=('count', 'songs'))
+SONG_LINE_TEMPLATE = Template(PLAYLIST_SONG_LINE, raw=('index', 'duration'))
+SONG_LINE_PERFORMER_TEMPLATE = Template(PLAYLIST_SONG_LINE_PERFORMER, raw=('index', 'duration'))
+
+
+def template_summary(name: str, mood: str, songs) -> str:
+    lines = []
+    for index, song in enumerate(songs, 1):
+        if song['performer'].lower() != 'unknown':
+            lines.append(SONG_LINE_PERFORMER_TEMPLATE.render(
+                index=index, title=song['title'], performer=song['performer'], duration=song['duration'],
+            ))
+        else:
+            lines.append(SONG_LINE_TEMPLATE.render(index=index, title=song['title'], duration=song['duration']))
+
+    return SUMMARY_TEMPLATE.render(
+        name=name, mood=mood, count=len(songs), songs="\n".join(lines) if lines else PLAYLIST_NO_SONGS,
+    )
+
+
+def bench(label: str, legacy, current, number: int):
+    assert legacy() == current(), f"{label}: output differs"
+    old = min(timeit.repeat(legacy, number=number, repeat=5)) / number * 1e6
+    new = min(timeit.repeat(current, number=number, repeat=5)) / number * 1e6
+    print(f"{label:<28} legacy {old:8.1f} µs   templates {new:8.1f} µs   x{old / new:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message rendering")
+    parser.add_argument('--number', type=int, default=2000, help="renders per timing run")
+    args = parser.parse_args()
+
+    playlists = sample_playlists(10)
+    songs = sample_songs(100)
+    names = [pl['name'] for pl in playlists] + [song['title'] for song in songs]
+
+    bench("escape 110 names", lambda: [legacy_escape_markdown(n) for n in names],
+          lambda: [escape_markdown(n) for n in names], args.number)
+    bench("browse screen (10 items)", lambda: legacy_browse(playlists),
+          lambda: template_browse(playlists), args.number)
+    bench("playlist summary (100 songs)", lambda: legacy_summary("My Playlist - vol.2", "😌 آرام", songs),
+          lambda: template_summary("My Playlist - vol.2", "😌 آرام", songs), args.number)
+
+
+if __name__ == '__main__':
+    main()
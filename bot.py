@@ -1,11 +1,13 @@
 # bot.py - Main Bot File
 # فایل اصلی ربات
 
+import functools
+import inspect
 import logging
-from datetime import datetime, time as datetime_time
-from typing import Dict, Optional
+from datetime import datetime, time as datetime_time, timedelta
+from typing import Dict, List, Optional, Tuple
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaAudio
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -19,11 +21,24 @@ from telegram.constants import ParseMode
 from telegram.error import BadRequest
 import asyncio
 
+from cache import CATALOG, caches
 from config import *
-from database import db
+from database import db, analytics
+from ratelimit import LANE_BULK, LANE_NOTIFICATION, SendScheduler
 from utils import *
 from texts import *
+from broadcasts import broadcaster, fan_out, send_with_retry
+from ledger import ledger
+from outbox import outbox
+from payments import zarinpal
+from rendering import Template
+from router import CallbackRouter
+from storage_gc import storage_gc
+from update_processor import KeyedUpdateProcessor
+from uploads import UploadBatcher
+from webserver import run_webhook
 from admin import (
+    BROADCAST_MESSAGE,
     GIVE_PREMIUM_ID,
     GIVE_PREMIUM_DAYS,
     ADD_PLAN_TITLE,
@@ -50,6 +65,9 @@ from admin import (
     admin_plan_delete_confirm,
     admin_stats_callback,
     admin_settings_callback,
+    admin_broadcast_start,
+    admin_broadcast_type,
+    admin_broadcast_send,
     admin_add_mood_start,
     admin_add_mood_save,
     admin_delete_mood_start,
@@ -240,28 +258,48 @@ async def send_response(
         )
 
 
-async def send_notification(user_id: int, message: str, context: ContextTypes.DEFAULT_TYPE):
-    """Send notification to user"""
+def send_notification(user_id: int, message: str):
+    """Queue notification for user; the outbox worker delivers it"""
     if should_send_notification(user_id, db):
-        try:
-            await context.bot.send_message(chat_id=user_id, text=message, parse_mode=ParseMode.MARKDOWN)
-            await asyncio.sleep(NOTIFICATION_DELAY)
-        except Exception as e:
-            logger.error(f"Failed to send notification to {user_id}: {e}")
+        outbox.enqueue(user_id, message)
 
 
-async def send_playlist_details(
-    user_id: int,
-    playlist: dict,
-    context: ContextTypes.DEFAULT_TYPE,
-    playlist_id: Optional[str] = None,
-):
-    """Send playlist summary and songs to a user"""
-    playlist_identifier = playlist_id or playlist.get('id')
+def send_activity_notification(user_id: int, key: str, single: str, many: str, **params):
+    """Queue a like/add notification, coalesced with others for the same item"""
+    if should_send_notification(user_id, db):
+        user = db.get_user(user_id)
+        outbox.enqueue_grouped(
+            user_id,
+            key,
+            single,
+            many,
+            params,
+            digest=user.get('notification_digest', False),
+        )
+
+
+# Message templates rendered in loops, parsed once
+PLAYLIST_SUMMARY_TEMPLATE = Template(PLAYLIST_SUMMARY, raw=('count', 'songs'))
+SONG_LINE_TEMPLATE = Template(PLAYLIST_SONG_LINE, raw=('index', 'duration'))
+SONG_LINE_PERFORMER_TEMPLATE = Template(PLAYLIST_SONG_LINE_PERFORMER, raw=('index', 'duration'))
+BROWSE_ROW_PLAYS_FIRST_TEMPLATE = Template(BROWSE_ROW_PLAYS_FIRST, raw=('icon', 'plays', 'likes'))
+BROWSE_ROW_TEMPLATE = Template(BROWSE_ROW, raw=('icon', 'plays', 'likes'))
+BROWSE_ROW_DATED_TEMPLATE = Template(BROWSE_ROW_DATED, raw=('icon', 'plays', 'likes', 'created'))
+MOOD_PLAYLISTS_HEADER_TEMPLATE = Template(MOOD_PLAYLISTS_HEADER, raw=('mood',))
+SEARCH_RESULTS_HEADER_TEMPLATE = Template(SEARCH_RESULTS_HEADER)
+ADDED_PLAYLISTS_ITEM_TEMPLATE = Template(ADDED_PLAYLISTS_ITEM, raw=('index', 'likes', 'songs'))
+LEADERBOARD_ITEM_TEMPLATE = Template(
+    LEADERBOARD_ITEM,
+    raw=('rank', 'premium', 'likes', 'plays', 'songs', 'playlists', 'score'),
+)
+
 
+def build_playlist_render(playlist: dict) -> Tuple[str, Dict[str, str]]:
+    """Viewer-independent parts of a playlist: summary text and song captions"""
     mood_label = get_mood_label(playlist.get('mood'))
 
     songs_info_lines = []
+    song_captions = {}
 
     for index, song_id in enumerate(playlist.get('songs', []), 1):
         song = db.data['songs'].get(song_id)
@@ -272,15 +310,48 @@ async def send_playlist_details(
         performer = song.get('performer') or ''
         duration = format_duration(song.get('duration', 0))
 
-        title_md = escape_markdown(str(title))
-        performer_md = escape_markdown(str(performer)) if performer and performer.lower() != 'unknown' else ''
-
-        if performer_md:
-            songs_info_lines.append(f"{index}. {title_md} — {performer_md} ({duration})")
+        if performer and str(performer).lower() != 'unknown':
+            songs_info_lines.append(
+                SONG_LINE_PERFORMER_TEMPLATE.render(index=index, title=title, performer=performer, duration=duration)
+            )
         else:
-            songs_info_lines.append(f"{index}. {title_md} ({duration})")
+            songs_info_lines.append(SONG_LINE_TEMPLATE.render(index=index, title=title, duration=duration))
+
+        song_captions[song_id] = get_song_info(song)
+
+    summary_text = PLAYLIST_SUMMARY_TEMPLATE.render(
+        name=playlist['name'],
+        mood=mood_label,
+        count=len(playlist.get('songs', [])),
+        songs="\n".join(songs_info_lines) if songs_info_lines else PLAYLIST_NO_SONGS,
+    )
+    return summary_text, song_captions
+
 
-    songs_text = "\n".join(songs_info_lines) if songs_info_lines else "هیچ آهنگی برای نمایش موجود نیست."
+def render_playlist(playlist: dict, playlist_id: Optional[str]) -> Tuple[str, Dict[str, str]]:
+    """build_playlist_render, cached per playlist version"""
+    if not playlist_id:
+        return build_playlist_render(playlist)
+
+    cache = caches.get('playlist_renders', maxsize=PLAYLIST_RENDER_CACHE_SIZE)
+    versions = (playlist.get('version', 0),)
+
+    rendered = cache.get(playlist_id, versions)
+    if rendered is None:
+        rendered = build_playlist_render(playlist)
+        cache.set(playlist_id, rendered, versions)
+    return rendered
+
+
+async def send_playlist_details(
+    user_id: int,
+    playlist: dict,
+    context: ContextTypes.DEFAULT_TYPE,
+    playlist_id: Optional[str] = None,
+):
+    """Send playlist summary and songs to a user"""
+    playlist_identifier = playlist_id or playlist.get('id')
+    playlist_summary, song_captions = render_playlist(playlist, playlist_identifier)
 
     is_owner = playlist.get('owner_id') == str(user_id)
     max_songs = playlist.get('max_songs', 0) or 0
@@ -307,13 +378,6 @@ async def send_playlist_details(
         else:
             owner_lines.append(PLAYLIST_OWNER_ADD_HINT)
 
-    playlist_summary = (
-        f"🎧 **{escape_markdown(playlist['name'])}**\n"
-        f"📂 دسته‌بندی: {escape_markdown(mood_label)}\n"
-        f"🎵 تعداد آهنگ‌ها: {len(playlist.get('songs', []))}\n\n"
-        f"{songs_text}"
-    )
-
     if owner_lines:
         playlist_summary += "\n\n" + "\n".join(owner_lines)
 
@@ -337,76 +401,352 @@ async def send_playlist_details(
 
     if playlist.get('songs') and playlist_identifier:
         db.increment_plays(playlist_identifier)
+        send_playlist_page(user_id, playlist, playlist_identifier, 0, context, song_captions)
+
+
+def playback_positions():
+    """(user_id, playlist_id) -> index of the next song to send"""
+    return caches.get('playback_positions', maxsize=PLAYBACK_POSITION_CACHE_SIZE, ttl=PLAYBACK_POSITION_TTL)
+
+
+def send_playlist_page(
+    user_id: int,
+    playlist: dict,
+    playlist_id: str,
+    offset: int,
+    context: ContextTypes.DEFAULT_TYPE,
+    song_captions: Optional[Dict[str, str]] = None,
+):
+    """Queue one page of songs from `offset`, then a "more" button if songs remain"""
+    if song_captions is None:
+        song_captions = render_playlist(playlist, playlist_id)[1]
+
+    song_ids = list(playlist.get('songs', []))
+    end = offset + PLAYBACK_PAGE_SIZE if PLAYBACK_PAGE_SIZE > 0 else len(song_ids)
+    page = song_ids[offset:end]
+    is_owner = playlist.get('owner_id') == str(user_id)
+
+    button_states = db.get_song_button_states(user_id, page)
+    deliveries = []
+
+    for song_id in page:
+        song = db.data['songs'].get(song_id)
+        state = button_states.get(song_id)
+        if not song or not state:
+            continue
+
+        deliveries.append((
+            song,
+            song_captions.get(song_id) or get_song_info(song),
+            create_song_buttons(
+                song_id,
+                playlist_id,
+                can_remove=is_owner,
+                **state,
+            ),
+        ))
+
+    # Larger playlists go out as albums with one shared keyboard
+    album_playlist_id = None
+    if PLAYBACK_ALBUM_MIN_SONGS and len(song_ids) >= PLAYBACK_ALBUM_MIN_SONGS:
+        album_playlist_id = playlist_id
+
+    more_prompt = None
+    key = (user_id, playlist_id)
+    if end < len(song_ids):
+        playback_positions().set(key, end)
+        next_count = min(PLAYBACK_PAGE_SIZE, len(song_ids) - end)
+        more_prompt = (
+            PLAYBACK_MORE.format(sent=format_number(end), total=format_number(len(song_ids))),
+            InlineKeyboardMarkup([[
+                InlineKeyboardButton(
+                    BTN_PLAYBACK_MORE.format(count=format_number(next_count)),
+                    callback_data=f"play_more:{playlist_id}",
+                )
+            ]]),
+        )
+    else:
+        playback_positions().delete(key)
+
+    # A new play replaces whatever is still being delivered to this chat
+    previous = _playback_tasks.pop(user_id, None)
+    if previous and not previous.done():
+        previous.cancel()
+
+    task = context.application.create_task(
+        deliver_playlist_songs(user_id, deliveries, context, more_prompt, album_playlist_id),
+        name=f"playback:{user_id}:{playlist_id}",
+    )
+    _playback_tasks[user_id] = task
+    task.add_done_callback(functools.partial(_forget_playback_task, user_id))
+
+
+# Background playback deliveries, keyed by chat id
+_playback_tasks: Dict[int, asyncio.Task] = {}
+
 
-        for song_id in playlist['songs']:
-            song = db.data['songs'].get(song_id)
-            if not song:
-                continue
+def _forget_playback_task(chat_id: int, task: asyncio.Task):
+    """Drop a finished playback task unless a newer play replaced it"""
+    if _playback_tasks.get(chat_id) is task:
+        _playback_tasks.pop(chat_id, None)
 
-            caption = get_song_info(song)
-            original_id = song.get('original_song_id', song_id)
-            user_liked = str(user_id) in song.get('likes', [])
-            already_added = db.user_has_song_copy(user_id, original_id)
-            like_count = len(song.get('likes', []))
-            add_count = db.count_song_adds(original_id)
-            can_remove = is_owner
 
+async def deliver_playlist_songs(
+    user_id: int,
+    deliveries: List[Tuple[dict, str, InlineKeyboardMarkup]],
+    context: ContextTypes.DEFAULT_TYPE,
+    more_prompt: Optional[Tuple[str, InlineKeyboardMarkup]] = None,
+    album_playlist_id: Optional[str] = None,
+):
+    """Send prepared songs in order, then `more_prompt` if given
+
+    With `album_playlist_id`, songs with a file_id are grouped into albums
+    of up to PLAYBACK_ALBUM_SIZE, each followed by one keyboard for all of
+    its songs. Uploads record file_id (store_uploads); songs saved before
+    that have none and are still copied one by one. Pacing comes from the
+    bot's SendScheduler.
+    """
+    album_size = min(PLAYBACK_ALBUM_SIZE, 10) if album_playlist_id else 1
+
+    for batch in song_batches(deliveries, album_size):
+        if len(batch) > 1 and await send_song_album(user_id, album_playlist_id, batch, context):
+            continue
+
+        for song, caption, reply_markup in batch:
             try:
-                channel_message_id = song.get('channel_message_id')
-                storage_channel_id = song.get('storage_channel_id', STORAGE_CHANNEL_ID)
-                if channel_message_id and storage_channel_id:
-                    await context.bot.copy_message(
-                        chat_id=user_id,
-                        from_chat_id=storage_channel_id,
-                        message_id=channel_message_id,
-                        caption=caption,
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup=create_song_buttons(
-                            song_id,
-                            playlist_identifier,
-                            user_liked=user_liked,
-                            already_added=already_added,
-                            like_count=like_count,
-                            add_count=add_count,
-                            can_remove=can_remove,
-                        ),
-                    )
-                elif song.get('file_id'):
-                    await context.bot.send_audio(
-                        chat_id=user_id,
-                        audio=song['file_id'],
-                        caption=caption,
-                        parse_mode=ParseMode.MARKDOWN,
-                        reply_markup=create_song_buttons(
-                            song_id,
-                            playlist_identifier,
-                            user_liked=user_liked,
-                            already_added=already_added,
-                            like_count=like_count,
-                            add_count=add_count,
-                            can_remove=can_remove,
-                        ),
-                    )
-                else:
-                    raise ValueError('Missing song storage reference')
-
-                await asyncio.sleep(0.5)
+                await send_playlist_song(user_id, song, caption, reply_markup, context)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error(f"Failed to send audio: {e}")
 
+    if more_prompt:
+        text, reply_markup = more_prompt
+        try:
+            await context.bot.send_message(chat_id=user_id, text=text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Failed to send playback prompt: {e}")
+
+
+def song_batches(deliveries: list, size: int):
+    """Split deliveries into runs of up to `size` songs that have a file_id"""
+    batch = []
+    for delivery in deliveries:
+        if size > 1 and delivery[0].get('file_id'):
+            batch.append(delivery)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+            continue
+
+        if batch:
+            yield batch
+            batch = []
+        yield [delivery]
+
+    if batch:
+        yield batch
+
+
+async def send_playlist_song(
+    user_id: int,
+    song: dict,
+    caption: str,
+    reply_markup: InlineKeyboardMarkup,
+    context: ContextTypes.DEFAULT_TYPE,
+):
+    """Send one song with its own buttons, copied from the storage channel if possible"""
+    channel_message_id = song.get('channel_message_id')
+    storage_channel_id = song.get('storage_channel_id', STORAGE_CHANNEL_ID)
+
+    if channel_message_id and storage_channel_id:
+        await context.bot.copy_message(
+            chat_id=user_id,
+            from_chat_id=storage_channel_id,
+            message_id=channel_message_id,
+            caption=caption,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=reply_markup,
+        )
+    elif song.get('file_id'):
+        await context.bot.send_audio(
+            chat_id=user_id,
+            audio=song['file_id'],
+            caption=caption,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=reply_markup,
+        )
+    else:
+        raise ValueError('Missing song storage reference')
+
+
+async def send_song_album(
+    user_id: int,
+    playlist_id: str,
+    batch: List[Tuple[dict, str, InlineKeyboardMarkup]],
+    context: ContextTypes.DEFAULT_TYPE,
+) -> bool:
+    """Send songs as one media group plus their shared keyboard; False if the group failed"""
+    try:
+        await context.bot.send_media_group(
+            chat_id=user_id,
+            media=[
+                InputMediaAudio(song['file_id'], caption=caption, parse_mode=ParseMode.MARKDOWN)
+                for song, caption, _ in batch
+            ],
+        )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"Failed to send album, sending songs one by one: {e}")
+        return False
+
+    group = build_song_group(user_id, playlist_id, [song['id'] for song, _, _ in batch])
+    if group:
+        text, reply_markup = group
+        try:
+            await context.bot.send_message(chat_id=user_id, text=text, reply_markup=reply_markup)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to send album buttons: {e}")
+    return True
+
+
+def build_song_group(user_id: int, playlist_id: str, song_ids: List[str]) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+    """Text and shared keyboard for an album's songs, numbered in order"""
+    states = db.get_song_button_states(user_id, song_ids)
+    entries = [(song_id, states[song_id]) for song_id in song_ids if song_id in states]
+    if not entries:
+        return None
+
+    playlist = db.get_playlist(playlist_id)
+    is_owner = playlist is not None and playlist.get('owner_id') == str(user_id)
+
+    lines = [SONG_GROUP_HEADER]
+    for number, (song_id, _) in enumerate(entries, 1):
+        title = db.data['songs'][song_id].get('title') or 'بدون عنوان'
+        lines.append(SONG_GROUP_LINE.format(number=number, title=title))
+
+    return "\n".join(lines), create_song_group_buttons(playlist_id, entries, can_remove=is_owner)
+
+
+def song_keyboard_for(
+    user_id: int,
+    playlist_id: str,
+    song_id: str,
+    group_song_ids: List[str],
+    **state,
+) -> InlineKeyboardMarkup:
+    """Refreshed buttons for a song message, or for the album keyboard it sits in"""
+    if len(group_song_ids) > 1:
+        group = build_song_group(user_id, playlist_id, group_song_ids)
+        if group:
+            return group[1]
+    return create_song_buttons(song_id, playlist_id, **state)
+
+
+async def refresh_analytics_snapshot(context: ContextTypes.DEFAULT_TYPE):
+    """Periodically export the read-only snapshot used by analytics workers"""
+    try:
+        await analytics.export_snapshot()
+    except Exception as exc:
+        logger.error("Failed to export analytics snapshot: %s", exc)
+
+
+async def reconcile_storage_messages(context: ContextTypes.DEFAULT_TYPE):
+    """Queue storage channel messages that no song uses anymore"""
+    try:
+        storage_gc.reconcile()
+    except Exception as exc:
+        logger.error("Failed to reconcile storage messages: %s", exc)
+
+
+# Long-running tasks started at startup, cancelled on shutdown
+_background_tasks: List[asyncio.Task] = []
+
+
+async def on_startup(application: Application):
+    """Start the background workers and resume fan-outs interrupted by a restart"""
+    outbox.start(application)
+    storage_gc.start(application)
+    broadcaster.resume_all(application)
+    ledger.backfill(db.data['users'], db.get_premium_plans())
+    _background_tasks.append(asyncio.create_task(
+        resume_daily_top_song(application.bot),
+        name='daily_top_song:resume',
+    ))
+
+
+async def on_stop(application: Application):
+    """Finish pending uploads and stop background senders
+
+    Runs as post_stop, while the bot's HTTP client is still open; by
+    post_shutdown it has been closed and nothing can be sent anymore.
+    """
+    await upload_batcher.flush_all()
+    await outbox.stop()
+    await storage_gc.stop()
+    await broadcaster.stop()
+
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+
+
+async def on_shutdown(application: Application):
+    """Close the payment client, the ledger and analytics worker processes"""
+    await zarinpal.close()
+    ledger.close()
+    analytics.shutdown()
+
 
 async def send_daily_top_song(context: ContextTypes.DEFAULT_TYPE):
     """Send the most liked song of the day to all users at 22:00"""
-    target_date = datetime.now().strftime('%Y-%m-%d')
+    await run_daily_top_song(context.bot, datetime.now().strftime('%Y-%m-%d'))
+
+
+async def resume_daily_top_song(bot):
+    """Finish a daily top song fan-out interrupted by a restart
+
+    Resumed under the date it was started for: a fan-out checkpointed
+    before midnight is still unfinished after it.
+    """
+    progress = db.get_top_song_progress()
+    if progress and progress.get('date'):
+        await run_daily_top_song(bot, progress['date'], resume_only=True)
+
 
+async def run_daily_top_song(bot, target_date: str, resume_only: bool = False):
+    """Fan out the daily top song, checkpointing after every batch
+
+    The chosen song and a recipient cursor are persisted before sending, so
+    after a restart the fan-out continues where it stopped instead of
+    starting over. With ``resume_only`` nothing new is started.
+    """
     if db.get_last_top_song_broadcast() == target_date:
         return
 
-    song, daily_likes = db.get_top_song_of_day(target_date)
+    progress = db.get_top_song_progress()
+    if not progress or progress.get('date') != target_date:
+        if resume_only:
+            return
+
+        song, daily_likes = db.get_top_song_of_day(target_date)
+        if not song or daily_likes <= 0:
+            return
+
+        progress = db.start_top_song_progress(target_date, song['id'], daily_likes)
+    else:
+        logger.info("Resuming daily top song fan-out after cursor %s", progress.get('cursor'))
 
-    if not song or daily_likes <= 0:
+    song = db.data['songs'].get(progress['song_id'])
+    if not song:
+        db.set_last_top_song_broadcast(target_date)
         return
 
+    daily_likes = progress['daily_likes']
     song_title = escape_markdown(song.get('title') or 'آهنگ')
     performer = escape_markdown(song.get('performer') or 'نامشخص')
     total_likes = len(song.get('likes', []))
@@ -435,68 +775,62 @@ async def send_daily_top_song(context: ContextTypes.DEFAULT_TYPE):
     except (TypeError, ValueError):
         owner_id = None
 
-    recipients = db.data.get('users', {}).values()
-
-    for user in recipients:
-        if user.get('banned'):
-            continue
-
-        try:
-            user_id = int(user['user_id'])
-        except (TypeError, ValueError):
-            continue
+    already_added = dict(db.get_top_song_recipients(
+        original_song_id,
+        exclude_user_id=owner_id,
+        after=progress.get('cursor'),
+    ))
+    recipient_ids, skipped = db.filter_reachable(list(already_added))
+    if skipped:
+        db.update_top_song_progress(skipped=progress.get('skipped', 0) + skipped)
 
-        if owner_id and user_id == owner_id:
-            continue
+    def send_to(user_id: int):
+        if not (channel_message_id and storage_channel_id) and not song.get('file_id'):
+            return bot.send_message(
+                chat_id=user_id,
+                text=caption,
+                parse_mode=ParseMode.MARKDOWN,
+                rate_limit_args=LANE_BULK,
+            )
 
-        if not should_send_notification(user_id, db):
-            continue
+        reply_markup = create_song_buttons(
+            song_id,
+            'daily_top',
+            user_liked=str(user_id) in song_likes,
+            already_added=already_added[user_id],
+            like_count=total_song_likes,
+            add_count=add_count,
+        )
+        if channel_message_id and storage_channel_id:
+            return bot.copy_message(
+                chat_id=user_id,
+                from_chat_id=storage_channel_id,
+                message_id=channel_message_id,
+                caption=caption,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=reply_markup,
+                rate_limit_args=LANE_BULK,
+            )
+        return bot.send_audio(
+            chat_id=user_id,
+            audio=song['file_id'],
+            caption=caption,
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=reply_markup,
+            rate_limit_args=LANE_BULK,
+        )
 
-        user_liked = str(user_id) in song_likes
-        already_added = db.user_has_song_copy(user_id, original_song_id)
+    async def send_one(user_id: int) -> bool:
+        return await send_with_retry(lambda: send_to(user_id), user_id)
 
-        try:
-            if channel_message_id and storage_channel_id:
-                await context.bot.copy_message(
-                    chat_id=user_id,
-                    from_chat_id=storage_channel_id,
-                    message_id=channel_message_id,
-                    caption=caption,
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=create_song_buttons(
-                        song_id,
-                        'daily_top',
-                        user_liked=user_liked,
-                        already_added=already_added,
-                        like_count=total_song_likes,
-                        add_count=add_count,
-                    ),
-                )
-            elif song.get('file_id'):
-                await context.bot.send_audio(
-                    chat_id=user_id,
-                    audio=song['file_id'],
-                    caption=caption,
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=create_song_buttons(
-                        song_id,
-                        'daily_top',
-                        user_liked=user_liked,
-                        already_added=already_added,
-                        like_count=total_song_likes,
-                        add_count=add_count,
-                    ),
-                )
-            else:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=caption,
-                    parse_mode=ParseMode.MARKDOWN,
-                )
+    async def checkpoint(last_id: int, delivered: int, failed: int):
+        db.update_top_song_progress(
+            cursor=last_id,
+            sent=progress['sent'] + delivered,
+            failed=progress['failed'] + failed,
+        )
 
-            await asyncio.sleep(NOTIFICATION_DELAY)
-        except Exception as exc:
-            logger.error("Failed to send daily top song to %s: %s", user_id, exc)
+    await fan_out(recipient_ids, send_one, checkpoint)
 
     if owner_id:
         owner = db.get_user(owner_id)
@@ -509,14 +843,21 @@ async def send_daily_top_song(context: ContextTypes.DEFAULT_TYPE):
             )
 
             try:
-                await context.bot.send_message(
+                await bot.send_message(
                     chat_id=owner_id,
                     text=owner_message,
                     parse_mode=ParseMode.MARKDOWN,
+                    rate_limit_args=LANE_NOTIFICATION,
                 )
             except Exception as exc:
                 logger.error("Failed to notify owner %s about daily top song: %s", owner_id, exc)
 
+    logger.info(
+        "Daily top song sent to %s users (%s failed, %s unreachable skipped)",
+        progress['sent'],
+        progress['failed'],
+        progress.get('skipped', 0),
+    )
     db.set_last_top_song_broadcast(target_date)
 
 # ===== COMMAND HANDLERS =====
@@ -891,27 +1232,51 @@ async def browse(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
-async def trending(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show trending playlists"""
-    playlists = db.get_trending_playlists(limit=20)
+# Browse screens look the same for every viewer, so the rendered text and
+# keyboard are cached until the catalog (or, for trending, the analytics
+# snapshot) changes. Plays and likes don't invalidate them; their counts
+# catch up within BROWSE_RENDER_TTL.
+BROWSE_BACK_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔙 بازگشت", callback_data="browse_menu")]
+])
+
+BrowseScreen = Tuple[str, Optional[InlineKeyboardMarkup], Optional[str]]
+
+
+async def send_browse_screen(update: Update, key: Tuple, build, extra_versions: Tuple = ()):
+    """Send a browse screen from the render cache, building it on a miss"""
+    cache = caches.get('browse_screens', maxsize=BROWSE_RENDER_CACHE_SIZE, ttl=BROWSE_RENDER_TTL)
+    versions = caches.versions((CATALOG,)) + extra_versions
+
+    screen = cache.get(key, versions)
+    if screen is None:
+        screen = build()
+        if inspect.isawaitable(screen):
+            screen = await screen
+        cache.set(key, screen, versions)
+
+    text, reply_markup, parse_mode = screen
+    await send_response(update, text, reply_markup=reply_markup, parse_mode=parse_mode)
+
+
+async def build_trending_screen() -> BrowseScreen:
+    playlists = await analytics.get_trending_playlists(limit=20)
 
     if not playlists:
-        await send_response(
-            update,
-            "هنوز پلی‌لیست ترندی نیست! اولین نفر باش! 🚀",
-            parse_mode=None,
-        )
-        return
+        return "هنوز پلی‌لیست ترندی نیست! اولین نفر باش! 🚀", None, None
 
-    message = TRENDING_HEADER
+    lines = [TRENDING_HEADER]
     buttons = []
 
     for i, pl in enumerate(playlists[:10], 1):
         rank_emoji = get_rank_emoji(i)
-        name = escape_markdown(pl['name'])
-        owner = escape_markdown(pl['owner_name'])
-        message += f"{rank_emoji} **{name}** by {owner}\n"
-        message += f"   ▶️ {pl.get('plays', 0)} | ❤️ {len(pl.get('likes', []))}\n\n"
+        lines.append(BROWSE_ROW_PLAYS_FIRST_TEMPLATE.render(
+            icon=rank_emoji,
+            name=pl['name'],
+            owner=pl['owner_name'],
+            plays=pl.get('plays', 0),
+            likes=len(pl.get('likes', [])),
+        ))
 
         buttons.append([
             InlineKeyboardButton(
@@ -924,40 +1289,27 @@ async def trending(update: Update, context: ContextTypes.DEFAULT_TYPE):
         InlineKeyboardButton("🔙 بازگشت", callback_data="browse_menu")
     ])
 
-    await send_response(
-        update,
-        message,
-        reply_markup=InlineKeyboardMarkup(buttons),
-    )
+    return "".join(lines), InlineKeyboardMarkup(buttons), ParseMode.MARKDOWN
 
 
-async def new_playlists(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show newest playlists"""
+def build_new_playlists_screen() -> BrowseScreen:
     playlists = db.get_new_playlists(limit=20)
 
     if not playlists:
-        await send_response(
-            update,
-            "فعلاً پلی‌لیست تازه‌ای ساخته نشده! 🎧",
-            parse_mode=None,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="browse_menu")]
-            ]),
-        )
-        return
+        return "فعلاً پلی‌لیست تازه‌ای ساخته نشده! 🎧", BROWSE_BACK_MARKUP, None
 
-    message = NEW_PLAYLISTS_HEADER
+    lines = [NEW_PLAYLISTS_HEADER]
     buttons = []
 
     for pl in playlists[:10]:
-        mood = get_mood_label(pl.get('mood'))
-        name = escape_markdown(pl['name'])
-        owner = escape_markdown(pl['owner_name'])
-        created = format_date(pl.get('created_at', ''))
-        message += f"{mood} **{name}** by {owner}\n"
-        message += (
-            f"   ❤️ {len(pl.get('likes', []))} | ▶️ {pl.get('plays', 0)} | 📅 {created}\n\n"
-        )
+        lines.append(BROWSE_ROW_DATED_TEMPLATE.render(
+            icon=get_mood_label(pl.get('mood')),
+            name=pl['name'],
+            owner=pl['owner_name'],
+            likes=len(pl.get('likes', [])),
+            plays=pl.get('plays', 0),
+            created=format_date(pl.get('created_at', '')),
+        ))
 
         buttons.append([
             InlineKeyboardButton(
@@ -970,39 +1322,27 @@ async def new_playlists(update: Update, context: ContextTypes.DEFAULT_TYPE):
         InlineKeyboardButton("🔙 بازگشت", callback_data="browse_menu")
     ])
 
-    await send_response(
-        update,
-        message,
-        reply_markup=InlineKeyboardMarkup(buttons),
-    )
+    return "".join(lines), InlineKeyboardMarkup(buttons), ParseMode.MARKDOWN
 
 
-async def top_playlists(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show top playlists by likes"""
+def build_top_playlists_screen() -> BrowseScreen:
     playlists = db.get_top_playlists(limit=20)
 
     if not playlists:
-        await send_response(
-            update,
-            "هنوز پلی‌لیست محبوبی وجود نداره!",
-            parse_mode=None,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="browse_menu")]
-            ]),
-        )
-        return
+        return "هنوز پلی‌لیست محبوبی وجود نداره!", BROWSE_BACK_MARKUP, None
 
-    message = TOP_PLAYLISTS_HEADER
+    lines = [TOP_PLAYLISTS_HEADER]
     buttons = []
 
     for i, pl in enumerate(playlists[:10], 1):
         medal = get_rank_emoji(i)
-        name = escape_markdown(pl['name'])
-        owner = escape_markdown(pl['owner_name'])
-        likes = len(pl.get('likes', []))
-        plays = pl.get('plays', 0)
-        message += f"{medal} **{name}** by {owner}\n"
-        message += f"   ❤️ {likes} | ▶️ {plays}\n\n"
+        lines.append(BROWSE_ROW_TEMPLATE.render(
+            icon=medal,
+            name=pl['name'],
+            owner=pl['owner_name'],
+            likes=len(pl.get('likes', [])),
+            plays=pl.get('plays', 0),
+        ))
 
         buttons.append([
             InlineKeyboardButton(
@@ -1015,39 +1355,27 @@ async def top_playlists(update: Update, context: ContextTypes.DEFAULT_TYPE):
         InlineKeyboardButton("🔙 بازگشت", callback_data="browse_menu")
     ])
 
-    await send_response(
-        update,
-        message,
-        reply_markup=InlineKeyboardMarkup(buttons),
-    )
+    return "".join(lines), InlineKeyboardMarkup(buttons), ParseMode.MARKDOWN
 
 
-async def mood_playlists(update: Update, context: ContextTypes.DEFAULT_TYPE, mood_key: str):
-    """Show playlists filtered by mood"""
+def build_mood_playlists_screen(mood_key: str) -> BrowseScreen:
     playlists = db.get_playlists_by_mood(mood_key, limit=20)
     mood_name = get_mood_label(mood_key)
 
     if not playlists:
-        await send_response(
-            update,
-            f"برای حال‌وهوای {mood_name} هنوز پلی‌لیستی نداریم!",
-            parse_mode=None,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="browse_menu")]
-            ]),
-        )
-        return
+        return f"برای حال‌وهوای {mood_name} هنوز پلی‌لیستی نداریم!", BROWSE_BACK_MARKUP, None
 
-    message = f"{mood_name} **پلی‌لیست‌های این حال‌وهوا:**\n\n"
+    lines = [MOOD_PLAYLISTS_HEADER_TEMPLATE.render(mood=mood_name)]
     buttons = []
 
     for pl in playlists[:10]:
-        name = escape_markdown(pl['name'])
-        owner = escape_markdown(pl['owner_name'])
-        likes = len(pl.get('likes', []))
-        plays = pl.get('plays', 0)
-        message += f"{mood_name} **{name}** by {owner}\n"
-        message += f"   ❤️ {likes} | ▶️ {plays}\n\n"
+        lines.append(BROWSE_ROW_TEMPLATE.render(
+            icon=mood_name,
+            name=pl['name'],
+            owner=pl['owner_name'],
+            likes=len(pl.get('likes', [])),
+            plays=pl.get('plays', 0),
+        ))
 
         buttons.append([
             InlineKeyboardButton(
@@ -1060,16 +1388,36 @@ async def mood_playlists(update: Update, context: ContextTypes.DEFAULT_TYPE, moo
         InlineKeyboardButton("🔙 بازگشت", callback_data="browse_menu")
     ])
 
-    await send_response(
+    return "".join(lines), InlineKeyboardMarkup(buttons), ParseMode.MARKDOWN
+
+
+async def trending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show trending playlists"""
+    await send_browse_screen(update, ('trending',), build_trending_screen, (analytics.version,))
+
+
+async def new_playlists(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show newest playlists"""
+    await send_browse_screen(update, ('new',), build_new_playlists_screen)
+
+
+async def top_playlists(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show top playlists by likes"""
+    await send_browse_screen(update, ('top',), build_top_playlists_screen)
+
+
+async def mood_playlists(update: Update, context: ContextTypes.DEFAULT_TYPE, mood_key: str):
+    """Show playlists filtered by mood"""
+    await send_browse_screen(
         update,
-        message,
-        reply_markup=InlineKeyboardMarkup(buttons),
+        ('mood', mood_key),
+        functools.partial(build_mood_playlists_screen, mood_key),
     )
 
 
 async def show_search_results(update: Update, context: ContextTypes.DEFAULT_TYPE, query: str):
     """Send playlist search results"""
-    playlists = db.search_playlists(query)
+    playlists = await analytics.search_playlists(query)
 
     if not playlists:
         await update.message.reply_text(
@@ -1081,18 +1429,17 @@ async def show_search_results(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return
 
-    text = f"🔍 **نتایج برای:** {escape_markdown(query)}\n\n"
+    lines = [SEARCH_RESULTS_HEADER_TEMPLATE.render(query=query)]
     buttons = []
 
     for pl in playlists[:10]:
-        mood = get_mood_label(pl.get('mood'))
-        name = escape_markdown(pl['name'])
-        owner = escape_markdown(pl['owner_name'])
-        likes = len(pl.get('likes', []))
-        plays = pl.get('plays', 0)
-
-        text += f"{mood} **{name}** by {owner}\n"
-        text += f"   ❤️ {likes} | ▶️ {plays}\n\n"
+        lines.append(BROWSE_ROW_TEMPLATE.render(
+            icon=get_mood_label(pl.get('mood')),
+            name=pl['name'],
+            owner=pl['owner_name'],
+            likes=len(pl.get('likes', [])),
+            plays=pl.get('plays', 0),
+        ))
 
         buttons.append([
             InlineKeyboardButton(
@@ -1109,7 +1456,7 @@ async def show_search_results(update: Update, context: ContextTypes.DEFAULT_TYPE
     ])
 
     await update.message.reply_text(
-        text,
+        "".join(lines),
         parse_mode=ParseMode.MARKDOWN,
         reply_markup=InlineKeyboardMarkup(buttons)
     )
@@ -1126,7 +1473,7 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     playlists = db.get_user_playlists(user_id)
     total_songs = sum(len(pl['songs']) for pl in playlists)
-    rank = db.get_user_rank(user_id)
+    rank = await analytics.get_user_rank(user_id)
 
     status = "💎 پریمیوم" if db.is_premium(user_id) else "🆓 رایگان"
     badges_text = format_badges(user.get('badges', []))
@@ -1195,10 +1542,10 @@ async def show_added_playlists(update: Update, context: ContextTypes.DEFAULT_TYP
             owner_name = "نامشخص"
 
         message_lines.append(
-            ADDED_PLAYLISTS_ITEM.format(
+            ADDED_PLAYLISTS_ITEM_TEMPLATE.render(
                 index=index,
-                name=escape_markdown(playlist['name']),
-                owner=escape_markdown(owner_name),
+                name=playlist['name'],
+                owner=owner_name,
                 likes=format_number(len(playlist.get('likes', []))),
                 songs=format_number(len(playlist.get('songs', []))),
             )
@@ -1223,7 +1570,7 @@ async def show_added_playlists(update: Update, context: ContextTypes.DEFAULT_TYP
 async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show leaderboard"""
     user_id = update.effective_user.id
-    leaderboard_entries = db.get_leaderboard(sort_by='likes', limit=0)
+    leaderboard_entries = await analytics.get_leaderboard(sort_by='likes', limit=0)
     top_users = leaderboard_entries[:20]
     total_users = len(leaderboard_entries)
 
@@ -1243,9 +1590,9 @@ async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
         rank_emoji = get_rank_emoji(i)
         premium_badge = " 💎" if user['is_premium'] else ""
 
-        message += LEADERBOARD_ITEM.format(
+        message += LEADERBOARD_ITEM_TEMPLATE.render(
             rank=rank_emoji,
-            name=escape_markdown(user['name']),
+            name=user['name'],
             premium=premium_badge,
             likes=format_number(user['likes']),
             plays=format_number(user['plays']),
@@ -1326,7 +1673,7 @@ async def premium_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ===== AUDIO HANDLER =====
 
 async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle audio file upload"""
+    """Handle audio file upload; files sent together are processed as one batch"""
     user_id = update.effective_user.id
 
     if db.is_banned(user_id):
@@ -1338,92 +1685,162 @@ async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(ERROR_NO_AUDIO)
         return
 
-    # Determine target playlist
-    caption = update.message.caption
-    user_playlists = db.get_user_playlists(user_id)
-    playlist = None
+    upload_batcher.add(user_id, update.message, context)
 
-    if caption:
-        for pl in user_playlists:
-            if pl['name'].lower() == caption.lower():
-                playlist = pl
-                break
 
-    if not playlist:
-        playlist = db.get_active_playlist(user_id)
+async def process_upload_batch(user_id: int, messages: List, context: ContextTypes.DEFAULT_TYPE):
+    """Store a batch of uploaded audio and add it to the target playlists
 
-    if not playlist:
+    Each target playlist is saved once and the user gets one reply for it.
+    """
+    user_playlists = db.get_user_playlists(user_id)
+    playlists_by_name = {pl['name'].lower(): pl for pl in user_playlists}
+    active_playlist = None
+
+    # Determine target playlist of each file
+    targets: Dict[str, List] = {}
+    unassigned = 0
+    for message in messages:
+        playlist = playlists_by_name.get(message.caption.lower()) if message.caption else None
+        if not playlist:
+            active_playlist = active_playlist or db.get_active_playlist(user_id)
+            playlist = active_playlist
+        if not playlist:
+            unassigned += 1
+            continue
+        targets.setdefault(playlist['id'], []).append(message)
+
+    if unassigned:
         if not user_playlists:
-            await update.message.reply_text(
-                UPLOAD_NO_PLAYLIST.format(playlists="هنوز پلی‌لیستی نساختی!")
-            )
+            playlists_list = "هنوز پلی‌لیستی نساختی!"
         else:
             playlists_list = "پلی‌لیست‌های تو:\n" + "\n".join([f"• {pl['name']}" for pl in user_playlists])
-            await update.message.reply_text(
-                UPLOAD_NO_PLAYLIST.format(playlists=playlists_list)
-            )
+        await messages[0].reply_text(UPLOAD_NO_PLAYLIST.format(playlists=playlists_list))
+
+    for playlist_id, playlist_messages in targets.items():
+        await add_uploads_to_playlist(user_id, playlist_id, playlist_messages, context)
+
+
+async def add_uploads_to_playlist(user_id: int, playlist_id: str, messages: List, context: ContextTypes.DEFAULT_TYPE):
+    """Store uploads that fit in the playlist, add them with one save and reply once"""
+    playlist = db.get_playlist(playlist_id)
+    reply_to = messages[-1]
+    if not playlist:
+        # Deleted while the batch was waiting
+        await reply_to.reply_text(ERROR_NOT_FOUND)
         return
 
     max_songs = playlist.get('max_songs', 0) or 0
-    current_count = len(playlist.get('songs', []))
-    if max_songs and current_count >= max_songs:
-        await update.message.reply_text(
+    room = max_songs - len(playlist.get('songs', [])) if max_songs else len(messages)
+
+    if room <= 0:
+        await reply_to.reply_text(
             PLAYLIST_FULL.format(max_songs=max_songs),
             parse_mode=ParseMode.MARKDOWN,
         )
         return
 
-    # Store audio in storage channel
-    try:
-        forwarded = await context.bot.forward_message(
-            chat_id=STORAGE_CHANNEL_ID,
-            from_chat_id=update.effective_chat.id,
-            message_id=update.message.message_id,
-        )
-    except Exception as exc:
-        logger.error(f"Failed to forward audio to storage channel: {exc}")
-        await update.message.reply_text(ERROR_GENERAL)
-        return
-
-    # Get audio info
-    audio = update.message.audio
-    song_data = {
-        'title': audio.title or 'Unknown',
-        'performer': audio.performer or 'Unknown',
-        'duration': audio.duration or 0,
-        'file_size': audio.file_size or 0,
-        'channel_message_id': forwarded.message_id,
-        'storage_channel_id': STORAGE_CHANNEL_ID,
-        'uploader_id': str(user_id),
-        'uploader_name': update.effective_user.first_name or update.effective_user.full_name,
-    }
+    accepted, skipped = messages[:room], len(messages) - min(room, len(messages))
+    songs = await store_uploads(user_id, accepted, context)
+    failed = len(accepted) - len(songs)
 
-    success, status = db.add_song_to_playlist(playlist['id'], song_data)
+    added, status = db.add_songs_to_playlist(playlist_id, songs) if songs else (0, 'storage_missing')
+    skipped += len(songs) - added
 
-    if success:
-        db.set_active_playlist(user_id, playlist['id'])
+    if added and db.get_user(user_id).get('active_playlist_id') != playlist_id:
+        db.set_active_playlist(user_id, playlist_id)
 
-    if not success:
+    if not added:
         if status == 'playlist_full':
-            await update.message.reply_text(
-                PLAYLIST_FULL.format(max_songs=playlist.get('max_songs', 0)),
+            await reply_to.reply_text(
+                PLAYLIST_FULL.format(max_songs=max_songs),
                 parse_mode=ParseMode.MARKDOWN,
             )
-        elif status == 'storage_missing':
-            await update.message.reply_text(ERROR_GENERAL)
         else:
-            await update.message.reply_text(ERROR_GENERAL)
+            await reply_to.reply_text(ERROR_GENERAL)
         return
 
-    updated_playlist = db.get_playlist(playlist['id'])
+    lines = []
+    if added > 1 or skipped or failed:
+        lines.append(UPLOAD_BATCH_ADDED.format(count=format_number(added), playlist=playlist['name']))
+        if skipped:
+            lines.append(UPLOAD_BATCH_SKIPPED_FULL.format(count=format_number(skipped), max_songs=max_songs))
+        if failed:
+            lines.append(UPLOAD_BATCH_FAILED.format(count=format_number(failed)))
+
+    status_text = upload_status_text(playlist_id, status)
+    if status_text and (status != 'song_added' or not lines):
+        lines.append(status_text)
+
+    await reply_to.reply_text("\n\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+
+async def store_uploads(user_id: int, messages: List, context: ContextTypes.DEFAULT_TYPE) -> List[Dict]:
+    """Song records for uploads, forwarding only audio not already in the storage channel"""
+    storage_by_file: Dict[str, Dict] = {}
+    to_forward = {}
+    for message in messages:
+        unique_id = message.audio.file_unique_id
+        storage = db.find_stored_audio(unique_id)
+        if storage:
+            storage_by_file[unique_id] = storage
+        else:
+            to_forward.setdefault(unique_id, message)
+
+    # One forward per file: forward_messages needs python-telegram-bot 20.8+
+    results = await asyncio.gather(
+        *(
+            context.bot.forward_message(
+                chat_id=STORAGE_CHANNEL_ID,
+                from_chat_id=message.chat_id,
+                message_id=message.message_id,
+            )
+            for message in to_forward.values()
+        ),
+        return_exceptions=True,
+    )
+    for message, result in zip(to_forward.values(), results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to forward audio to storage channel: {result}")
+            continue
+        storage_gc.track(STORAGE_CHANNEL_ID, result.message_id)
+        storage_by_file[message.audio.file_unique_id] = {
+            'channel_message_id': result.message_id,
+            'storage_channel_id': STORAGE_CHANNEL_ID,
+        }
+
+    songs = []
+    for message in messages:
+        audio = message.audio
+        storage = storage_by_file.get(audio.file_unique_id)
+        if not storage:
+            continue
+
+        sender = message.from_user
+        songs.append({
+            'title': audio.title or 'Unknown',
+            'performer': audio.performer or 'Unknown',
+            'duration': audio.duration or 0,
+            'file_size': audio.file_size or 0,
+            'file_id': audio.file_id,
+            'file_unique_id': audio.file_unique_id,
+            'channel_message_id': storage['channel_message_id'],
+            'storage_channel_id': storage['storage_channel_id'],
+            'uploader_id': str(user_id),
+            'uploader_name': (sender.first_name or sender.full_name) if sender else None,
+        })
+    return songs
+
+
+def upload_status_text(playlist_id: str, status: str) -> str:
+    """Reply for a playlist that just got new songs"""
+    updated_playlist = db.get_playlist(playlist_id)
     updated_count = len(updated_playlist.get('songs', []))
 
     if status == 'playlist_published':
-        await update.message.reply_text(
-            PLAYLIST_PUBLISHED,
-            parse_mode=ParseMode.MARKDOWN,
-        )
-    elif status == 'draft_progress':
+        return PLAYLIST_PUBLISHED
+
+    if status == 'draft_progress':
         remaining = max(MIN_SONGS_TO_PUBLISH - updated_count, 0)
         max_songs_value = updated_playlist.get('max_songs')
         if isinstance(max_songs_value, int):
@@ -1441,24 +1858,21 @@ async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             auto_hint = "همین حالا می‌تونی منتشرش کنی!"
 
-        await update.message.reply_text(
-            PLAYLIST_DRAFT_PROGRESS.format(
-                current=updated_count,
-                maximum=maximum_display,
-                auto_hint=auto_hint,
-            ),
-            parse_mode=ParseMode.MARKDOWN,
-        )
-    else:
-        await update.message.reply_text(
-            UPLOAD_SUCCESS.format(playlist=updated_playlist['name']),
-            parse_mode=ParseMode.MARKDOWN,
+        return PLAYLIST_DRAFT_PROGRESS.format(
+            current=updated_count,
+            maximum=maximum_display,
+            auto_hint=auto_hint,
         )
 
+    return UPLOAD_SUCCESS.format(playlist=updated_playlist['name'])
+
+
+upload_batcher = UploadBatcher(process_upload_batch)
 
-# ===== CALLBACK HANDLERS =====
 
+# ===== CALLBACK HANDLERS =====
 
+callback_router = CallbackRouter()
 
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1466,684 +1880,804 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    data = query.data
-    user_id = update.effective_user.id
-
-    db.touch_user(user_id)
+    db.touch_user(update.effective_user.id)
 
-    # Browse menus
-    if data.startswith('help_section:'):
-        section = data.split(':', 1)[1]
-        await show_help(update, context, section)
-        return
+    await callback_router.dispatch(update, context)
 
-    if data == 'browse_menu':
-        context.user_data.pop('awaiting_search', None)
-        await browse(update, context)
 
-    elif data == 'browse_trending':
-        await trending(update, context)
+@callback_router.route('help_section:')
+async def on_help_section(update: Update, context: ContextTypes.DEFAULT_TYPE, section: str):
+    """Open a help section"""
+    await show_help(update, context, section)
 
-    elif data == 'browse_new':
-        await new_playlists(update, context)
 
-    elif data == 'browse_top':
-        await top_playlists(update, context)
+@callback_router.route('browse_menu')
+async def on_browse_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Browse menu"""
+    context.user_data.pop('awaiting_search', None)
+    await browse(update, context)
 
-    elif data.startswith('browse_mood_'):
-        mood_key = data.replace('browse_mood_', '')
-        await mood_playlists(update, context, mood_key)
 
-    elif data == 'browse_search':
-        context.user_data['awaiting_search'] = True
-        await send_response(
-            update,
-            SEARCH_PROMPT,
-            parse_mode=None,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔙 بازگشت", callback_data="browse_menu")]
-            ]),
-        )
+@callback_router.route('browse_trending')
+async def on_browse_trending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Trending playlists"""
+    await trending(update, context)
 
-    elif data.startswith('share_'):
-        playlist_id = data.replace('share_', '', 1)
-        playlist = db.get_playlist(playlist_id)
 
-        if not playlist:
-            await query.answer(ERROR_NOT_FOUND, show_alert=True)
-            return
+@callback_router.route('browse_new')
+async def on_browse_new(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Newest playlists"""
+    await new_playlists(update, context)
 
-        if playlist.get('status') != 'published' and playlist.get('owner_id') != str(user_id):
-            await query.answer(PLAYLIST_NOT_PUBLISHED, show_alert=True)
-            return
-        if playlist.get('is_private') and playlist.get('owner_id') != str(user_id):
-            await query.answer(PLAYLIST_PRIVATE_WARNING, show_alert=True)
-            return
 
-        share_url = build_playlist_share_url(playlist_id, playlist.get('name', ''))
-        if not share_url:
-            await query.answer(ERROR_GENERAL, show_alert=True)
-            return
+@callback_router.route('browse_top')
+async def on_browse_top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Top playlists"""
+    await top_playlists(update, context)
 
-        share_text = SHARE_PLAYLIST_MESSAGE.format(
-            name=escape_markdown(playlist.get('name', 'پلی‌لیست')),
-            link=share_url,
-        )
 
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=share_text,
-            parse_mode=ParseMode.MARKDOWN,
-            disable_web_page_preview=True,
-        )
+@callback_router.route('browse_mood_')
+async def on_browse_mood(update: Update, context: ContextTypes.DEFAULT_TYPE, mood_key: str):
+    """Playlists for a mood"""
+    await mood_playlists(update, context, mood_key)
 
-        await query.answer(SHARE_LINK_SENT)
 
-    # Like song (needs to be checked before general like handler)
-    elif data.startswith('like_song:'):
-        try:
-            _, playlist_id, song_id = data.split(':', 2)
-        except ValueError:
-            await query.answer(ERROR_GENERAL, show_alert=True)
-            return
+@callback_router.route('browse_search')
+async def on_browse_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ask for a search query"""
+    context.user_data['awaiting_search'] = True
+    await send_response(
+        update,
+        SEARCH_PROMPT,
+        parse_mode=None,
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔙 بازگشت", callback_data="browse_menu")]
+        ]),
+    )
 
-        song = db.data['songs'].get(song_id)
-        if not song:
-            await query.answer(ERROR_NOT_FOUND, show_alert=True)
-            return
 
-        playlist = db.get_playlist(playlist_id)
-        is_owner = playlist is not None and playlist.get('owner_id') == str(user_id)
+@callback_router.route('share_')
+async def on_share(update: Update, context: ContextTypes.DEFAULT_TYPE, playlist_id: str):
+    """Send the share link of a playlist"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-        if str(user_id) in song.get('likes', []):
-            db.unlike_song(user_id, song_id)
-            await query.answer(UNLIKED)
-            liked = False
-        else:
-            if db.like_song(user_id, song_id):
-                await query.answer(LIKED)
-                liked = True
-
-                uploader_id = song.get('uploader_id')
-                if uploader_id and int(uploader_id) != user_id:
-                    liker = db.get_user(user_id)
-                    notif_text = NOTIF_SONG_LIKED.format(
-                        user=liker['first_name'],
-                        song=song.get('title', 'آهنگ'),
-                    )
-                    await send_notification(int(uploader_id), notif_text, context)
-
-                await send_notification(
-                    user_id,
-                    NOTIF_SONG_LIKED_SELF.format(song=song.get('title', 'آهنگ')),
-                    context,
-                )
-            else:
-                await query.answer(ALREADY_LIKED)
-                return
+    playlist = db.get_playlist(playlist_id)
 
-        original_id = song.get('original_song_id', song_id)
-        already_added = db.user_has_song_copy(user_id, original_id)
-        like_count = len(song.get('likes', []))
-        add_count = db.count_song_adds(original_id)
-        try:
-            await query.message.edit_reply_markup(
-                reply_markup=create_song_buttons(
-                    song_id,
-                    playlist_id,
-                    user_liked=liked,
-                    already_added=already_added,
-                    like_count=like_count,
-                    add_count=add_count,
-                    can_remove=is_owner,
-                )
-            )
-        except BadRequest as exc:
-            logger.warning(
-                "BadRequest while updating song buttons after like: %s",
-                exc,
-            )
-        except Exception as exc:
-            logger.error(
-                "Unexpected error updating song buttons after like: %s",
-                exc,
-            )
+    if not playlist:
+        await query.answer(ERROR_NOT_FOUND, show_alert=True)
+        return
 
+    if playlist.get('status') != 'published' and playlist.get('owner_id') != str(user_id):
+        await query.answer(PLAYLIST_NOT_PUBLISHED, show_alert=True)
+        return
+    if playlist.get('is_private') and playlist.get('owner_id') != str(user_id):
+        await query.answer(PLAYLIST_PRIVATE_WARNING, show_alert=True)
         return
 
-    # Like playlist
-    elif data.startswith('like_'):
-        playlist_id = data.replace('like_', '')
-        playlist = db.get_playlist(playlist_id)
+    share_url = build_playlist_share_url(playlist_id, playlist.get('name', ''))
+    if not share_url:
+        await query.answer(ERROR_GENERAL, show_alert=True)
+        return
 
-        if not playlist:
-            await query.answer(ERROR_NOT_FOUND, show_alert=True)
-            return
+    share_text = SHARE_PLAYLIST_MESSAGE.format(
+        name=escape_markdown(playlist.get('name', 'پلی‌لیست')),
+        link=share_url,
+    )
 
-        if playlist.get('status') != 'published' and playlist.get('owner_id') != str(user_id):
-            await query.answer(PLAYLIST_NOT_PUBLISHED, show_alert=True)
-            return
+    await context.bot.send_message(
+        chat_id=user_id,
+        text=share_text,
+        parse_mode=ParseMode.MARKDOWN,
+        disable_web_page_preview=True,
+    )
 
-        # Check if already liked
-        if str(user_id) in playlist.get('likes', []):
-            # Unlike
-            db.unlike_playlist(user_id, playlist_id)
-            await query.answer(UNLIKED)
-        else:
-            # Like
-            if db.like_playlist(user_id, playlist_id):
-                await query.answer(LIKED)
-
-                # Send notification to owner
-                owner_id = int(playlist['owner_id'])
-                if owner_id != user_id:
-                    user = db.get_user(user_id)
-                    notif_text = NOTIF_LIKED.format(
-                        user=user['first_name'],
-                        playlist=playlist['name']
-                    )
-                    await send_notification(owner_id, notif_text, context)
-            else:
-                await query.answer(ALREADY_LIKED)
+    await query.answer(SHARE_LINK_SENT)
 
-    elif data.startswith('add_song:'):
-        try:
-            _, source_playlist_id, song_id = data.split(':', 2)
-        except ValueError:
-            await query.answer(ERROR_GENERAL, show_alert=True)
-            return
 
-        song = db.data['songs'].get(song_id)
-        if not song:
-            await query.answer(ERROR_NOT_FOUND, show_alert=True)
-            return
+@callback_router.route('like_song:', args=2)
+async def on_like_song(update: Update, context: ContextTypes.DEFAULT_TYPE, playlist_id: str, song_id: str):
+    """Like or unlike a song"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-        user_playlists = db.get_user_playlists(user_id)
-        if not user_playlists:
-            await query.answer("اول یه پلی‌لیست بساز!", show_alert=True)
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=NEED_PLAYLIST_BEFORE_ADD,
-            )
-            return
+    song = db.data['songs'].get(song_id)
+    if not song:
+        await query.answer(ERROR_NOT_FOUND, show_alert=True)
+        return
 
-        context.user_data['pending_song_add'] = {
-            'song_id': song_id,
-            'source_playlist_id': source_playlist_id,
-            'message_id': query.message.message_id,
-        }
+    playlist = db.get_playlist(playlist_id)
+    is_owner = playlist is not None and playlist.get('owner_id') == str(user_id)
 
-        buttons = [
-            [
-                InlineKeyboardButton(
-                    pl['name'],
-                    callback_data=f"add_song_to:{pl['id']}",
+    if str(user_id) in song.get('likes', []):
+        db.unlike_song(user_id, song_id)
+        await query.answer(UNLIKED)
+        liked = False
+    else:
+        if db.like_song(user_id, song_id):
+            await query.answer(LIKED)
+            liked = True
+
+            uploader_id = song.get('uploader_id')
+            if uploader_id and int(uploader_id) != user_id:
+                liker = db.get_user(user_id)
+                send_activity_notification(
+                    int(uploader_id),
+                    f"song_liked:{song_id}",
+                    NOTIF_SONG_LIKED,
+                    NOTIF_SONG_LIKED_MANY,
+                    user=liker['first_name'],
+                    song=song.get('title', 'آهنگ'),
                 )
-            ]
-            for pl in user_playlists
-        ]
 
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=CHOOSE_PLAYLIST_TO_SAVE_SONG,
-            reply_markup=InlineKeyboardMarkup(buttons),
+            send_notification(
+                user_id,
+                NOTIF_SONG_LIKED_SELF.format(song=song.get('title', 'آهنگ')),
+            )
+        else:
+            await query.answer(ALREADY_LIKED)
+            return
+
+    original_id = song.get('original_song_id', song_id)
+    already_added = db.user_has_song_copy(user_id, original_id)
+    like_count = len(song.get('likes', []))
+    add_count = db.count_song_adds(original_id)
+    try:
+        await query.message.edit_reply_markup(
+            reply_markup=song_keyboard_for(
+                user_id,
+                playlist_id,
+                song_id,
+                keyboard_song_ids(query.message.reply_markup),
+                user_liked=liked,
+                already_added=already_added,
+                like_count=like_count,
+                add_count=add_count,
+                can_remove=is_owner,
+            )
+        )
+    except BadRequest as exc:
+        logger.warning(
+            "BadRequest while updating song buttons after like: %s",
+            exc,
+        )
+    except Exception as exc:
+        logger.error(
+            "Unexpected error updating song buttons after like: %s",
+            exc,
         )
 
-    elif data.startswith('add_song_to:'):
-        target_playlist_id = data.replace('add_song_to:', '')
-        pending = context.user_data.get('pending_song_add')
-        if not pending:
-            await query.answer(ERROR_GENERAL, show_alert=True)
-            return
 
-        song_id = pending['song_id']
-        original_song = db.data['songs'].get(song_id)
-        if not original_song:
-            await query.answer(ERROR_NOT_FOUND, show_alert=True)
-            return
+@callback_router.route('like_')
+async def on_like_playlist(update: Update, context: ContextTypes.DEFAULT_TYPE, playlist_id: str):
+    """Like or unlike a playlist"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-        success, status = db.add_existing_song_to_playlist(
-            song_id,
-            target_playlist_id,
-            user_id,
-        )
+    playlist = db.get_playlist(playlist_id)
 
-        target_playlist = db.get_playlist(target_playlist_id)
-        if not target_playlist:
-            await query.answer(ERROR_NOT_FOUND, show_alert=True)
-            return
+    if not playlist:
+        await query.answer(ERROR_NOT_FOUND, show_alert=True)
+        return
 
-        if not success:
-            if status == 'duplicate':
-                await query.answer(
-                    "این آهنگ قبلاً تو این پلی‌لیسته!", show_alert=True
-                )
-            elif status == 'playlist_full':
-                await query.answer(
-                    PLAYLIST_FULL.format(max_songs=target_playlist.get('max_songs', 0)),
-                    show_alert=True,
+    if playlist.get('status') != 'published' and playlist.get('owner_id') != str(user_id):
+        await query.answer(PLAYLIST_NOT_PUBLISHED, show_alert=True)
+        return
+
+    # Check if already liked
+    if str(user_id) in playlist.get('likes', []):
+        # Unlike
+        db.unlike_playlist(user_id, playlist_id)
+        await query.answer(UNLIKED)
+    else:
+        # Like
+        if db.like_playlist(user_id, playlist_id):
+            await query.answer(LIKED)
+
+            # Send notification to owner
+            owner_id = int(playlist['owner_id'])
+            if owner_id != user_id:
+                user = db.get_user(user_id)
+                send_activity_notification(
+                    owner_id,
+                    f"playlist_liked:{playlist_id}",
+                    NOTIF_LIKED,
+                    NOTIF_LIKED_MANY,
+                    user=user['first_name'],
+                    playlist=playlist['name'],
                 )
-            else:
-                await query.answer(ERROR_GENERAL, show_alert=True)
-            return
+        else:
+            await query.answer(ALREADY_LIKED)
 
-        await query.answer("انجام شد! ✅")
 
-        await query.edit_message_text(
-            ADDED_TO_PLAYLIST.format(playlist=target_playlist['name'])
-        )
+@callback_router.route('add_song:', args=2)
+async def on_add_song(update: Update, context: ContextTypes.DEFAULT_TYPE, source_playlist_id: str, song_id: str):
+    """Pick a playlist to save a song to"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-        source_uploader = original_song.get('uploader_id')
-        if source_uploader and int(source_uploader) != user_id:
-            adder = db.get_user(user_id)
-            notif_text = NOTIF_ADDED.format(
-                user=adder['first_name'],
-                song=original_song.get('title', 'آهنگ'),
-            )
-            await send_notification(int(source_uploader), notif_text, context)
+    song = db.data['songs'].get(song_id)
+    if not song:
+        await query.answer(ERROR_NOT_FOUND, show_alert=True)
+        return
 
-        await send_notification(
-            user_id,
-            NOTIF_SONG_ADDED_SELF.format(
-                song=original_song.get('title', 'آهنگ'),
-                playlist=target_playlist['name'],
-            ),
-            context,
+    user_playlists = db.get_user_playlists(user_id)
+    if not user_playlists:
+        await query.answer("اول یه پلی‌لیست بساز!", show_alert=True)
+        await context.bot.send_message(
+            chat_id=user_id,
+            text=NEED_PLAYLIST_BEFORE_ADD,
         )
+        return
 
-        original_id = original_song.get('original_song_id', song_id)
-        like_count = len(original_song.get('likes', []))
-        add_count = db.count_song_adds(original_id)
-        source_playlist = db.get_playlist(pending['source_playlist_id']) if pending.get('source_playlist_id') else None
-        can_remove_source = source_playlist is not None and source_playlist.get('owner_id') == str(user_id)
+    context.user_data['pending_song_add'] = {
+        'song_id': song_id,
+        'source_playlist_id': source_playlist_id,
+        'message_id': query.message.message_id,
+        'group_song_ids': keyboard_song_ids(query.message.reply_markup),
+    }
 
-        try:
-            await context.bot.edit_message_reply_markup(
-                chat_id=user_id,
-                message_id=pending['message_id'],
-                reply_markup=create_song_buttons(
-                    song_id,
-                    pending['source_playlist_id'],
-                    user_liked=str(user_id) in original_song.get('likes', []),
-                    already_added=True,
-                    like_count=like_count,
-                    add_count=add_count,
-                    can_remove=can_remove_source,
-                ),
+    buttons = [
+        [
+            InlineKeyboardButton(
+                pl['name'],
+                callback_data=f"add_song_to:{pl['id']}",
             )
-        except Exception as exc:
-            logger.error(f"Failed to update song buttons after add: {exc}")
+        ]
+        for pl in user_playlists
+    ]
 
-        context.user_data.pop('pending_song_add', None)
+    await context.bot.send_message(
+        chat_id=user_id,
+        text=CHOOSE_PLAYLIST_TO_SAVE_SONG,
+        reply_markup=InlineKeyboardMarkup(buttons),
+    )
 
-    elif data.startswith('remove_song:'):
-        try:
-            _, playlist_id, song_id = data.split(':', 2)
-        except ValueError:
-            await query.answer(ERROR_GENERAL, show_alert=True)
-            return
 
-        playlist = db.get_playlist(playlist_id)
-        playlist_name = playlist.get('name', 'پلی‌لیست') if playlist else 'پلی‌لیست'
+@callback_router.route('add_song_to:')
+async def on_add_song_to(update: Update, context: ContextTypes.DEFAULT_TYPE, target_playlist_id: str):
+    """Save the pending song to the chosen playlist"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-        success, info = db.remove_song_from_playlist(playlist_id, song_id, user_id)
+    pending = context.user_data.get('pending_song_add')
+    if not pending:
+        await query.answer(ERROR_GENERAL, show_alert=True)
+        return
 
-        if not success:
-            status = info.get('status') if isinstance(info, dict) else None
-            if status == 'not_owner':
-                await query.answer(SONG_REMOVE_NOT_OWNER, show_alert=True)
-            elif status in {'playlist_not_found', 'song_not_in_playlist'}:
-                await query.answer(SONG_REMOVE_NOT_FOUND, show_alert=True)
-            else:
-                await query.answer(ERROR_GENERAL, show_alert=True)
-            return
+    song_id = pending['song_id']
+    original_song = db.data['songs'].get(song_id)
+    if not original_song:
+        await query.answer(ERROR_NOT_FOUND, show_alert=True)
+        return
 
-        storage_messages = info.get('storage_messages', []) if isinstance(info, dict) else []
-        for channel_id, message_id in storage_messages:
-            try:
-                await context.bot.delete_message(chat_id=channel_id, message_id=message_id)
-            except BadRequest as exc:
-                logger.warning(
-                    "BadRequest while deleting song %s from channel %s: %s",
-                    song_id,
-                    channel_id,
-                    exc,
-                )
-            except Exception as exc:
-                logger.error(
-                    "Unexpected error deleting song %s from channel %s: %s",
-                    song_id,
-                    channel_id,
-                    exc,
-                )
+    success, status = db.add_existing_song_to_playlist(
+        song_id,
+        target_playlist_id,
+        user_id,
+    )
 
-        try:
-            await query.message.delete()
-        except BadRequest as exc:
-            logger.debug("Failed to delete song message after removal: %s", exc)
-        except Exception as exc:
-            logger.error("Unexpected error deleting song message: %s", exc)
+    target_playlist = db.get_playlist(target_playlist_id)
+    if not target_playlist:
+        await query.answer(ERROR_NOT_FOUND, show_alert=True)
+        return
 
-        await query.answer("آهنگ حذف شد!", show_alert=True)
+    if not success:
+        if status == 'duplicate':
+            await query.answer(
+                "این آهنگ قبلاً تو این پلی‌لیسته!", show_alert=True
+            )
+        elif status == 'playlist_full':
+            await query.answer(
+                PLAYLIST_FULL.format(max_songs=target_playlist.get('max_songs', 0)),
+                show_alert=True,
+            )
+        else:
+            await query.answer(ERROR_GENERAL, show_alert=True)
+        return
 
-        updated_playlist = db.get_playlist(playlist_id)
-        playlist_display_name = playlist_name
-        if updated_playlist:
-            playlist_display_name = updated_playlist.get('name', playlist_name)
+    await query.answer("انجام شد! ✅")
 
-        remaining = info.get('remaining_songs', 0)
-        max_songs = info.get('max_songs', 0)
-        current_display = format_number(remaining)
-        maximum_display = "∞" if not max_songs else format_number(max_songs)
+    await query.edit_message_text(
+        ADDED_TO_PLAYLIST.format(playlist=target_playlist['name'])
+    )
 
-        messages = [
-            SONG_REMOVED_SUCCESS.format(playlist=playlist_display_name)
-        ]
-        messages.append(
-            PLAYLIST_CAPACITY_STATUS.format(
-                current=current_display,
-                maximum=maximum_display,
-            )
+    source_uploader = original_song.get('uploader_id')
+    if source_uploader and int(source_uploader) != user_id:
+        adder = db.get_user(user_id)
+        send_activity_notification(
+            int(source_uploader),
+            f"song_added:{song_id}",
+            NOTIF_ADDED,
+            NOTIF_ADDED_MANY,
+            user=adder['first_name'],
+            song=original_song.get('title', 'آهنگ'),
         )
 
-        if not max_songs or remaining < max_songs:
-            messages.append(PLAYLIST_OWNER_ADD_HINT)
+    send_notification(
+        user_id,
+        NOTIF_SONG_ADDED_SELF.format(
+            song=original_song.get('title', 'آهنگ'),
+            playlist=target_playlist['name'],
+        ),
+    )
 
-        if info.get('playlist_now_draft'):
-            messages.append(
-                PLAYLIST_OWNER_NOW_DRAFT.format(
-                    min_songs=MIN_SONGS_TO_PUBLISH,
-                )
-            )
+    original_id = original_song.get('original_song_id', song_id)
+    like_count = len(original_song.get('likes', []))
+    add_count = db.count_song_adds(original_id)
+    source_playlist = db.get_playlist(pending['source_playlist_id']) if pending.get('source_playlist_id') else None
+    can_remove_source = source_playlist is not None and source_playlist.get('owner_id') == str(user_id)
 
-        await context.bot.send_message(
+    try:
+        await context.bot.edit_message_reply_markup(
             chat_id=user_id,
-            text="\n".join(messages),
+            message_id=pending['message_id'],
+            reply_markup=song_keyboard_for(
+                user_id,
+                pending['source_playlist_id'],
+                song_id,
+                pending.get('group_song_ids', []),
+                user_liked=str(user_id) in original_song.get('likes', []),
+                already_added=True,
+                like_count=like_count,
+                add_count=add_count,
+                can_remove=can_remove_source,
+            ),
         )
+    except Exception as exc:
+        logger.error(f"Failed to update song buttons after add: {exc}")
 
-        return
+    context.user_data.pop('pending_song_add', None)
 
-    # Add to playlist
-    elif data.startswith('add_'):
-        playlist_id = data.replace('add_', '')
-        playlist = db.get_playlist(playlist_id)
 
-        if not playlist:
-            await query.answer(ERROR_NOT_FOUND)
-            return
+@callback_router.route('remove_song:', args=2)
+async def on_remove_song(update: Update, context: ContextTypes.DEFAULT_TYPE, playlist_id: str, song_id: str):
+    """Remove a song from own playlist"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-        if playlist.get('status') != 'published' and playlist.get('owner_id') != str(user_id):
-            await query.answer(PLAYLIST_NOT_PUBLISHED)
-            return
+    playlist = db.get_playlist(playlist_id)
+    playlist_name = playlist.get('name', 'پلی‌لیست') if playlist else 'پلی‌لیست'
 
-        context.user_data['adding_from'] = playlist_id
+    success, info = db.remove_song_from_playlist(playlist_id, song_id, user_id)
 
-        # Show user's playlists
-        user_playlists = db.get_user_playlists(user_id)
-        if not user_playlists:
-            await query.answer("اول یه پلی‌لیست بساز!")
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=NEED_PLAYLIST_BEFORE_ADD,
-            )
-            return
+    if not success:
+        status = info.get('status') if isinstance(info, dict) else None
+        if status == 'not_owner':
+            await query.answer(SONG_REMOVE_NOT_OWNER, show_alert=True)
+        elif status in {'playlist_not_found', 'song_not_in_playlist'}:
+            await query.answer(SONG_REMOVE_NOT_FOUND, show_alert=True)
+        else:
+            await query.answer(ERROR_GENERAL, show_alert=True)
+        return
 
-        buttons = []
-        for pl in user_playlists:
-            buttons.append([
-                InlineKeyboardButton(
-                    pl['name'],
-                    callback_data=f"addto_{pl['id']}"
-                )
-            ])
+    storage_gc.enqueue(info.get('storage_messages', []) if isinstance(info, dict) else [])
 
-        await query.edit_message_text(
-            CHOOSE_PLAYLIST_TO_ADD,
-            reply_markup=InlineKeyboardMarkup(buttons)
-        )
+    # In an album keyboard only this song's row goes; the other songs stay
+    remaining_group = [
+        group_song_id
+        for group_song_id in keyboard_song_ids(query.message.reply_markup)
+        if group_song_id != song_id
+    ]
+    group = build_song_group(user_id, playlist_id, remaining_group) if remaining_group else None
 
-    # Play playlist
-    elif data.startswith('play_'):
-        playlist_id = data.replace('play_', '')
-        playlist = db.get_playlist(playlist_id)
-
-        if not playlist:
-            await query.answer(ERROR_NOT_FOUND)
-            return
+    try:
+        if group:
+            text, reply_markup = group
+            await query.message.edit_text(text, reply_markup=reply_markup)
+        else:
+            await query.message.delete()
+    except BadRequest as exc:
+        logger.debug("Failed to update song message after removal: %s", exc)
+    except Exception as exc:
+        logger.error("Unexpected error updating song message: %s", exc)
 
-        if playlist.get('status') != 'published' and playlist.get('owner_id') != str(user_id):
-            await query.answer(PLAYLIST_NOT_PUBLISHED)
-            return
-        if playlist.get('is_private') and playlist.get('owner_id') != str(user_id):
-            await query.answer(PLAYLIST_PRIVATE_WARNING, show_alert=True)
-            return
+    await query.answer("آهنگ حذف شد!", show_alert=True)
 
-        if playlist.get('songs'):
-            await query.answer(f"در حال پخش {playlist['name']}...")
-        else:
-            await query.answer("این پلی‌لیست خالیه!")
+    updated_playlist = db.get_playlist(playlist_id)
+    playlist_display_name = playlist_name
+    if updated_playlist:
+        playlist_display_name = updated_playlist.get('name', playlist_name)
 
-        await send_playlist_details(user_id, playlist, context, playlist_id)
+    remaining = info.get('remaining_songs', 0)
+    max_songs = info.get('max_songs', 0)
+    current_display = format_number(remaining)
+    maximum_display = "∞" if not max_songs else format_number(max_songs)
 
-    elif data.startswith('set_active_add:'):
-        playlist_id = data.replace('set_active_add:', '')
-        playlist = db.get_playlist(playlist_id)
+    messages = [
+        SONG_REMOVED_SUCCESS.format(playlist=playlist_display_name)
+    ]
+    messages.append(
+        PLAYLIST_CAPACITY_STATUS.format(
+            current=current_display,
+            maximum=maximum_display,
+        )
+    )
 
-        if not playlist or playlist.get('owner_id') != str(user_id):
-            await query.answer(ERROR_NOT_FOUND, show_alert=True)
-            return
+    if not max_songs or remaining < max_songs:
+        messages.append(PLAYLIST_OWNER_ADD_HINT)
 
-        max_songs = playlist.get('max_songs', 0) or 0
-        current_count = len(playlist.get('songs', []))
-        if max_songs and current_count >= max_songs:
-            await query.answer(
-                PLAYLIST_FULL.format(max_songs=max_songs),
-                show_alert=True,
+    if info.get('playlist_now_draft'):
+        messages.append(
+            PLAYLIST_OWNER_NOW_DRAFT.format(
+                min_songs=MIN_SONGS_TO_PUBLISH,
             )
-            return
+        )
 
-        user = db.get_user(user_id)
-        current_active = user.get('active_playlist_id') if user else None
-        if current_active == playlist_id:
-            await query.answer(PLAYLIST_ALREADY_ACTIVE, show_alert=True)
-            return
+    await context.bot.send_message(
+        chat_id=user_id,
+        text="\n".join(messages),
+    )
 
-        db.set_active_playlist(user_id, playlist_id)
-        await query.answer("پلی‌لیست فعال شد!", show_alert=False)
 
-        current_display = format_number(current_count)
-        maximum_display = "∞" if not max_songs else format_number(max_songs)
-        message_lines = [
-            PLAYLIST_ACTIVATED_FOR_UPLOAD.format(name=playlist.get('name', 'پلی‌لیست')),
-            PLAYLIST_CAPACITY_STATUS.format(
-                current=current_display,
-                maximum=maximum_display,
-            ),
-        ]
+@callback_router.route('add_')
+async def on_add_playlist(update: Update, context: ContextTypes.DEFAULT_TYPE, playlist_id: str):
+    """Add to playlist"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+
+    playlist = db.get_playlist(playlist_id)
+
+    if not playlist:
+        await query.answer(ERROR_NOT_FOUND)
+        return
+
+    if playlist.get('status') != 'published' and playlist.get('owner_id') != str(user_id):
+        await query.answer(PLAYLIST_NOT_PUBLISHED)
+        return
 
-        if not max_songs or current_count < max_songs:
-            message_lines.append(PLAYLIST_OWNER_ADD_HINT)
+    context.user_data['adding_from'] = playlist_id
 
+    # Show user's playlists
+    user_playlists = db.get_user_playlists(user_id)
+    if not user_playlists:
+        await query.answer("اول یه پلی‌لیست بساز!")
         await context.bot.send_message(
             chat_id=user_id,
-            text="\n".join(message_lines),
+            text=NEED_PLAYLIST_BEFORE_ADD,
         )
+        return
 
-    elif data.startswith('toggle_visibility_'):
-        playlist_id = data.replace('toggle_visibility_', '', 1)
-        new_state = db.toggle_playlist_visibility(user_id, playlist_id)
+    buttons = []
+    for pl in user_playlists:
+        buttons.append([
+            InlineKeyboardButton(
+                pl['name'],
+                callback_data=f"addto_{pl['id']}"
+            )
+        ])
 
-        if new_state is None:
-            await query.answer(ERROR_GENERAL, show_alert=True)
-            return
+    await query.edit_message_text(
+        CHOOSE_PLAYLIST_TO_ADD,
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
 
-        if new_state:
-            await query.answer(PLAYLIST_NOW_PRIVATE)
-        else:
-            await query.answer(PLAYLIST_NOW_PUBLIC)
 
-        await manage_playlist_visibility(update, context)
+@callback_router.route('play_')
+async def on_play(update: Update, context: ContextTypes.DEFAULT_TYPE, playlist_id: str):
+    """Play playlist"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-    # User quick actions
-    elif data == 'my_playlists':
-        await my_playlists(update, context)
+    playlist = await get_playable_playlist(query, user_id, playlist_id)
+    if not playlist:
+        return
 
-    elif data == 'added_playlists':
-        await show_added_playlists(update, context)
+    if playlist.get('songs'):
+        await query.answer(f"در حال پخش {playlist['name']}...")
+    else:
+        await query.answer("این پلی‌لیست خالیه!")
 
-    elif data == 'premium':
-        await premium_info(update, context)
+    await send_playlist_details(user_id, playlist, context, playlist_id)
 
-    elif data == 'manage_visibility':
-        await manage_playlist_visibility(update, context)
 
-    # Delete playlist
-    elif data.startswith('delete_'):
-        playlist_id = data.replace('delete_', '')
-        playlist = db.get_playlist(playlist_id)
+@callback_router.route('play_more:')
+async def on_play_more(update: Update, context: ContextTypes.DEFAULT_TYPE, playlist_id: str):
+    """Send the next page of a playlist being played"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-        if playlist and playlist['owner_id'] == str(user_id):
-            # Confirm
-            buttons = [
-                [InlineKeyboardButton(CONFIRM_YES, callback_data=f"confirm_delete_{playlist_id}")],
-                [InlineKeyboardButton(CONFIRM_NO, callback_data="cancel_delete")],
-            ]
-            await query.edit_message_text(
-                CONFIRM_DELETE,
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
+    playlist = await get_playable_playlist(query, user_id, playlist_id)
+    if not playlist:
+        return
 
-    # Confirm delete
-    elif data.startswith('confirm_delete_'):
-        playlist_id = data.replace('confirm_delete_', '')
-        deleted_messages = db.delete_playlist(playlist_id)
+    offset = playback_positions().get((user_id, playlist_id))
+    if offset is None or offset >= len(playlist.get('songs', [])):
+        await query.answer(PLAYBACK_EXPIRED, show_alert=True)
+        offset = None
+    else:
+        await query.answer()
 
-        for channel_id, message_id in deleted_messages:
-            try:
-                await context.bot.delete_message(
-                    chat_id=channel_id,
-                    message_id=message_id,
-                )
-            except BadRequest as exc:
-                logger.warning(
-                    "BadRequest while deleting storage message %s from channel %s: %s",
-                    message_id,
-                    channel_id,
-                    exc,
-                )
-            except Exception as exc:
-                logger.error(
-                    "Failed to delete storage message %s from channel %s: %s",
-                    message_id,
-                    channel_id,
-                    exc,
-                )
+    try:
+        await query.edit_message_reply_markup(reply_markup=None)
+    except BadRequest:
+        pass
 
-        await query.edit_message_text(PLAYLIST_DELETED)
+    if offset is not None:
+        send_playlist_page(user_id, playlist, playlist_id, offset, context)
 
-    # Cancel delete
-    elif data == 'cancel_delete':
-        await query.edit_message_text(CANCELLED)
 
-        # Toggle notifications
-    elif data == 'toggle_notif':
-        user = db.get_user(user_id)
-        current = user.get('notifications_enabled', True)
-        db.update_user(user_id, {'notifications_enabled': not current})
+async def get_playable_playlist(query, user_id: int, playlist_id: str) -> Optional[dict]:
+    """The playlist if this user may play it; otherwise answer the query and return None"""
+    playlist = db.get_playlist(playlist_id)
 
-        status = "خاموش" if current else "روشن"
-        await query.answer(f"نوتیفیکیشن‌ها {status} شد!")
+    if not playlist:
+        await query.answer(ERROR_NOT_FOUND)
+        return None
 
-        # Refresh settings menu
-        notif_status = "✅ فعال" if not current else "❌ غیرفعال"
-        message = f"""
-    ⚙️ **تنظیمات**
+    if playlist.get('status') != 'published' and playlist.get('owner_id') != str(user_id):
+        await query.answer(PLAYLIST_NOT_PUBLISHED)
+        return None
+    if playlist.get('is_private') and playlist.get('owner_id') != str(user_id):
+        await query.answer(PLAYLIST_PRIVATE_WARNING, show_alert=True)
+        return None
 
-    🔔 نوتیفیکیشن‌ها: {notif_status}
+    return playlist
 
-    از دکمه‌های زیر استفاده کن:
-    """
-        buttons = [
-            [InlineKeyboardButton(
-                "🔔 نوتیفیکیشن‌ها روشن/خاموش",
-                callback_data="toggle_notif"
-            )],
-            [InlineKeyboardButton("🔙 برگشت", callback_data="back_main")],
-        ]
-        await query.edit_message_text(
-            message,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup(buttons)
+
+@callback_router.route('set_active_add:')
+async def on_set_active_add(update: Update, context: ContextTypes.DEFAULT_TYPE, playlist_id: str):
+    """Make a playlist the upload target"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+
+    playlist = db.get_playlist(playlist_id)
+
+    if not playlist or playlist.get('owner_id') != str(user_id):
+        await query.answer(ERROR_NOT_FOUND, show_alert=True)
+        return
+
+    max_songs = playlist.get('max_songs', 0) or 0
+    current_count = len(playlist.get('songs', []))
+    if max_songs and current_count >= max_songs:
+        await query.answer(
+            PLAYLIST_FULL.format(max_songs=max_songs),
+            show_alert=True,
         )
+        return
 
-    # Back to main
-    elif data == 'back_main':
-        await query.message.delete()
+    user = db.get_user(user_id)
+    current_active = user.get('active_playlist_id') if user else None
+    if current_active == playlist_id:
+        await query.answer(PLAYLIST_ALREADY_ACTIVE, show_alert=True)
+        return
 
-    elif data == 'back_profile':
-        await profile(update, context)
+    db.set_active_playlist(user_id, playlist_id)
+    await query.answer("پلی‌لیست فعال شد!", show_alert=False)
+
+    current_display = format_number(current_count)
+    maximum_display = "∞" if not max_songs else format_number(max_songs)
+    message_lines = [
+        PLAYLIST_ACTIVATED_FOR_UPLOAD.format(name=playlist.get('name', 'پلی‌لیست')),
+        PLAYLIST_CAPACITY_STATUS.format(
+            current=current_display,
+            maximum=maximum_display,
+        ),
+    ]
 
-    # Buy premium
-    elif data == 'buy_premium':
-        plans = db.get_premium_plans()
+    if not max_songs or current_count < max_songs:
+        message_lines.append(PLAYLIST_OWNER_ADD_HINT)
 
-        if not plans:
-            await query.edit_message_text("فعلاً هیچ پلنی تعریف نشده!")
-            return
+    await context.bot.send_message(
+        chat_id=user_id,
+        text="\n".join(message_lines),
+    )
+
+
+@callback_router.route('toggle_visibility_')
+async def on_toggle_visibility(update: Update, context: ContextTypes.DEFAULT_TYPE, playlist_id: str):
+    """Toggle playlist private/public"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+
+    new_state = db.toggle_playlist_visibility(user_id, playlist_id)
+
+    if new_state is None:
+        await query.answer(ERROR_GENERAL, show_alert=True)
+        return
+
+    if new_state:
+        await query.answer(PLAYLIST_NOW_PRIVATE)
+    else:
+        await query.answer(PLAYLIST_NOW_PUBLIC)
+
+    await manage_playlist_visibility(update, context)
+
+
+@callback_router.route('my_playlists')
+async def on_my_playlists(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """User quick actions"""
+    await my_playlists(update, context)
+
+
+@callback_router.route('added_playlists')
+async def on_added_playlists(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Playlists the user saved songs from"""
+    await show_added_playlists(update, context)
+
+
+@callback_router.route('premium')
+async def on_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Premium info"""
+    await premium_info(update, context)
+
+
+@callback_router.route('manage_visibility')
+async def on_manage_visibility(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Playlist visibility settings"""
+    await manage_playlist_visibility(update, context)
+
+
+@callback_router.route('delete_')
+async def on_delete(update: Update, context: ContextTypes.DEFAULT_TYPE, playlist_id: str):
+    """Delete playlist (ask for confirmation)"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+
+    playlist = db.get_playlist(playlist_id)
 
+    if playlist and playlist['owner_id'] == str(user_id):
+        # Confirm
         buttons = [
-            [
-                InlineKeyboardButton(
-                    f"{plan['title']} — {format_number(plan['price'])} تومان",
-                    callback_data=f"buy_plan_{plan['id']}"
-                )
-            ]
-            for plan in plans
+            [InlineKeyboardButton(CONFIRM_YES, callback_data=f"confirm_delete_{playlist_id}")],
+            [InlineKeyboardButton(CONFIRM_NO, callback_data="cancel_delete")],
         ]
-
         await query.edit_message_text(
-            "یکی از پلن‌های زیر رو انتخاب کن:",
+            CONFIRM_DELETE,
             reply_markup=InlineKeyboardMarkup(buttons)
         )
 
-    elif data.startswith('buy_plan_'):
-        plan_id = data.replace('buy_plan_', '')
-        plan = db.get_premium_plan(plan_id)
 
-        if not plan:
-            await query.answer("پلن پیدا نشد!")
-            return
+@callback_router.route('confirm_delete_')
+async def on_confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE, playlist_id: str):
+    """Confirm delete"""
+    query = update.callback_query
 
-        price_text = format_number(plan['price'])
-        buttons = [
-            [InlineKeyboardButton("✅ فیلترشکن خاموشه، لینک بساز", callback_data=f"confirm_plan_{plan_id}")],
-            [InlineKeyboardButton("🔙 پلن‌های دیگر", callback_data="buy_premium")],
+    storage_gc.enqueue(db.delete_playlist(playlist_id))
+
+    await query.edit_message_text(PLAYLIST_DELETED)
+
+
+@callback_router.route('cancel_delete')
+async def on_cancel_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancel delete"""
+    query = update.callback_query
+
+    await query.edit_message_text(CANCELLED)
+
+
+@callback_router.route('toggle_notif')
+async def on_toggle_notif(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Toggle notifications"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+
+    user = db.get_user(user_id)
+    current = user.get('notifications_enabled', True)
+    db.update_user(user_id, {'notifications_enabled': not current})
+
+    status = "خاموش" if current else "روشن"
+    await query.answer(f"نوتیفیکیشن‌ها {status} شد!")
+
+    # Refresh settings menu
+    message, markup = build_settings_menu(db.get_user(user_id))
+    await query.edit_message_text(
+        message,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=markup
+    )
+
+
+@callback_router.route('toggle_digest')
+async def on_toggle_digest(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Toggle daily digest"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+
+    user = db.get_user(user_id)
+    current = user.get('notification_digest', False)
+    db.update_user(user_id, {'notification_digest': not current})
+
+    status = "خلاصه‌ی روزانه" if not current else "فوری"
+    await query.answer(f"حالت نوتیفیکیشن‌ها: {status}")
+
+    message, markup = build_settings_menu(db.get_user(user_id))
+    await query.edit_message_text(
+        message,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=markup
+    )
+
+
+@callback_router.route('back_main')
+async def on_back_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Back to main"""
+    query = update.callback_query
+
+    await query.message.delete()
+
+
+@callback_router.route('back_profile')
+async def on_back_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Back to profile"""
+    await profile(update, context)
+
+
+@callback_router.route('buy_premium')
+async def on_buy_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Buy premium"""
+    query = update.callback_query
+
+    plans = db.get_premium_plans()
+
+    if not plans:
+        await query.edit_message_text("فعلاً هیچ پلنی تعریف نشده!")
+        return
+
+    buttons = [
+        [
+            InlineKeyboardButton(
+                f"{plan['title']} — {format_number(plan['price'])} تومان",
+                callback_data=f"buy_plan_{plan['id']}"
+            )
         ]
+        for plan in plans
+    ]
 
-        await query.edit_message_text(
-            PREMIUM_VPN_WARNING.format(
-                title=escape_markdown(plan['title']),
-                price=price_text,
-                days=plan['duration_days'],
-            ),
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup(buttons)
-        )
+    await query.edit_message_text(
+        "یکی از پلن‌های زیر رو انتخاب کن:",
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
 
-    elif data.startswith('confirm_plan_'):
-        plan_id = data.replace('confirm_plan_', '')
-        plan = db.get_premium_plan(plan_id)
 
-        if not plan:
-            await query.answer("پلن پیدا نشد!", show_alert=True)
-            return
+@callback_router.route('buy_plan_')
+async def on_buy_plan(update: Update, context: ContextTypes.DEFAULT_TYPE, plan_id: str):
+    """Show a plan before payment"""
+    query = update.callback_query
+
+    plan = db.get_premium_plan(plan_id)
+
+    if not plan:
+        await query.answer("پلن پیدا نشد!")
+        return
+
+    price_text = format_number(plan['price'])
+    buttons = [
+        [InlineKeyboardButton("✅ فیلترشکن خاموشه، لینک بساز", callback_data=f"confirm_plan_{plan_id}")],
+        [InlineKeyboardButton("🔙 پلن‌های دیگر", callback_data="buy_premium")],
+    ]
+
+    await query.edit_message_text(
+        PREMIUM_VPN_WARNING.format(
+            title=escape_markdown(plan['title']),
+            price=price_text,
+            days=plan['duration_days'],
+        ),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
+
+
+@callback_router.route('confirm_plan_')
+async def on_confirm_plan(update: Update, context: ContextTypes.DEFAULT_TYPE, plan_id: str):
+    """Create the payment link for a plan"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+
+    plan = db.get_premium_plan(plan_id)
+
+    if not plan:
+        await query.answer("پلن پیدا نشد!", show_alert=True)
+        return
 
-        payment_data = zarinpal.create_payment(
+    # Repeated taps on the same plan reuse the authority from the last one
+    payment_data = reusable_pending_payment(user_id, plan)
+    if not payment_data:
+        payment_data = await zarinpal.create_payment(
             amount=plan['price'],
             description=f"خرید {plan['title']} پلی‌لیست - {user_id}",
             user_id=user_id
         )
-
         if payment_data and payment_data.get('payment_url') and payment_data.get('authority'):
             db.set_pending_payment(
                 user_id,
@@ -2154,89 +2688,242 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 duration_days=plan['duration_days'],
             )
 
-            buttons = [
-                [InlineKeyboardButton("💳 پرداخت", url=payment_data['payment_url'])],
-                [InlineKeyboardButton("🔙 پلن‌های دیگر", callback_data="buy_premium")],
-            ]
+    if payment_data and payment_data.get('payment_url') and payment_data.get('authority'):
+        buttons = [
+            [InlineKeyboardButton("💳 پرداخت", url=payment_data['payment_url'])],
+            [InlineKeyboardButton("🔙 پلن‌های دیگر", callback_data="buy_premium")],
+        ]
 
-            await query.edit_message_text(
-                PREMIUM_PAYMENT_INSTRUCTIONS.format(
-                    title=escape_markdown(plan['title']),
-                    price=plan['price'],
-                    days=plan['duration_days'],
-                ),
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
-        else:
-            error_buttons = [[InlineKeyboardButton("🔙 پلن‌های دیگر", callback_data="buy_premium")]]
-            await query.edit_message_text(
-                "مشکلی در ایجاد لینک پرداخت پیش اومد! لطفاً بعداً تلاش کن.",
-                reply_markup=InlineKeyboardMarkup(error_buttons)
-            )
+        await query.edit_message_text(
+            PREMIUM_PAYMENT_INSTRUCTIONS.format(
+                title=escape_markdown(plan['title']),
+                price=plan['price'],
+                days=plan['duration_days'],
+            ),
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=InlineKeyboardMarkup(buttons)
+        )
+    else:
+        error_buttons = [[InlineKeyboardButton("🔙 پلن‌های دیگر", callback_data="buy_premium")]]
+        await query.edit_message_text(
+            PAYMENT_LINK_FAILED if zarinpal.available else PAYMENT_GATEWAY_DOWN,
+            reply_markup=InlineKeyboardMarkup(error_buttons)
+        )
 
-    elif data == 'verify_payment':
-        user = db.get_user(user_id)
-        pending = user.get('pending_payment') if user else None
 
-        if not pending:
-            await query.answer(PREMIUM_NO_PENDING_PAYMENT, show_alert=True)
-            return
+@callback_router.route('verify_payment')
+async def on_verify_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Verify pending payment"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-        authority = pending.get('authority')
-        amount = pending.get('amount')
-        plan_id = pending.get('plan_id')
-        duration_days = pending.get('duration_days') or 30
+    user = db.get_user(user_id)
+    pending = user.get('pending_payment') if user else None
 
-        if not authority or not amount:
-            await query.answer(PREMIUM_VERIFY_FAILED, show_alert=True)
-            return
+    if not pending:
+        await query.answer(PREMIUM_NO_PENDING_PAYMENT, show_alert=True)
+        return
+
+    if not pending.get('authority') or not pending.get('amount'):
+        await query.answer(PREMIUM_VERIFY_FAILED, show_alert=True)
+        return
+
+    verified = await _verify_and_activate(user_id)
+    if verified:
+        limits = premium_limits_display()
+        success_buttons = [[InlineKeyboardButton("🔙 برگشت", callback_data="back_main")]]
+
+        await query.edit_message_text(
+            PREMIUM_ACTIVATED.format(date=premium_expiry_display(user_id), **limits),
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=InlineKeyboardMarkup(success_buttons)
+        )
+
+        await context.bot.send_message(
+            chat_id=user_id,
+            text=PREMIUM_BENEFITS_REMINDER.format(**limits),
+            parse_mode=ParseMode.MARKDOWN,
+        )
+
+        await query.answer("پرداخت با موفقیت تایید شد!", show_alert=True)
+    elif verified is None:
+        await query.answer(PAYMENT_GATEWAY_DOWN, show_alert=True)
+    else:
+        await query.answer(PREMIUM_VERIFY_FAILED, show_alert=True)
+
+
+# ===== PAYMENTS =====
+
+def premium_limits_display() -> Dict[str, str]:
+    """Premium limits formatted for PREMIUM_ACTIVATED / PREMIUM_BENEFITS_REMINDER"""
+    return {
+        'playlist_limit': "بی‌نهایت" if not PREMIUM_PLAYLIST_LIMIT else str(PREMIUM_PLAYLIST_LIMIT),
+        'songs_limit': "بی‌نهایت" if not PREMIUM_SONGS_PER_PLAYLIST else str(PREMIUM_SONGS_PER_PLAYLIST),
+        'follow_limit': "بی‌نهایت" if not PREMIUM_FOLLOW_LIMIT else format_number(PREMIUM_FOLLOW_LIMIT),
+    }
+
+
+def premium_expiry_display(user_id: int) -> str:
+    """User's premium expiry date for display"""
+    user = db.get_user(user_id)
+    expiry_raw = user.get('premium_until') if user else None
+    return format_date(expiry_raw) if expiry_raw else "—"
+
+
+# user_id -> [lock, number of callers holding or waiting for it]
+_payment_locks: Dict[int, list] = {}
+
+
+def reusable_pending_payment(user_id: int, plan: Dict) -> Optional[Dict[str, str]]:
+    """Payment link created for the same plan within PAYMENT_AUTHORITY_REUSE_MINUTES"""
+    user = db.get_user(user_id)
+    pending = user.get('pending_payment') if user else None
+    if not pending or not pending.get('authority'):
+        return None
+
+    if pending.get('plan_id') != plan.get('id') or pending.get('amount') != plan.get('price'):
+        return None
+
+    try:
+        created_at = datetime.fromisoformat(pending.get('created_at') or '')
+    except ValueError:
+        return None
+    if datetime.now() - created_at > timedelta(minutes=PAYMENT_AUTHORITY_REUSE_MINUTES):
+        return None
+
+    return {
+        'payment_url': zarinpal.payment_link(pending['authority']),
+        'authority': pending['authority'],
+    }
+
+
+async def _verify_and_activate(user_id: int, authority: Optional[str] = None) -> Optional[bool]:
+    """Verify user's pending payment and activate premium
+
+    Returns True if activated, False if the gateway says it isn't paid and
+    None if there was nothing to verify or the gateway couldn't be reached.
+    The button, the payment callback and the reconciler may race on the same
+    payment; a per-user lock makes sure only one of them activates it.
+    """
+    entry = _payment_locks.get(user_id)
+    if entry is None:
+        entry = _payment_locks[user_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+
+    try:
+        async with entry[0]:
+            user = db.get_user(user_id)
+            pending = user.get('pending_payment') if user else None
+            if not pending or not pending.get('authority') or not pending.get('amount'):
+                return None
+
+            if authority and authority != pending['authority']:
+                return None
+
+            amount = pending['amount']
+            verified = await zarinpal.verify_payment(pending['authority'], amount)
+            if not verified:
+                return verified
 
-        if zarinpal.verify_payment(authority, amount):
             db.activate_premium(
                 user_id,
-                days=duration_days,
-                plan_id=plan_id,
+                days=pending.get('duration_days') or 30,
+                plan_id=pending.get('plan_id'),
                 price=amount,
+                authority=pending['authority'],
             )
             db.clear_pending_payment(user_id)
+            return True
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _payment_locks[user_id]
 
-            user = db.get_user(user_id)
-            expiry_raw = user.get('premium_until') if user else None
-            expiry_date = format_date(expiry_raw) if expiry_raw else "—"
 
-            success_buttons = [[InlineKeyboardButton("🔙 برگشت", callback_data="back_main")]]
+async def confirm_pending_payment(user_id: int, authority: Optional[str] = None) -> bool:
+    """Verify user's pending ZarinPal payment and activate premium
 
-            playlist_limit_display = "بی‌نهایت" if not PREMIUM_PLAYLIST_LIMIT else str(PREMIUM_PLAYLIST_LIMIT)
-            songs_limit_display = "بی‌نهایت" if not PREMIUM_SONGS_PER_PLAYLIST else str(PREMIUM_SONGS_PER_PLAYLIST)
-            follow_limit_display = (
-                "بی‌نهایت" if not PREMIUM_FOLLOW_LIMIT else format_number(PREMIUM_FOLLOW_LIMIT)
-            )
+    `authority`, when given (payment callback), must match the pending one.
+    """
+    return await _verify_and_activate(user_id, authority) is True
 
-            await query.edit_message_text(
-                PREMIUM_ACTIVATED.format(
-                    date=expiry_date,
-                    playlist_limit=playlist_limit_display,
-                    songs_limit=songs_limit_display,
-                    follow_limit=follow_limit_display,
-                ),
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup(success_buttons)
-            )
 
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=PREMIUM_BENEFITS_REMINDER.format(
-                    playlist_limit=playlist_limit_display,
-                    songs_limit=songs_limit_display,
-                    follow_limit=follow_limit_display,
-                ),
-                parse_mode=ParseMode.MARKDOWN,
-            )
+async def notify_premium_activated(bot, user_id: int):
+    """Tell the user their premium is active"""
+    limits = premium_limits_display()
+    await bot.send_message(
+        chat_id=user_id,
+        text=PREMIUM_ACTIVATED.format(date=premium_expiry_display(user_id), **limits),
+        parse_mode=ParseMode.MARKDOWN,
+    )
 
-            await query.answer("پرداخت با موفقیت تایید شد!", show_alert=True)
-        else:
-            await query.answer(PREMIUM_VERIFY_FAILED, show_alert=True)
+
+async def handle_payment_callback(bot, user_id: int, authority: Optional[str], status: Optional[str]) -> bool:
+    """ZarinPal redirect (webhook mode): verify, activate and tell the user"""
+    if status != 'OK':
+        return False
+
+    if await confirm_pending_payment(user_id, authority):
+        await notify_premium_activated(bot, user_id)
+        return True
+
+    # The reconciler or the check button may have activated this payment
+    # first (and told the user); it is paid, so show the success page
+    return bool(authority) and ledger.has_authority(authority, user_id)
+
+
+async def reconcile_pending_payments(context: ContextTypes.DEFAULT_TYPE):
+    """Verify payments whose users never came back to confirm them
+
+    Works from the pending-payment index, a batch at a time with bounded
+    concurrency. Unpaid checks back off exponentially; payments the gateway
+    still rejects after PAYMENT_PENDING_TTL_HOURS are dropped.
+    """
+    if not zarinpal.available:
+        return
+
+    due = db.get_due_pending_payments()
+    if not due:
+        return
+
+    semaphore = asyncio.Semaphore(PAYMENT_RECONCILE_CONCURRENCY)
+    expire_before = (datetime.now() - timedelta(hours=PAYMENT_PENDING_TTL_HOURS)).isoformat()
+    results = {'activated': 0, 'expired': 0, 'unreachable': 0}
+
+    async def reconcile(user_id: int, pending: Dict):
+        async with semaphore:
+            verified = await _verify_and_activate(user_id, pending.get('authority'))
+
+        if verified:
+            results['activated'] += 1
+            try:
+                await notify_premium_activated(context.bot, user_id)
+            except Exception as exc:
+                logger.warning("Couldn't notify %s about premium activation: %s", user_id, exc)
+            return
+
+        user = db.get_user(user_id)
+        if not user or user.get('pending_payment') is not pending:
+            # Confirmed or replaced meanwhile (button, callback, new plan)
+            return
+
+        if verified is False and (pending.get('created_at') or '') < expire_before:
+            results['expired'] += 1
+            db.clear_pending_payment(user_id, save=False)
+            return
+
+        if verified is None:
+            results['unreachable'] += 1
+        delay = min(PAYMENT_RECONCILE_INTERVAL * 2 ** pending.get('checks', 0), PAYMENT_RECONCILE_MAX_BACKOFF)
+        db.record_payment_check(user_id, datetime.now() + timedelta(seconds=delay), save=False)
+
+    await asyncio.gather(*(reconcile(user_id, pending) for user_id, pending in due))
+    db.save_data()
+
+    logger.info(
+        "Reconciled %s pending payments: %s activated, %s expired, %s gateway errors",
+        len(due), results['activated'], results['expired'], results['unreachable'],
+    )
 
 
 # ===== ADMIN HANDLERS =====
@@ -2269,8 +2956,14 @@ async def admin_stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(user_id):
         return
 
-    stats = db.get_global_stats()
-    stats_text = format_admin_stats(stats)
+    stats = await analytics.get_global_stats()
+    stats_text = (
+        format_admin_stats(stats)
+        + format_send_lanes(context.bot.rate_limiter)
+        + format_notification_savings(outbox)
+        + format_callback_routes(callback_router)
+        + format_cache_stats(caches)
+    )
 
     await update.message.reply_text(stats_text, parse_mode=ParseMode.MARKDOWN)
 
@@ -2321,17 +3014,16 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await settings(update, context)
 
 
-async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Settings menu"""
-    user_id = update.effective_user.id
-    user = db.get_user(user_id)
-
+def build_settings_menu(user: dict) -> Tuple[str, InlineKeyboardMarkup]:
+    """Settings message and keyboard for user"""
     notif_status = "✅ فعال" if user.get('notifications_enabled', True) else "❌ غیرفعال"
+    digest_status = "📬 خلاصه‌ی روزانه" if user.get('notification_digest', False) else "⚡️ فوری"
 
     message = f"""
 ⚙️ **تنظیمات**
 
 🔔 نوتیفیکیشن‌ها: {notif_status}
+📨 لایک‌ها و افزودن‌ها: {digest_status}
 
 از دکمه‌های زیر استفاده کن:
 """
@@ -2341,13 +3033,25 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "🔔 نوتیفیکیشن‌ها روشن/خاموش",
             callback_data="toggle_notif"
         )],
+        [InlineKeyboardButton(
+            "📨 فوری/خلاصه‌ی روزانه",
+            callback_data="toggle_digest"
+        )],
         [InlineKeyboardButton("🔙 برگشت", callback_data="back_main")],
     ]
 
+    return message, InlineKeyboardMarkup(buttons)
+
+
+async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Settings menu"""
+    user_id = update.effective_user.id
+    message, markup = build_settings_menu(db.get_user(user_id))
+
     await update.message.reply_text(
         message,
         parse_mode=ParseMode.MARKDOWN,
-        reply_markup=InlineKeyboardMarkup(buttons)
+        reply_markup=markup
     )
 
 
@@ -2365,7 +3069,16 @@ def main():
         return
 
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .rate_limiter(SendScheduler())
+        .concurrent_updates(KeyedUpdateProcessor())
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # Add handlers
     application.add_handler(CommandHandler("start", start))
@@ -2419,6 +3132,16 @@ def main():
     )
     application.add_handler(admin_conv_handler)
 
+    # Admin broadcast conversation
+    broadcast_conv_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(admin_broadcast_type, pattern='^broadcast_(all|premium|free)$')],
+        states={
+            BROADCAST_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_broadcast_send)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+    )
+    application.add_handler(broadcast_conv_handler)
+
     # Admin premium callbacks
     application.add_handler(CallbackQueryHandler(admin_premium, pattern='^admin_premium$'))
     application.add_handler(CallbackQueryHandler(admin_premium_list, pattern='^admin_premium_list$'))
@@ -2426,6 +3149,7 @@ def main():
     application.add_handler(CallbackQueryHandler(admin_plan_delete_start, pattern='^admin_plan_delete_.+$'))
     application.add_handler(CallbackQueryHandler(admin_plan_delete_confirm, pattern='^admin_plan_delete_confirm_.+$'))
     application.add_handler(CallbackQueryHandler(admin_stats_callback, pattern='^admin_stats$'))
+    application.add_handler(CallbackQueryHandler(admin_broadcast_start, pattern='^admin_broadcast$'))
     application.add_handler(CallbackQueryHandler(admin_settings_callback, pattern='^admin_settings$'))
     application.add_handler(CallbackQueryHandler(admin_delete_mood_start, pattern='^admin_delete_mood_[a-z0-9_]+$'))
     application.add_handler(CallbackQueryHandler(admin_delete_mood_confirm, pattern='^admin_delete_mood_confirm_[a-z0-9_]+$'))
@@ -2448,12 +3172,33 @@ def main():
             time=datetime_time(hour=22, minute=0),
             name='daily_top_song',
         )
+        application.job_queue.run_repeating(
+            reconcile_pending_payments,
+            interval=PAYMENT_RECONCILE_INTERVAL,
+            first=PAYMENT_RECONCILE_INTERVAL,
+            name='payment_reconcile',
+        )
+        application.job_queue.run_repeating(
+            reconcile_storage_messages,
+            interval=STORAGE_GC_RECONCILE_INTERVAL,
+            first=STORAGE_GC_RECONCILE_INTERVAL,
+            name='storage_reconcile',
+        )
+        application.job_queue.run_repeating(
+            refresh_analytics_snapshot,
+            interval=ANALYTICS_SNAPSHOT_INTERVAL,
+            first=0,
+            name='analytics_snapshot',
+        )
 
     # Start bot
     print("🎵 پلی‌لیست ربات راه‌اندازی شد! 🚀")
     print(f"📍 ربات: {BOT_NAME}")
     print(f"👨‍💼 ادمین‌ها: {ADMIN_IDS}")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if USE_WEBHOOK:
+        run_webhook(application, payment_handler=handle_payment_callback)
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,227 @@
+# broadcasts.py - Persistent Broadcast Engine
+# موتور ارسال همگانی با قابلیت ادامه بعد از ری‌استارت
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from config import *
+from database import db
+from ratelimit import LANE_BULK
+from texts import BROADCAST_ADMIN_MESSAGE, BROADCAST_PROGRESS, BROADCAST_REPORT
+from utils import format_number
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_chat_unreachable(exc: Exception) -> bool:
+    """True for errors meaning the user can't receive messages at all"""
+    if isinstance(exc, Forbidden):
+        return True
+    return isinstance(exc, BadRequest) and 'chat not found' in str(exc).lower()
+
+
+async def send_with_retry(
+    send: Callable[[], Awaitable],
+    user_id: int,
+    max_attempts: int = BROADCAST_MAX_ATTEMPTS,
+) -> bool:
+    """Await ``send()`` with backoff on flood control and network errors
+
+    Users whose chat rejects the message are marked unreachable (saved with
+    the caller's next checkpoint) so later fan-outs skip them.
+    """
+    for attempt in range(max_attempts):
+        try:
+            await send()
+            db.mark_user_reachable(user_id, save=False)
+            return True
+        except RetryAfter as exc:
+            # The scheduler already retried; back off harder before the next try
+            await asyncio.sleep(exc.retry_after + 0.1)
+        except (BadRequest, Forbidden) as exc:
+            if is_chat_unreachable(exc):
+                logger.info("User %s is unreachable: %s", user_id, exc)
+                db.mark_user_unreachable(user_id, save=False)
+            else:
+                logger.error("Failed to send to %s: %s", user_id, exc)
+            return False
+        except NetworkError as exc:
+            logger.warning("Network error sending to %s: %s", user_id, exc)
+            await asyncio.sleep(min(2 ** attempt, 30))
+        except Exception as exc:
+            logger.error("Failed to send to %s: %s", user_id, exc)
+            return False
+
+    return False
+
+
+async def fan_out(
+    recipient_ids: List[int],
+    send_one: Callable[[int], Awaitable[bool]],
+    checkpoint: Callable[[int, int, int], Awaitable],
+    batch_size: int = BROADCAST_BATCH_SIZE,
+    concurrency: int = BROADCAST_CONCURRENCY,
+):
+    """Run ``send_one`` for every recipient, a batch at a time
+
+    Sends inside a batch run concurrently (the send scheduler still paces
+    them); after each batch ``checkpoint(last_id, delivered, failed)`` is
+    awaited so the caller can persist a resume cursor.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def guarded(user_id: int) -> bool:
+        async with semaphore:
+            return await send_one(user_id)
+
+    for start in range(0, len(recipient_ids), batch_size):
+        batch = recipient_ids[start:start + batch_size]
+        results = await asyncio.gather(*(guarded(user_id) for user_id in batch))
+        delivered = sum(1 for ok in results if ok)
+        await checkpoint(batch[-1], delivered, len(batch) - delivered)
+
+
+class BroadcastWorker:
+    """Send stored broadcast jobs in the background, checkpointing a recipient cursor
+
+    Recipients are walked in ascending user id order and the cursor is the last
+    id of the latest finished batch, so a restart resumes right after it.
+    """
+
+    def __init__(
+        self,
+        database,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        batch_size: int = BROADCAST_BATCH_SIZE,
+        max_attempts: int = BROADCAST_MAX_ATTEMPTS,
+        progress_interval: float = BROADCAST_PROGRESS_INTERVAL,
+    ):
+        self.db = database
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.progress_interval = progress_interval
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, application, job_id: str):
+        """Start (or resume) a job unless it is already running"""
+        task = self._tasks.get(job_id)
+        if task and not task.done():
+            return
+
+        # Not Application.create_task: stop() would wait for the whole job
+        task = asyncio.create_task(self._run(application.bot, job_id), name=f"broadcast:{job_id}")
+        task.add_done_callback(self._log_failure)
+        self._tasks[job_id] = task
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.error("Broadcast task %s failed", task.get_name(), exc_info=task.exception())
+
+    async def stop(self):
+        """Cancel running jobs; they resume from their checkpoint on next start"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def resume_all(self, application):
+        """Resume every unfinished job, e.g. after a restart"""
+        for job in self.db.get_running_broadcasts():
+            logger.info("Resuming broadcast %s after cursor %s", job['id'], job.get('cursor'))
+            self.submit(application, job['id'])
+
+    async def _report(self, bot, job: Dict, text: str):
+        """Edit the admin's status message with progress"""
+        if not job.get('status_chat_id') or not job.get('status_message_id'):
+            return
+
+        try:
+            await bot.edit_message_text(
+                chat_id=job['status_chat_id'],
+                message_id=job['status_message_id'],
+                text=text,
+            )
+        except BadRequest as exc:
+            if 'message is not modified' not in str(exc).lower():
+                logger.warning("Failed to update broadcast status %s: %s", job['id'], exc)
+        except Exception as exc:
+            logger.warning("Failed to update broadcast status %s: %s", job['id'], exc)
+
+    def _progress_text(self, job: Dict) -> str:
+        done = job['sent'] + job['failed'] + job.get('skipped', 0)
+        return BROADCAST_PROGRESS.format(
+            sent=format_number(job['sent']),
+            failed=format_number(job['failed']),
+            skipped=format_number(job.get('skipped', 0)),
+            done=format_number(done),
+            total=format_number(max(job.get('total', 0), done)),
+        )
+
+    async def _run(self, bot, job_id: str):
+        job = self.db.get_broadcast(job_id)
+        if not job or job.get('status') != 'running':
+            return
+
+        text = BROADCAST_ADMIN_MESSAGE.format(text=job['text'])
+        recipients, skipped = self.db.filter_reachable(
+            self.db.get_broadcast_recipient_ids(job['audience'], after=job.get('cursor'))
+        )
+        if skipped:
+            self.db.update_broadcast(job_id, skipped=job.get('skipped', 0) + skipped)
+        last_report = 0.0
+
+        async def send_one(user_id: int) -> bool:
+            return await send_with_retry(
+                lambda: bot.send_message(
+                    chat_id=user_id,
+                    text=text,
+                    parse_mode=ParseMode.MARKDOWN,
+                    rate_limit_args=LANE_BULK,
+                ),
+                user_id,
+                self.max_attempts,
+            )
+
+        async def checkpoint(last_id: int, delivered: int, failed: int):
+            nonlocal last_report
+            self.db.update_broadcast(
+                job_id,
+                cursor=last_id,
+                sent=job['sent'] + delivered,
+                failed=job['failed'] + failed,
+            )
+
+            now = time.monotonic()
+            if now - last_report >= self.progress_interval:
+                last_report = now
+                await self._report(bot, job, self._progress_text(job))
+
+        await fan_out(recipients, send_one, checkpoint, self.batch_size, self.concurrency)
+
+        self.db.update_broadcast(job_id, status='done', finished_at=datetime.now().isoformat())
+
+        report = BROADCAST_REPORT.format(
+            sent=format_number(job['sent']),
+            failed=format_number(job['failed']),
+            skipped=format_number(job.get('skipped', 0)),
+        )
+        await self._report(bot, job, report)
+
+        try:
+            await bot.send_message(chat_id=int(job['admin_id']), text=report)
+        except Exception as exc:
+            logger.error("Failed to send broadcast report for %s: %s", job_id, exc)
+
+
+# Initialize broadcast worker
+broadcaster = BroadcastWorker(db)
@@ -0,0 +1,163 @@
+# cache.py - In-memory Caches
+# کش حافظه با محدودیت اندازه و زمان انقضا
+
+import functools
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+from config import *
+
+
+# Data version namespaces; mutations bump them, cached reads depend on them
+PLAYLISTS = 'playlists'
+USERS = 'users'
+# Which playlists are listed and what they contain (publish, visibility,
+# songs, moods); unlike PLAYLISTS it isn't bumped by plays and likes
+CATALOG = 'catalog'
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Size-bounded LRU cache whose entries also expire after `ttl` seconds
+
+    Each entry remembers the versions of the data it was computed from; an
+    entry whose versions are behind the registry's is treated as a miss.
+    """
+
+    def __init__(self, name: str, maxsize: int = CACHE_DEFAULT_MAXSIZE, ttl: float = CACHE_DEFAULT_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, Tuple]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, versions: Tuple = (), default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+
+        value, expires_at, entry_versions = entry
+        if expires_at <= time.monotonic() or entry_versions != versions:
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, versions: Tuple = (), ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (value, expires_at, versions)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class CacheRegistry:
+    """Named caches plus the data versions they are invalidated by"""
+
+    def __init__(self):
+        self._caches: Dict[str, LRUCache] = {}
+        self._versions: Dict[str, int] = {}
+
+    def get(self, name: str, maxsize: int = CACHE_DEFAULT_MAXSIZE, ttl: float = CACHE_DEFAULT_TTL) -> LRUCache:
+        """The cache called `name`, created on first use"""
+        cache = self._caches.get(name)
+        if cache is None:
+            cache = self._caches[name] = LRUCache(name, maxsize, ttl)
+        return cache
+
+    def version(self, namespace: str) -> int:
+        return self._versions.get(namespace, 0)
+
+    def versions(self, namespaces: Iterable[str]) -> Tuple[int, ...]:
+        return tuple(self._versions.get(namespace, 0) for namespace in namespaces)
+
+    def bump(self, *namespaces: str):
+        """Invalidate everything computed from these namespaces"""
+        for namespace in namespaces:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def clear(self):
+        for cache in self._caches.values():
+            cache.clear()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: cache.stats() for name, cache in self._caches.items()}
+
+
+caches = CacheRegistry()
+
+
+def memoize(name: str, depends: Iterable[str], maxsize: int = CACHE_DEFAULT_MAXSIZE, ttl: float = CACHE_DEFAULT_TTL):
+    """Cache a Database read method until `depends` are bumped or `ttl` passes
+
+    Arguments must be hashable. Lists are returned as copies so callers can
+    sort or slice them without touching the cached value.
+    """
+    depends = tuple(depends)
+
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = caches.get(name, maxsize, ttl)
+            key = (args, tuple(sorted(kwargs.items())))
+            versions = caches.versions(depends)
+
+            value = cache.get(key, versions, _MISSING)
+            if value is _MISSING:
+                value = method(self, *args, **kwargs)
+                cache.set(key, value, versions)
+
+            return list(value) if isinstance(value, list) else value
+
+        wrapper.cache_name = name
+        return wrapper
+
+    return decorator
+
+
+def invalidates(*namespaces: str):
+    """Bump `namespaces` after the decorated mutation runs"""
+
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            try:
+                return method(*args, **kwargs)
+            finally:
+                caches.bump(*namespaces)
+
+        return wrapper
+
+    return decorator
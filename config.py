@@ -46,10 +46,36 @@ PREMIUM_SONGS_PER_PLAYLIST = 3
 
 # ====== PLAYLIST SETTINGS ======
 MIN_SONGS_TO_PUBLISH = 3
+PLAYBACK_PAGE_SIZE = 5  # تعداد آهنگ‌هایی که با هر بار پخش فرستاده میشه؛ بقیه با دکمه «بعدی» (0 = همه با هم)
+PLAYBACK_POSITION_TTL = 6 * 3600  # ثانیه؛ تا این مدت دکمه «بعدی» از همون جایی که کاربر بود ادامه میده
+PLAYBACK_POSITION_CACHE_SIZE = 10000  # حداکثر پخش نیمه‌تمام که جاشون نگه داشته میشه
+PLAYBACK_ALBUM_MIN_SONGS = 4  # پلی‌لیست‌هایی با حداقل این تعداد آهنگ به شکل آلبوم فرستاده میشن (0 = خاموش)
+PLAYBACK_ALBUM_SIZE = 10  # حداکثر آهنگ در هر آلبوم (سقف تلگرام ۱۰ تاست)
+
+# ====== UPLOADS ======
+# آهنگ‌هایی که پشت‌سرهم یا به شکل آلبوم فرستاده میشن با هم پردازش میشن و یک جواب می‌گیرن
+UPLOAD_BATCH_WINDOW = 1.5  # ثانیه سکوت بعد از آخرین آهنگ تا دسته پردازش بشه
+UPLOAD_BATCH_MAX_SIZE = 20  # دسته‌ی بزرگ‌تر از این فوراً پردازش میشه
+
+# ====== STORAGE CHANNEL CLEANUP ======
+# پیام‌هایی از کانال ذخیره که دیگه هیچ آهنگی بهشون اشاره نمی‌کنه در پس‌زمینه پاک میشن
+STORAGE_GC_PATH = "data/storage_gc.sqlite3"
+STORAGE_GC_BATCH_SIZE = 100  # پیام‌هایی که در هر دور بررسی میشن
+STORAGE_GC_CONCURRENCY = 5  # درخواست حذف همزمان
+STORAGE_GC_MAX_ATTEMPTS = 5
+STORAGE_GC_POLL_INTERVAL = 30  # ثانیه؛ برای حذف‌هایی که باید دوباره امتحان بشن
+STORAGE_GC_RECONCILE_INTERVAL = 6 * 3600  # هر چند ثانیه پیام‌های یتیم کانال پیدا بشن
+STORAGE_GC_ORPHAN_GRACE = 3600  # پیامی که این‌قدر بی‌استفاده مونده یتیم حساب میشه
 
 # ====== DATABASE ======
 DATABASE_PATH = "data/users.json"
 
+# ====== ANALYTICS ======
+# آمار سنگین (رتبه‌بندی، ترند، جستجو) روی یک اسنپ‌شات فقط‌خواندنی در پروسس جدا محاسبه میشه
+ANALYTICS_SNAPSHOT_PATH = "data/analytics_snapshot.pickle"
+ANALYTICS_SNAPSHOT_INTERVAL = 60  # ثانیه
+ANALYTICS_WORKERS = 2
+
 # Create data directory
 if not os.path.exists("data"):
     os.makedirs("data")
@@ -80,7 +106,66 @@ LEADERBOARD_TOP_COUNT = 20
 ENABLE_NOTIFICATIONS = True
 BOT_NAME = "پلی‌لیست"
 BOT_USERNAME = "@PlayList4_Bot"
-NOTIFICATION_DELAY = 0.2
+
+# ====== RATE LIMITS ======
+# محدودیت‌های تلگرام برای ارسال پیام؛ همه‌ی ارسال‌ها از زمان‌بند مرکزی رد میشن
+GLOBAL_SEND_RATE = 30  # پیام در ثانیه برای کل ربات
+GLOBAL_SEND_BURST = 30
+SEND_MAX_RETRIES = 3  # تلاش دوباره بعد از RetryAfter
+# سهم هر صف از ظرفیت ارسال: پاسخ‌های کاربر > نوتیفیکیشن > ارسال همگانی
+SEND_LANE_WEIGHTS = {
+    'interactive': 8,
+    'notification': 3,
+    'bulk': 1,
+}
+INTERACTIVE_MAX_WAIT = 0.5  # حداکثر تاخیر مجاز پاسخ‌های تعاملی (ثانیه)
+CHAT_SEND_RATE = 1.0  # پیام در ثانیه برای چت خصوصی
+CHAT_SEND_BURST = 3
+GROUP_SEND_RATE = 20 / 60  # ۲۰ پیام در دقیقه برای گروه‌ها و کانال‌ها
+GROUP_SEND_BURST = 1
+CHAT_BUCKET_IDLE_TTL = 600  # حذف محدودکننده‌ی چت‌هایی که این مدت پیامی نگرفتن (ثانیه)
+CHAT_BUCKET_PRUNE_INTERVAL = 60  # فاصله‌ی پاک‌سازی محدودکننده‌های بیکار (ثانیه)
+
+# ====== UPDATE PROCESSING ======
+# آپدیت‌های کاربرهای مختلف همزمان پردازش میشن؛ آپدیت‌های یک کاربر به ترتیب
+UPDATE_CONCURRENCY = 32  # حداکثر هندلرهای همزمان
+UPDATE_MAX_PENDING = 1024  # حداکثر آپدیت‌های در حال پردازش یا منتظر نوبت
+
+# ====== BROADCAST ======
+# ارسال همگانی در پس‌زمینه با ذخیره‌ی پیشرفت بعد از هر دسته
+BROADCAST_BATCH_SIZE = 50  # تعداد گیرنده در هر دسته (نقطه‌ی ذخیره)
+BROADCAST_CONCURRENCY = 10  # ارسال همزمان در هر دسته
+BROADCAST_MAX_ATTEMPTS = 4  # تلاش برای هر گیرنده در خطای شبکه
+BROADCAST_PROGRESS_INTERVAL = 5  # فاصله‌ی به‌روزرسانی پیام وضعیت (ثانیه)
+UNREACHABLE_REPROBE_DAYS = 7  # کاربرهایی که ربات رو بلاک کردن هر چند روز یک بار دوباره امتحان میشن
+
+# ====== CACHE ======
+CACHE_DEFAULT_MAXSIZE = 256  # حداکثر آیتم در هر کش
+CACHE_DEFAULT_TTL = 300  # ثانیه؛ بعد از تغییر داده‌ها هم زودتر باطل میشه
+BROWSE_RENDER_CACHE_SIZE = 64  # صفحه‌های مرور آماده (ترند، جدید، برتر، هر مود)
+BROWSE_RENDER_TTL = 60  # ثانیه؛ تعداد پخش و لایک صفحه‌های مرور حداکثر این‌قدر عقب می‌مونه
+LEADERBOARD_CACHE_SIZE = 8  # رتبه‌بندی کامل برای هر نوع مرتب‌سازی
+PLAYLIST_RENDER_CACHE_SIZE = 512  # متن آماده پلی‌لیست‌ها (بر اساس نسخه هر پلی‌لیست)
+
+# ====== NOTIFICATIONS ======
+# صف ماندگار نوتیفیکیشن‌ها؛ هندلرها فقط ثبت می‌کنن و یک ورکر جدا می‌فرسته
+OUTBOX_PATH = "data/outbox.sqlite3"
+OUTBOX_BATCH_SIZE = 20
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_POLL_INTERVAL = 5  # فاصله‌ی بررسی نوتیفیکیشن‌هایی که باید دوباره ارسال بشن (ثانیه)
+NOTIFICATION_COALESCE_WINDOW = 15 * 60  # حداکثر یک نوتیف لایک/افزودن برای هر آیتم در این بازه (ثانیه)
+NOTIFICATION_DIGEST_HOUR = 21  # ساعت ارسال خلاصه‌ی روزانه برای کاربرهایی که حالت خلاصه رو انتخاب کردن
+
+# ====== WEBHOOK ======
+# False = polling (getUpdates)، True = وبهوک با سرور داخلی (webserver.py)
+USE_WEBHOOK = False
+WEBHOOK_BASE_URL = "https://yourdomain.com"  # آدرس عمومی سرور؛ خالی = وبهوک در تلگرام ثبت نمیشه (تست محلی)
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = int(os.environ.get("PORT", 8443))
+WEBHOOK_PATH = "telegram-webhook"  # یه مسیر غیرقابل حدس بذار
+WEBHOOK_SECRET_TOKEN = ""  # هدر X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = 40  # حداکثر اتصال همزمان تلگرام به وبهوک (۱ تا ۱۰۰)
+PAYMENT_CALLBACK_PATH = "/verify"  # باید با مسیر ZARINPAL_CALLBACK_URL یکی باشه
 
 # ====== SUPPORT ======
 # یوزرنیم اکانت پشتیبانی (بدون @) برای لینک‌دهی در راهنما
@@ -90,6 +175,24 @@ SUPPORT_USERNAME = "support_bot"
 ZARINPAL_MERCHANT_ID = "d97f7648-614f-4025-bee2-5f3cda6d8fcd"  # مرچنت آیدی زرین‌پال
 ZARINPAL_CALLBACK_URL = "https://yourdomain.com/verify"  # آدرس کال‌بک (بعداً تنظیم میکنیم)
 ZARINPAL_SANDBOX = False  # True = تست، False = واقعی
+ZARINPAL_STUB_URL = ""  # مثلاً http://127.0.0.1:8600 برای تست با fake_zarinpal.py
+
+# اتصال به درگاه (ثانیه)
+ZARINPAL_CONNECT_TIMEOUT = 3
+ZARINPAL_READ_TIMEOUT = 8
+ZARINPAL_MAX_ATTEMPTS = 3  # تلاش مجدد برای خطای شبکه / 5xx
+ZARINPAL_POOL_SIZE = 20  # حداکثر اتصال همزمان
+ZARINPAL_BREAKER_FAILURES = 5  # بعد از این تعداد خطای پشت سر هم، درگاه موقتاً قطع حساب میشه
+ZARINPAL_BREAKER_RESET = 30  # چند ثانیه بعد دوباره امتحان بشه
+PAYMENT_AUTHORITY_REUSE_MINUTES = 10  # زدن دوباره همون پلن تو این مدت، همون لینک پرداخت رو میده
+
+# بررسی خودکار پرداخت‌های معلق (برای کسایی که دکمه تایید رو نزدن)
+PAYMENT_RECONCILE_INTERVAL = 120  # هر چند ثانیه یه بار
+PAYMENT_RECONCILE_BATCH_SIZE = 50  # حداکثر پرداخت در هر دور
+PAYMENT_RECONCILE_CONCURRENCY = 5  # درخواست همزمان به درگاه
+PAYMENT_RECONCILE_MAX_BACKOFF = 60 * 60  # حداکثر فاصله بین دو بررسی یه پرداخت (ثانیه)
+PAYMENT_PENDING_TTL_HOURS = 24  # بعد از این مدت پرداخت تایید‌نشده منقضی میشه
+LEDGER_PATH = "data/ledger.sqlite3"  # دفتر پرداخت‌ها (فقط اضافه میشه، هیچوقت پاک نمیشه)
 
 # ZarinPal API URLs
 ZARINPAL_REQUEST_URL = "https://api.zarinpal.com/pg/v4/payment/request.json"
@@ -9,14 +9,41 @@ import uuid
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional, Tuple
 
+from analytics import (
+    AnalyticsPool,
+    build_playlist_columns,
+    build_snapshot,
+    compute_global_stats,
+    compute_search,
+    compute_trending,
+)
+from cache import CATALOG, PLAYLISTS, USERS, invalidates, memoize
 from config import *
-from utils import calculate_score
+from ledger import ledger
 
 
 class Database:
     def __init__(self):
         self.db_path = DATABASE_PATH
         self.data = self.load_data()
+        # Users whose chats reject messages (blocked bot / deleted account)
+        self._unreachable_ids = {
+            user_id
+            for user_id, user in self.data.get('users', {}).items()
+            if user.get('unreachable_since')
+        }
+        # Users with a payment started but not yet verified
+        self._pending_payment_ids = {
+            user_id
+            for user_id, user in self.data.get('users', {}).items()
+            if user.get('pending_payment')
+        }
+        # Songs per storage channel message, and the stored message for each
+        # audio file (by Telegram's file_unique_id) so re-uploads reuse it
+        self._storage_refs: Dict[Tuple[int, int], int] = {}
+        self._stored_files: Dict[str, Tuple[int, int]] = {}
+        for song in self.data.get('songs', {}).values():
+            self._add_storage_ref(song)
 
     def load_data(self) -> Dict:
         """Load database from JSON file"""
@@ -36,6 +63,7 @@ class Database:
 
         data.setdefault('song_daily_likes', {})
         data.setdefault('last_top_song_broadcast', None)
+        data.setdefault('broadcasts', {})
 
         moods = data.get('moods')
         if not isinstance(moods, dict) or not moods:
@@ -52,6 +80,7 @@ class Database:
             user.setdefault('added_playlists', [])
             user.setdefault('last_seen', user.get('join_date', datetime.now().isoformat()))
             user.setdefault('pending_payment', None)
+            user.setdefault('notification_digest', False)
 
         # Update playlists with new fields
         users = data.get('users', {})
@@ -69,6 +98,7 @@ class Database:
                 playlist['max_songs'] = 0
             playlist.setdefault('published_at', None)
             playlist.setdefault('is_private', False)
+            playlist.setdefault('version', 0)
             if status not in ('draft', 'published'):
                 playlist['status'] = 'draft'
             if playlist['status'] == 'draft' and len(playlist.get('songs', [])) >= MIN_SONGS_TO_PUBLISH:
@@ -77,6 +107,7 @@ class Database:
         for song in data.get('songs', {}).values():
             song.setdefault('channel_message_id', None)
             song.setdefault('storage_channel_id', STORAGE_CHANNEL_ID)
+            song.setdefault('file_unique_id', None)
             song.setdefault('likes', [])
             song.setdefault('original_song_id', song.get('id'))
             song.setdefault('added_from_playlist_id', None)
@@ -101,6 +132,7 @@ class Database:
             'premium_plans': copy.deepcopy(DEFAULT_PREMIUM_PLANS),
             'song_daily_likes': {},
             'last_top_song_broadcast': None,
+            'broadcasts': {},
         }
 
     def save_data(self):
@@ -110,6 +142,7 @@ class Database:
 
     # ===== USER MANAGEMENT =====
 
+    @invalidates(USERS)
     def create_user(self, user_id: int, username: str, first_name: str) -> Dict:
         """Create new user"""
         user_id = str(user_id)
@@ -136,6 +169,7 @@ class Database:
             'total_songs_uploaded': 0,
             'total_adds': 0,
             'notifications_enabled': True,
+            'notification_digest': False,
             'join_date': datetime.now().isoformat(),
             'last_seen': datetime.now().isoformat(),
             'active_playlist_id': None,
@@ -151,6 +185,7 @@ class Database:
         """Get user by ID"""
         return self.data['users'].get(str(user_id))
 
+    @invalidates(USERS)
     def update_user(self, user_id: int, updates: Dict):
         """Update user data"""
         user_id = str(user_id)
@@ -172,6 +207,10 @@ class Database:
         except Exception:
             last_seen_dt = None
 
+        # A user talking to the bot can obviously be messaged again
+        if self.is_user_unreachable(user_id):
+            self.mark_user_reachable(user_id)
+
         if last_seen_dt and (now - last_seen_dt).total_seconds() < 60:
             return
 
@@ -199,8 +238,10 @@ class Database:
         days: Optional[int] = None,
         plan_id: Optional[str] = None,
         price: Optional[int] = None,
+        authority: Optional[str] = None,
+        kind: str = 'payment',
     ):
-        """Activate premium for user"""
+        """Activate premium for user and append it to the payment ledger"""
         if days is None:
             if plan_id:
                 plan = self.get_premium_plan(plan_id)
@@ -223,6 +264,8 @@ class Database:
             'premium_price': price,
             'pending_payment': None,
         })
+        self._pending_payment_ids.discard(str(user_id))
+        ledger.record(user_id, kind, plan_id, price, days, authority=authority)
         self.apply_premium_limits(user_id)
         # Give premium badge
         self.add_badge(user_id, 'premium')
@@ -291,17 +334,54 @@ class Database:
             'title': title,
             'duration_days': duration_days,
             'created_at': datetime.now().isoformat(),
+            'checks': 0,
+            'next_check_at': None,
         }
+        self._pending_payment_ids.add(str(user_id))
         self.save_data()
 
-    def clear_pending_payment(self, user_id: int):
+    def clear_pending_payment(self, user_id: int, save: bool = True):
         """Remove pending payment info for user"""
+        self._pending_payment_ids.discard(str(user_id))
         user = self.get_user(user_id)
         if not user:
             return
 
         if user.get('pending_payment') is not None:
             user['pending_payment'] = None
+            if save:
+                self.save_data()
+
+    def get_due_pending_payments(self, limit: int = PAYMENT_RECONCILE_BATCH_SIZE) -> List[Tuple[int, Dict]]:
+        """Pending payments due for a reconciliation check, oldest first"""
+        now = datetime.now().isoformat()
+        due = []
+
+        for key in list(self._pending_payment_ids):
+            pending = self.data['users'].get(key, {}).get('pending_payment')
+            if not pending:
+                self._pending_payment_ids.discard(key)
+                continue
+            if (pending.get('next_check_at') or '') <= now:
+                due.append((int(key), pending))
+
+        due.sort(key=lambda item: item[1].get('created_at') or '')
+        return due[:limit]
+
+    def count_pending_payments(self) -> int:
+        """Number of payments waiting for verification"""
+        return len(self._pending_payment_ids)
+
+    def record_payment_check(self, user_id: int, next_check_at: datetime, save: bool = True):
+        """Count a failed verification and schedule the next one"""
+        user = self.get_user(user_id)
+        pending = user.get('pending_payment') if user else None
+        if not pending:
+            return
+
+        pending['checks'] = pending.get('checks', 0) + 1
+        pending['next_check_at'] = next_check_at.isoformat()
+        if save:
             self.save_data()
 
     # ===== PREMIUM PLANS =====
@@ -345,10 +425,12 @@ class Database:
             self.data['premium_plans'] = updated
             self.save_data()
 
+    @invalidates(USERS)
     def ban_user(self, user_id: int):
         """Ban user"""
         self.update_user(user_id, {'banned': True})
 
+    @invalidates(USERS)
     def unban_user(self, user_id: int):
         """Unban user"""
         self.update_user(user_id, {'banned': False})
@@ -360,6 +442,7 @@ class Database:
 
     # ===== PLAYLIST MANAGEMENT =====
 
+    @invalidates(PLAYLISTS, USERS)
     def create_playlist(self, user_id: int, name: str, mood: str = 'happy') -> Optional[str]:
         """Create new playlist"""
         user = self.get_user(user_id)
@@ -398,6 +481,7 @@ class Database:
             'status': 'draft',
             'max_songs': max_songs,
             'published_at': None,
+            'version': 0,
         }
 
         self.data['playlists'][playlist_id] = playlist
@@ -415,6 +499,11 @@ class Database:
         """Get playlist by ID"""
         return self.data['playlists'].get(playlist_id)
 
+    @staticmethod
+    def bump_playlist_version(playlist: Dict):
+        """Mark playlist content as changed so its cached renders are rebuilt"""
+        playlist['version'] = playlist.get('version', 0) + 1
+
     def get_moods(self) -> Dict[str, str]:
         """Return available playlist moods/categories"""
         moods = self.data.get('moods') or {}
@@ -465,6 +554,7 @@ class Database:
         self.save_data()
         return True, normalized_key
 
+    @invalidates(PLAYLISTS, CATALOG)
     def delete_mood(self, key: str) -> Tuple[bool, str]:
         """Delete mood and return fallback mood key"""
         moods = self.data.get('moods', {})
@@ -484,11 +574,13 @@ class Database:
         for playlist in self.data.get('playlists', {}).values():
             if playlist.get('mood') == key:
                 playlist['mood'] = fallback_key
+                self.bump_playlist_version(playlist)
 
         moods.pop(key)
         self.save_data()
         return True, fallback_key or ''
 
+    @invalidates(PLAYLISTS, USERS, CATALOG)
     def delete_playlist(self, playlist_id: str) -> List[Tuple[int, int]]:
         """Delete playlist and return storage channel messages to remove"""
         deleted_messages: List[Tuple[int, int]] = []
@@ -506,15 +598,9 @@ class Database:
             if not song:
                 continue
 
-            channel_message_id = song.get('channel_message_id')
-            storage_channel_id = song.get('storage_channel_id', STORAGE_CHANNEL_ID)
-
-            if (
-                channel_message_id
-                and self._is_channel_message_unique(song_id, storage_channel_id, channel_message_id)
-            ):
-                channel_id_int = int(storage_channel_id) if storage_channel_id is not None else STORAGE_CHANNEL_ID
-                deleted_messages.append((channel_id_int, int(channel_message_id)))
+            storage_message = self._release_storage_ref(song)
+            if storage_message:
+                deleted_messages.append(storage_message)
 
             # Remove song entry
             del self.data['songs'][song_id]
@@ -529,30 +615,53 @@ class Database:
 
         return deleted_messages
 
-    def _is_channel_message_unique(
-        self,
-        song_id: str,
-        storage_channel_id: Optional[int],
-        channel_message_id: Optional[int],
-    ) -> bool:
-        """Check if the forwarded message is only used by the given song"""
-        if channel_message_id is None:
-            return False
+    @staticmethod
+    def _storage_key(song: Dict) -> Optional[Tuple[int, int]]:
+        """(channel_id, message_id) of the storage message holding a song"""
+        channel_message_id = song.get('channel_message_id')
+        if not channel_message_id:
+            return None
+        storage_channel_id = song.get('storage_channel_id', STORAGE_CHANNEL_ID)
+        channel_id = int(storage_channel_id) if storage_channel_id is not None else STORAGE_CHANNEL_ID
+        return channel_id, int(channel_message_id)
 
-        for other_song_id, other_song in self.data.get('songs', {}).items():
-            if other_song_id == song_id:
-                continue
+    def _add_storage_ref(self, song: Dict):
+        key = self._storage_key(song)
+        if key is None:
+            return
+        self._storage_refs[key] = self._storage_refs.get(key, 0) + 1
+        file_unique_id = song.get('file_unique_id')
+        if file_unique_id:
+            self._stored_files.setdefault(file_unique_id, key)
+
+    def _release_storage_ref(self, song: Dict) -> Optional[Tuple[int, int]]:
+        """Drop a deleted song's reference; the storage message if nothing else uses it"""
+        key = self._storage_key(song)
+        if key is None:
+            return None
 
-            other_channel_id = other_song.get('storage_channel_id', STORAGE_CHANNEL_ID)
-            other_message_id = other_song.get('channel_message_id')
+        remaining = self._storage_refs.get(key, 0) - 1
+        if remaining > 0:
+            self._storage_refs[key] = remaining
+            return None
 
-            if (
-                other_channel_id == storage_channel_id
-                and other_message_id == channel_message_id
-            ):
-                return False
+        self._storage_refs.pop(key, None)
+        file_unique_id = song.get('file_unique_id')
+        if file_unique_id and self._stored_files.get(file_unique_id) == key:
+            del self._stored_files[file_unique_id]
+        return key
 
-        return True
+    def storage_message_in_use(self, channel_id: int, message_id: int) -> bool:
+        """Whether any song still points at this storage channel message"""
+        return (int(channel_id), int(message_id)) in self._storage_refs
+
+    def find_stored_audio(self, file_unique_id: Optional[str]) -> Optional[Dict]:
+        """Storage reference of an audio file that is already in the channel"""
+        key = self._stored_files.get(file_unique_id) if file_unique_id else None
+        if key is None:
+            return None
+        channel_id, message_id = key
+        return {'storage_channel_id': channel_id, 'channel_message_id': message_id}
 
     def get_user_playlists(self, user_id: int) -> List[Dict]:
         """Get all playlists of a user"""
@@ -574,6 +683,7 @@ class Database:
 
         return drafts + published
 
+    @invalidates(PLAYLISTS, CATALOG)
     def set_playlist_visibility(self, user_id: int, playlist_id: str, is_private: bool) -> bool:
         """Update playlist visibility if the requesting user is the owner"""
         playlist = self.get_playlist(playlist_id)
@@ -581,9 +691,11 @@ class Database:
             return False
 
         playlist['is_private'] = bool(is_private)
+        self.bump_playlist_version(playlist)
         self.save_data()
         return True
 
+    @invalidates(PLAYLISTS, CATALOG)
     def toggle_playlist_visibility(self, user_id: int, playlist_id: str) -> Optional[bool]:
         """Toggle playlist visibility and return the new state"""
         playlist = self.get_playlist(playlist_id)
@@ -592,6 +704,7 @@ class Database:
 
         new_state = not playlist.get('is_private', False)
         playlist['is_private'] = new_state
+        self.bump_playlist_version(playlist)
         self.save_data()
         return new_state
 
@@ -637,51 +750,74 @@ class Database:
         user['active_playlist_id'] = playlist_id
         self.save_data()
 
+    @invalidates(PLAYLISTS, USERS, CATALOG)
     def add_song_to_playlist(self, playlist_id: str, song_data: Dict) -> Tuple[bool, str]:
         """Add song to playlist"""
+        added, status = self.add_songs_to_playlist(playlist_id, [song_data])
+        return added > 0, status
+
+    @invalidates(PLAYLISTS, USERS, CATALOG)
+    def add_songs_to_playlist(self, playlist_id: str, songs: List[Dict]) -> Tuple[int, str]:
+        """Add songs in order with a single save, stopping once the playlist is full
+
+        Returns how many were added and the outcome: 'song_added',
+        'draft_progress' or 'playlist_published' when any were added,
+        otherwise 'playlist_not_found', 'playlist_full' or 'storage_missing'.
+        """
         playlist = self.get_playlist(playlist_id)
         if not playlist:
-            return False, 'playlist_not_found'
+            return 0, 'playlist_not_found'
 
         max_songs = playlist.get('max_songs', 0) or 0
         current_count = len(playlist.get('songs', []))
-        if max_songs and current_count >= max_songs:
-            return False, 'playlist_full'
+        owner_id = int(playlist['owner_id'])
+        user = self.get_user(owner_id)
+        added = 0
+        failure = 'storage_missing'
 
-        if not song_data.get('channel_message_id'):
-            return False, 'storage_missing'
+        for song_data in songs:
+            if max_songs and current_count >= max_songs:
+                failure = 'playlist_full'
+                break
 
-        song_data['channel_message_id'] = int(song_data['channel_message_id'])
+            if not song_data.get('channel_message_id'):
+                continue
 
-        # Generate song ID
-        song_id = f"song_{len(self.data['songs'])}"
-        song_data['id'] = song_id
-        song_data['playlist_id'] = playlist_id
-        song_data['uploaded_at'] = datetime.now().isoformat()
-        song_data.setdefault('storage_channel_id', STORAGE_CHANNEL_ID)
-        song_data.setdefault('likes', [])
-        song_data.setdefault('original_song_id', song_id)
-        song_data.setdefault('added_from_playlist_id', None)
-        song_data.setdefault('added_by', str(playlist.get('owner_id')))
-        song_data.setdefault('uploader_id', str(song_data.get('uploader_id') or playlist.get('owner_id')))
-        song_data.setdefault('uploader_name', song_data.get('uploader_name') or playlist.get('owner_name'))
+            song_data['channel_message_id'] = int(song_data['channel_message_id'])
 
-        self.data['songs'][song_id] = song_data
-        playlist['songs'].append(song_id)
+            # Generate song ID
+            song_id = f"song_{len(self.data['songs'])}"
+            song_data['id'] = song_id
+            song_data['playlist_id'] = playlist_id
+            song_data['uploaded_at'] = datetime.now().isoformat()
+            song_data.setdefault('storage_channel_id', STORAGE_CHANNEL_ID)
+            song_data.setdefault('likes', [])
+            song_data.setdefault('original_song_id', song_id)
+            song_data.setdefault('added_from_playlist_id', None)
+            song_data.setdefault('added_by', str(playlist.get('owner_id')))
+            song_data.setdefault('uploader_id', str(song_data.get('uploader_id') or playlist.get('owner_id')))
+            song_data.setdefault('uploader_name', song_data.get('uploader_name') or playlist.get('owner_name'))
 
-        owner_id = int(playlist['owner_id'])
+            self.data['songs'][song_id] = song_data
+            self._add_storage_ref(song_data)
+            playlist['songs'].append(song_id)
+            current_count += 1
+            added += 1
 
-        # Update user stats
-        user = self.get_user(owner_id)
-        if user:
-            user['total_songs_uploaded'] += 1
+            # Update user stats
+            if user:
+                user['total_songs_uploaded'] += 1
 
-            # Check badges
-            if user['total_songs_uploaded'] >= 100:
-                self.add_badge(owner_id, 'music_lover')
+        if not added:
+            return 0, failure
+
+        self.bump_playlist_version(playlist)
+
+        # Check badges
+        if user and user['total_songs_uploaded'] >= 100:
+            self.add_badge(owner_id, 'music_lover')
 
         # Auto-publish if minimum songs reached
-        current_count += 1
         message_key = 'song_added'
         if playlist.get('status') != 'published':
             if current_count >= MIN_SONGS_TO_PUBLISH:
@@ -692,10 +828,11 @@ class Database:
                 message_key = 'draft_progress'
 
         self.save_data()
-        return True, message_key
+        return added, message_key
 
     # ===== LIKES & INTERACTIONS =====
 
+    @invalidates(PLAYLISTS, CATALOG)
     def publish_playlist(self, playlist_id: str) -> bool:
         """Force publish a playlist manually"""
         playlist = self.get_playlist(playlist_id)
@@ -710,6 +847,7 @@ class Database:
         self.save_data()
         return True
 
+    @invalidates(PLAYLISTS, USERS)
     def like_playlist(self, user_id: int, playlist_id: str) -> bool:
         """Like a playlist"""
         playlist = self.get_playlist(playlist_id)
@@ -747,6 +885,7 @@ class Database:
         self.save_data()
         return True
 
+    @invalidates(PLAYLISTS, USERS)
     def unlike_playlist(self, user_id: int, playlist_id: str) -> bool:
         """Unlike a playlist"""
         playlist = self.get_playlist(playlist_id)
@@ -771,6 +910,7 @@ class Database:
         self.save_data()
         return True
 
+    @invalidates(USERS)
     def like_song(self, user_id: int, song_id: str) -> bool:
         """Register a like for a song"""
         song = self.data['songs'].get(song_id)
@@ -798,6 +938,7 @@ class Database:
         self.save_data()
         return True
 
+    @invalidates(USERS)
     def unlike_song(self, user_id: int, song_id: str) -> bool:
         """Remove like from a song"""
         song = self.data['songs'].get(song_id)
@@ -878,8 +1019,78 @@ class Database:
     def set_last_top_song_broadcast(self, date: str):
         """Persist the date string of the latest daily top song broadcast"""
         self.data['last_top_song_broadcast'] = date
+        self.data.pop('top_song_progress', None)
         self.save_data()
 
+    def get_top_song_progress(self) -> Optional[Dict]:
+        """Return the checkpoint of an unfinished daily top song fan-out"""
+        return self.data.get('top_song_progress')
+
+    def start_top_song_progress(self, date: str, song_id: str, daily_likes: int) -> Dict:
+        """Persist the song picked for a daily fan-out before sending starts"""
+        progress = {
+            'date': date,
+            'song_id': song_id,
+            'daily_likes': daily_likes,
+            'cursor': None,
+            'sent': 0,
+            'failed': 0,
+            'skipped': 0,
+        }
+        self.data['top_song_progress'] = progress
+        self.save_data()
+        return progress
+
+    def update_top_song_progress(self, **updates):
+        """Update daily top song fan-out checkpoint"""
+        progress = self.data.get('top_song_progress')
+        if not progress:
+            return
+        progress.update(updates)
+        self.save_data()
+
+    def get_top_song_recipients(
+        self,
+        original_song_id: str,
+        exclude_user_id: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> List[Tuple[int, bool]]:
+        """Return sorted (user_id, already_added) pairs for the daily top song
+
+        Skips banned users and users with notifications turned off. Copies
+        of the song are collected once instead of per recipient.
+        """
+        songs = self.data.get('songs', {})
+        copy_ids = {
+            song_id
+            for song_id, song in songs.items()
+            if song.get('original_song_id', song.get('id')) == original_song_id
+        }
+        playlists = self.data.get('playlists', {})
+
+        recipients = []
+        for user in self.data['users'].values():
+            if user.get('banned') or not user.get('notifications_enabled', True):
+                continue
+
+            try:
+                user_id = int(user['user_id'])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+            if user_id == exclude_user_id or (after is not None and user_id <= after):
+                continue
+
+            already_added = any(
+                song_id in copy_ids
+                for playlist_id in user.get('playlists', [])
+                for song_id in playlists.get(playlist_id, {}).get('songs', [])
+            )
+            recipients.append((user_id, already_added))
+
+        recipients.sort()
+        return recipients
+
     def user_has_song_copy(self, user_id: int, original_song_id: str) -> bool:
         """Check if user already saved a copy of the song"""
         user = self.get_user(user_id)
@@ -900,6 +1111,52 @@ class Database:
 
         return False
 
+    def get_song_button_states(self, user_id: int, song_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Return like/add button state for many songs in a single pass"""
+        user_id_str = str(user_id)
+        user = self.get_user(user_id)
+        songs = self.data.get('songs', {})
+
+        owned_originals = set()
+        if user:
+            for playlist_id in user.get('playlists', []):
+                playlist = self.get_playlist(playlist_id)
+                if not playlist:
+                    continue
+                for owned_song_id in playlist.get('songs', []):
+                    owned_song = songs.get(owned_song_id)
+                    if owned_song:
+                        owned_originals.add(owned_song.get('original_song_id', owned_song.get('id')))
+
+        wanted_originals = set()
+        for song_id in song_ids:
+            song = songs.get(song_id)
+            if song:
+                wanted_originals.add(song.get('original_song_id', song_id))
+
+        add_counts: Dict[str, int] = {}
+        for song in songs.values():
+            original_id = song.get('original_song_id')
+            if original_id in wanted_originals and song.get('id') != original_id:
+                add_counts[original_id] = add_counts.get(original_id, 0) + 1
+
+        states: Dict[str, Dict[str, Any]] = {}
+        for song_id in song_ids:
+            song = songs.get(song_id)
+            if not song:
+                continue
+            original_id = song.get('original_song_id', song_id)
+            likes = song.get('likes', [])
+            states[song_id] = {
+                'user_liked': user_id_str in likes,
+                'already_added': original_id in owned_originals,
+                'like_count': len(likes),
+                'add_count': add_counts.get(original_id, 0),
+            }
+
+        return states
+
+    @invalidates(PLAYLISTS, USERS, CATALOG)
     def add_existing_song_to_playlist(
         self,
         source_song_id: str,
@@ -948,6 +1205,8 @@ class Database:
             'file_size': source_song.get('file_size'),
             'channel_message_id': source_song.get('channel_message_id'),
             'storage_channel_id': source_song.get('storage_channel_id', STORAGE_CHANNEL_ID),
+            'file_id': source_song.get('file_id'),
+            'file_unique_id': source_song.get('file_unique_id'),
             'playlist_id': target_playlist_id,
             'uploaded_at': datetime.now().isoformat(),
             'likes': [],
@@ -959,7 +1218,9 @@ class Database:
         }
 
         self.data['songs'][new_song_id] = cloned_song
+        self._add_storage_ref(cloned_song)
         target_playlist.setdefault('songs', []).append(new_song_id)
+        self.bump_playlist_version(target_playlist)
 
         actor['total_adds'] += 1
 
@@ -974,6 +1235,7 @@ class Database:
         self.save_data()
         return True, 'added'
 
+    @invalidates(PLAYLISTS, USERS, CATALOG)
     def remove_song_from_playlist(
         self,
         playlist_id: str,
@@ -993,20 +1255,9 @@ class Database:
             return False, {'status': 'song_not_in_playlist'}
 
         song = self.data['songs'].get(song_id)
-        storage_messages: List[Tuple[int, int]] = []
-
-        if song:
-            channel_message_id = song.get('channel_message_id')
-            storage_channel_id = song.get('storage_channel_id', STORAGE_CHANNEL_ID)
-
-            if (
-                channel_message_id
-                and self._is_channel_message_unique(song_id, storage_channel_id, channel_message_id)
-            ):
-                channel_id_int = int(storage_channel_id) if storage_channel_id is not None else STORAGE_CHANNEL_ID
-                storage_messages.append((channel_id_int, int(channel_message_id)))
 
         playlist['songs'] = [sid for sid in playlist.get('songs', []) if sid != song_id]
+        self.bump_playlist_version(playlist)
 
         actor = self.get_user(actor_id)
         if actor and song:
@@ -1047,8 +1298,11 @@ class Database:
             playlist['published_at'] = None
             playlist_now_draft = True
 
+        storage_messages: List[Tuple[int, int]] = []
         if song_id in self.data['songs']:
-            del self.data['songs'][song_id]
+            storage_message = self._release_storage_ref(self.data['songs'].pop(song_id))
+            if storage_message:
+                storage_messages.append(storage_message)
 
         self.save_data()
 
@@ -1100,6 +1354,7 @@ class Database:
 
         return count
 
+    @invalidates(PLAYLISTS, USERS)
     def increment_plays(self, playlist_id: str):
         """Increment play count"""
         playlist = self.get_playlist(playlist_id)
@@ -1120,6 +1375,7 @@ class Database:
 
     # ===== FOLLOW SYSTEM =====
 
+    @invalidates(USERS)
     def follow_user(self, follower_id: int, following_id: int) -> bool:
         """Follow a user"""
         follower = self.get_user(follower_id)
@@ -1147,6 +1403,7 @@ class Database:
         self.save_data()
         return True
 
+    @invalidates(USERS)
     def unfollow_user(self, follower_id: int, following_id: int) -> bool:
         """Unfollow a user"""
         follower = self.get_user(follower_id)
@@ -1176,87 +1433,9 @@ class Database:
             user['badges'].append(badge_name)
             self.save_data()
 
-    # ===== LEADERBOARD =====
-
-    def get_leaderboard(self, sort_by='likes', limit=20) -> List[Dict]:
-        """Get leaderboard with detailed ranking data"""
-        users: List[Dict] = []
-
-        for user_id, user in self.data['users'].items():
-            if user.get('banned'):
-                continue
-
-            likes = user.get('total_likes_received', 0)
-            plays = user.get('total_plays', 0)
-            songs = user.get('total_songs_uploaded', 0)
-            playlists_count = len(user.get('playlists', []))
-            followers_count = len(user.get('followers', []))
-            join_date_raw = user.get('join_date')
-
-            try:
-                join_timestamp = datetime.fromisoformat(join_date_raw).timestamp() if join_date_raw else float('inf')
-            except Exception:
-                join_timestamp = float('inf')
-
-            composite_score = calculate_score(user)
-
-            if sort_by == 'likes':
-                primary_metric = likes
-            elif sort_by == 'plays':
-                primary_metric = plays
-            elif sort_by == 'songs':
-                primary_metric = songs
-            else:
-                primary_metric = composite_score
-
-            first_name = user.get('first_name') or ''
-            username = user.get('username') or ''
-
-            if first_name and first_name.lower() != 'unknown':
-                display_name = first_name
-            elif username:
-                display_name = f"@{username}"
-            else:
-                display_name = f"کاربر {user_id[-4:]}"
-
-            users.append({
-                'user_id': user_id,
-                'name': display_name,
-                'username': username,
-                'score': composite_score,
-                'likes': likes,
-                'plays': plays,
-                'songs': songs,
-                'playlists': playlists_count,
-                'followers': followers_count,
-                'is_premium': user.get('premium', False),
-                '_primary_metric': primary_metric,
-                '_join_timestamp': join_timestamp,
-            })
-
-        users.sort(
-            key=lambda x: (
-                -x['_primary_metric'],
-                -x['score'],
-                -x['likes'],
-                -x['plays'],
-                -x['songs'],
-                -x['followers'],
-                x['_join_timestamp'],
-            )
-        )
-
-        for user in users:
-            user.pop('_primary_metric', None)
-            user.pop('_join_timestamp', None)
-
-        if limit is None or limit <= 0:
-            return users
-
-        return users[:limit]
-
     # ===== BROWSE & DISCOVER =====
 
+    @memoize('public_playlists', depends=(PLAYLISTS,))
     def get_all_playlists(self, filter_private=True) -> List[Dict]:
         """Get all public playlists"""
         playlists = []
@@ -1268,25 +1447,20 @@ class Database:
             playlists.append(playlist)
         return playlists
 
+    @memoize('trending_playlists', depends=(PLAYLISTS,), ttl=60)
     def get_trending_playlists(self, days=7, limit=20) -> List[Dict]:
         """Get trending playlists"""
-        cutoff = datetime.now() - timedelta(days=days)
-        playlists = []
-
-        for playlist in self.get_all_playlists():
-            created = datetime.fromisoformat(playlist['created_at'])
-            if created > cutoff:
-                playlists.append(playlist)
-
-        playlists.sort(key=lambda x: x.get('plays', 0), reverse=True)
-        return playlists[:limit]
+        playlist_ids = compute_trending({'playlists': build_playlist_columns(self.data)}, days=days, limit=limit)
+        return [self.data['playlists'][pl_id] for pl_id in playlist_ids]
 
+    @memoize('top_playlists', depends=(PLAYLISTS,))
     def get_top_playlists(self, limit=20) -> List[Dict]:
         """Get top playlists by likes"""
         playlists = self.get_all_playlists()
         playlists.sort(key=lambda x: len(x.get('likes', [])), reverse=True)
         return playlists[:limit]
 
+    @memoize('new_playlists', depends=(PLAYLISTS,))
     def get_new_playlists(self, limit=20) -> List[Dict]:
         """Get newest playlists"""
         playlists = self.get_all_playlists()
@@ -1301,6 +1475,7 @@ class Database:
         playlists.sort(key=_created_at, reverse=True)
         return playlists[:limit]
 
+    @memoize('mood_playlists', depends=(PLAYLISTS,))
     def get_playlists_by_mood(self, mood: str, limit=20) -> List[Dict]:
         """Get playlists filtered by mood"""
         playlists = [
@@ -1313,114 +1488,196 @@ class Database:
 
     def search_playlists(self, query: str) -> List[Dict]:
         """Search playlists by name"""
-        query = query.lower()
-        results = []
-        for playlist in self.get_all_playlists():
-            if query in playlist['name'].lower():
-                results.append(playlist)
-        return results
+        playlist_ids = compute_search({'playlists': build_playlist_columns(self.data)}, query)
+        return [self.data['playlists'][pl_id] for pl_id in playlist_ids]
 
     # ===== STATS =====
 
     def get_global_stats(self) -> Dict:
         """Get global statistics"""
-        total_playlists = len(
-            [
-                pl
-                for pl in self.data['playlists'].values()
-                if pl.get('status') == 'published'
-            ]
-        )
-        total_songs = len(self.data['songs'])
-        users = list(self.data['users'].values())
-        total_users = len(users)
-        banned_users = len([u for u in users if u.get('banned')])
-        active_users = total_users - banned_users
-
-        today = datetime.now().date()
-        seven_days_ago = today - timedelta(days=6)
-
-        new_today = 0
-        new_last_week = 0
-        active_today = 0
-        premium_users = 0
-        revenue = 0
-        premium_status_changed = False
-
-        for user in users:
-            if user.get('banned'):
+        stats = compute_global_stats(build_snapshot(self.data))
+        self.expire_premium_users(stats.pop('expired_premium_ids', []))
+        stats.update(ledger.summary())
+        return stats
+
+    @invalidates(USERS)
+    def expire_premium_users(self, user_ids: List[str]):
+        """Clear premium flag for users whose subscription has lapsed
+
+        The ids may come from an older analytics snapshot, so each live
+        record is checked again: a user who renewed since keeps premium.
+        """
+        now = datetime.now()
+        changed = False
+        for user_id in user_ids:
+            user = self.data['users'].get(str(user_id))
+            if not user or not user.get('premium') or not user.get('premium_until'):
                 continue
 
-            join_date_raw = user.get('join_date')
-            last_seen_raw = user.get('last_seen')
-
             try:
-                join_date = datetime.fromisoformat(join_date_raw).date() if join_date_raw else None
-            except Exception:
-                join_date = None
+                expired = datetime.fromisoformat(user['premium_until']) <= now
+            except (TypeError, ValueError):
+                expired = True
 
-            try:
-                last_seen = datetime.fromisoformat(last_seen_raw).date() if last_seen_raw else None
-            except Exception:
-                last_seen = None
-
-            if join_date:
-                if join_date == today:
-                    new_today += 1
-                if join_date >= seven_days_ago:
-                    new_last_week += 1
-
-            if last_seen and last_seen == today:
-                active_today += 1
-
-            if user.get('premium'):
-                premium_until_raw = user.get('premium_until')
-                has_active_premium = True
-
-                if premium_until_raw:
-                    try:
-                        expiry = datetime.fromisoformat(premium_until_raw)
-                        if datetime.now() > expiry:
-                            has_active_premium = False
-                    except Exception:
-                        has_active_premium = False
-
-                if has_active_premium:
-                    premium_users += 1
-                    revenue += user.get('premium_price', 0) or 0
-                else:
-                    user['premium'] = False
-                    premium_status_changed = True
-
-        if premium_status_changed:
+            if expired:
+                user['premium'] = False
+                changed = True
+
+        if changed:
             self.save_data()
 
-        return {
-            'total_users': total_users,
-            'active_users': active_users,
-            'banned_users': banned_users,
-            'active_today': active_today,
-            'new_today': new_today,
-            'new_last_week': new_last_week,
-            'total_playlists': total_playlists,
-            'total_songs': total_songs,
-            'total_likes': self.data['stats']['total_likes'],
-            'total_plays': self.data['stats']['total_plays'],
-            'premium_users': premium_users,
-            'premium_ratio': (premium_users / active_users) if active_users else 0,
-            'revenue': revenue,
-        }
+    # ===== REACHABILITY =====
 
-    def get_user_rank(self, user_id: int, sort_by: str = 'likes') -> int:
-        """Get user rank in leaderboard"""
-        leaderboard = self.get_leaderboard(sort_by=sort_by, limit=0)
-        user_id_str = str(user_id)
+    def mark_user_unreachable(self, user_id: int, save: bool = True):
+        """Record that messages to user fail (blocked bot / deleted account)"""
+        user = self.get_user(user_id)
+        if not user:
+            return
+
+        now = datetime.now().isoformat()
+        if not user.get('unreachable_since'):
+            user['unreachable_since'] = now
+        user['unreachable_checked_at'] = now
+        self._unreachable_ids.add(str(user_id))
+
+        if save:
+            self.save_data()
+
+    def mark_user_reachable(self, user_id: int, save: bool = True):
+        """Clear unreachable state after a successful send or user activity"""
+        key = str(user_id)
+        if key not in self._unreachable_ids:
+            return
+
+        self._unreachable_ids.discard(key)
+        user = self.get_user(user_id)
+        if user:
+            user.pop('unreachable_since', None)
+            user.pop('unreachable_checked_at', None)
+
+        if save:
+            self.save_data()
+
+    def is_user_unreachable(self, user_id: int) -> bool:
+        """Check if user is marked unreachable"""
+        return str(user_id) in self._unreachable_ids
+
+    def count_unreachable_users(self) -> int:
+        """Number of users currently marked unreachable"""
+        return len(self._unreachable_ids)
+
+    def filter_reachable(
+        self,
+        user_ids: List[int],
+        reprobe_days: float = UNREACHABLE_REPROBE_DAYS,
+    ) -> Tuple[List[int], int]:
+        """Drop unreachable users from a recipient list
+
+        Users last checked more than `reprobe_days` ago are kept so they get
+        re-probed. Returns the kept ids and how many were skipped.
+        """
+        if not self._unreachable_ids:
+            return list(user_ids), 0
+
+        cutoff = datetime.now() - timedelta(days=reprobe_days)
+        kept = []
+        skipped = 0
+
+        for user_id in user_ids:
+            key = str(user_id)
+            if key in self._unreachable_ids:
+                checked_raw = self.data['users'].get(key, {}).get('unreachable_checked_at')
+                try:
+                    checked_at = datetime.fromisoformat(checked_raw) if checked_raw else None
+                except ValueError:
+                    checked_at = None
+
+                if checked_at and checked_at > cutoff:
+                    skipped += 1
+                    continue
+
+            kept.append(user_id)
+
+        return kept, skipped
+
+    # ===== BROADCASTS =====
+
+    def get_broadcast_recipient_ids(self, audience: str, after: Optional[int] = None) -> List[int]:
+        """Return sorted user ids for a broadcast audience, after the cursor"""
+        recipient_ids = []
+        for user in self.data['users'].values():
+            if user.get('banned'):
+                continue
+            if audience == 'premium' and not user.get('premium'):
+                continue
+            if audience == 'free' and user.get('premium'):
+                continue
+
+            try:
+                user_id = int(user['user_id'])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+            if after is None or user_id > after:
+                recipient_ids.append(user_id)
+
+        recipient_ids.sort()
+        return recipient_ids
+
+    def create_broadcast(self, admin_id: int, text: str, audience: str, keep_finished: int = 20) -> Dict:
+        """Persist a new broadcast job"""
+        broadcasts = self.data.setdefault('broadcasts', {})
 
-        for i, user in enumerate(leaderboard, 1):
-            if user['user_id'] == user_id_str:
-                return i
-        return 0
+        finished = sorted(
+            (job for job in broadcasts.values() if job.get('status') == 'done'),
+            key=lambda job: job.get('created_at') or '',
+        )
+        for job in finished[:max(len(finished) - keep_finished, 0)]:
+            broadcasts.pop(job['id'], None)
+
+        job = {
+            'id': uuid.uuid4().hex[:10],
+            'admin_id': str(admin_id),
+            'text': text,
+            'audience': audience,
+            'status': 'running',
+            'cursor': None,
+            'total': len(self.get_broadcast_recipient_ids(audience)),
+            'sent': 0,
+            'failed': 0,
+            'skipped': 0,
+            'status_chat_id': None,
+            'status_message_id': None,
+            'created_at': datetime.now().isoformat(),
+            'finished_at': None,
+        }
+        broadcasts[job['id']] = job
+        self.save_data()
+        return job
+
+    def get_broadcast(self, job_id: str) -> Optional[Dict]:
+        """Get broadcast job by id"""
+        return self.data.get('broadcasts', {}).get(job_id)
+
+    def get_running_broadcasts(self) -> List[Dict]:
+        """Return broadcast jobs that still have recipients left"""
+        return [
+            job
+            for job in self.data.get('broadcasts', {}).values()
+            if job.get('status') == 'running'
+        ]
+
+    def update_broadcast(self, job_id: str, **updates):
+        """Update broadcast job (checkpoint)"""
+        job = self.get_broadcast(job_id)
+        if not job:
+            return
+        job.update(updates)
+        self.save_data()
 
 
 # Initialize database
 db = Database()
+
+# Aggregate queries for handlers run in worker processes
+analytics = AnalyticsPool(db)
@@ -0,0 +1,107 @@
+# fake_telegram.py - Local Webhook Poster
+# شبیه‌ساز تلگرام برای تست وبهوک روی سیستم خودت
+#
+# Run the bot with USE_WEBHOOK = True and WEBHOOK_BASE_URL = "" (so no
+# webhook is registered), then:
+#
+#   python fake_telegram.py --text /start --user-id 12345
+#   python fake_telegram.py --callback trending --user-id 12345
+#   python fake_telegram.py --healthz
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+import aiohttp
+
+from config import *
+
+
+_update_ids = itertools.count(int(time.time()))
+
+
+def build_user(user_id: int, first_name: str) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': first_name}
+
+
+def build_message_update(user_id: int, text: str, first_name: str = 'Tester') -> dict:
+    """Telegram Update JSON for a private text message"""
+    message = {
+        'message_id': next(_update_ids) % 1_000_000,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private', 'first_name': first_name},
+        'from': build_user(user_id, first_name),
+        'text': text,
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return {'update_id': next(_update_ids), 'message': message}
+
+
+def build_callback_update(user_id: int, data: str, first_name: str = 'Tester') -> dict:
+    """Telegram Update JSON for an inline button press"""
+    return {
+        'update_id': next(_update_ids),
+        'callback_query': {
+            'id': str(next(_update_ids)),
+            'from': build_user(user_id, first_name),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private', 'first_name': first_name},
+                'text': '...',
+            },
+        },
+    }
+
+
+async def post_update(base_url: str, update: dict, count: int = 1) -> list:
+    """POST the update `count` times like Telegram would; return status codes"""
+    url = base_url.rstrip('/') + '/' + WEBHOOK_PATH.strip('/')
+    headers = {'X-Telegram-Bot-Api-Secret-Token': WEBHOOK_SECRET_TOKEN} if WEBHOOK_SECRET_TOKEN else {}
+
+    async with aiohttp.ClientSession() as session:
+        async def post(payload: dict) -> int:
+            async with session.post(url, json=payload, headers=headers) as response:
+                return response.status
+
+        payloads = [dict(update, update_id=next(_update_ids)) for _ in range(count)]
+        return await asyncio.gather(*(post(payload) for payload in payloads))
+
+
+async def get_healthz(base_url: str) -> str:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(base_url.rstrip('/') + '/healthz') as response:
+            return f"{response.status} {await response.text()}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post fake Telegram updates to the local webhook")
+    parser.add_argument('--url', default=f"http://127.0.0.1:{WEBHOOK_PORT}")
+    parser.add_argument('--user-id', type=int, default=ADMIN_IDS[0] if ADMIN_IDS else 1)
+    parser.add_argument('--text', help="message text, e.g. /start")
+    parser.add_argument('--callback', help="callback_data of an inline button")
+    parser.add_argument('--count', type=int, default=1, help="send the update this many times concurrently")
+    parser.add_argument('--healthz', action='store_true')
+    args = parser.parse_args()
+
+    if args.healthz:
+        print(asyncio.run(get_healthz(args.url)))
+        return
+
+    if args.callback:
+        update = build_callback_update(args.user_id, args.callback)
+    else:
+        update = build_message_update(args.user_id, args.text or '/start')
+
+    print(json.dumps(update, ensure_ascii=False))
+    print(asyncio.run(post_update(args.url, update, args.count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# fake_zarinpal.py - Local ZarinPal Stub Gateway
+# درگاه شبیه‌سازی‌شده زرین‌پال برای تست روی سیستم خودت
+#
+# Serve the stub and point the bot at it with ZARINPAL_STUB_URL:
+#
+#   python fake_zarinpal.py --port 8600 --latency 2 --fail-rate 0.3
+#
+# Or run the client against it once and print timings:
+#
+#   python fake_zarinpal.py --check --latency 0.5 --fail-rate 0.5
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+from payments import ZarinPal
+
+
+class FakeGateway:
+    """ZarinPal v4 request/verify endpoints with configurable latency and 5xx rate"""
+
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0, decline_rate: float = 0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.decline_rate = decline_rate
+        self.payments = {}  # authority -> {'amount', 'verified'}
+        self.requests = 0
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/pg/v4/payment/request.json', self._request)
+        app.router.add_post('/pg/v4/payment/verify.json', self._verify)
+        app.router.add_get('/pg/StartPay/{authority}', self._start_pay)
+        return app
+
+    async def _simulate(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if random.random() < self.fail_rate:
+            raise web.HTTPServiceUnavailable()
+
+    async def _request(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        await self._simulate()
+        if not data.get('merchant_id') or not data.get('amount'):
+            return web.json_response({'data': [], 'errors': {'code': -9}}, status=400)
+
+        authority = 'A' + uuid.uuid4().hex[:35].upper()
+        self.payments[authority] = {'amount': data['amount'], 'verified': False}
+        return web.json_response({'data': {'code': 100, 'message': 'Success', 'authority': authority}, 'errors': []})
+
+    async def _verify(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        await self._simulate()
+        payment = self.payments.get(data.get('authority'))
+        if not payment or payment['amount'] != data.get('amount') or random.random() < self.decline_rate:
+            return web.json_response({'data': [], 'errors': {'code': -51}}, status=400)
+
+        code = 101 if payment['verified'] else 100
+        payment['verified'] = True
+        return web.json_response({'data': {'code': code, 'ref_id': random.randint(10 ** 8, 10 ** 9)}, 'errors': []})
+
+    async def _start_pay(self, request: web.Request) -> web.Response:
+        return web.Response(text=f"Fake payment page for {request.match_info['authority']}")
+
+
+async def check(gateway: FakeGateway, port: int, count: int):
+    """Run `count` concurrent create+verify round trips against the stub"""
+    runner = web.AppRunner(gateway.build_app())
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+
+    client = ZarinPal(base_url=f"http://127.0.0.1:{port}")
+
+    async def round_trip(user_id: int):
+        started = time.perf_counter()
+        payment = await client.create_payment(50000, "test", user_id)
+        verified = bool(payment) and await client.verify_payment(payment['authority'], 50000)
+        return bool(payment), verified, time.perf_counter() - started
+
+    try:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(round_trip(user_id) for user_id in range(1, count + 1)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+    print(f"round trips: {count}, gateway requests: {gateway.requests}, wall time: {elapsed:.2f}s")
+    print(f"created: {sum(r[0] for r in results)}, verified: {sum(r[1] for r in results)}")
+    print(f"slowest: {max(r[2] for r in results):.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local ZarinPal stub gateway")
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every answer")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument('--decline-rate', type=float, default=0.0, help="fraction of verifies declined")
+    parser.add_argument('--check', action='store_true', help="exercise the client against the stub and exit")
+    parser.add_argument('--count', type=int, default=20, help="round trips for --check")
+    args = parser.parse_args()
+
+    gateway = FakeGateway(args.latency, args.fail_rate, args.decline_rate)
+    if args.check:
+        asyncio.run(check(gateway, args.port, args.count))
+    else:
+        web.run_app(gateway.build_app(), host='127.0.0.1', port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+# ledger.py - Append-only Payment Ledger
+# دفتر پرداخت‌ها و گزارش درآمد
+
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+DAY = 'day'
+MONTH = 'month'
+
+
+class PaymentLedger:
+    """Every premium activation, appended once and never changed
+
+    Revenue per (day, plan) and (month, plan) is kept in `revenue_periods`,
+    updated in the same transaction as the ledger row, so revenue reports
+    read a handful of aggregate rows instead of scanning users. Paid
+    activations carry their ZarinPal authority, which is unique: recording
+    the same payment twice is a no-op.
+    """
+
+    def __init__(self, path: str = LEDGER_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    plan_id TEXT NOT NULL,
+                    amount INTEGER NOT NULL,
+                    days INTEGER NOT NULL,
+                    authority TEXT UNIQUE
+                );
+                CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (user_id, id);
+
+                CREATE TRIGGER IF NOT EXISTS ledger_no_update BEFORE UPDATE ON ledger
+                BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END;
+                CREATE TRIGGER IF NOT EXISTS ledger_no_delete BEFORE DELETE ON ledger
+                BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END;
+
+                CREATE TABLE IF NOT EXISTS revenue_periods (
+                    granularity TEXT NOT NULL,
+                    period TEXT NOT NULL,
+                    plan_id TEXT NOT NULL,
+                    amount INTEGER NOT NULL DEFAULT 0,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (granularity, period, plan_id)
+                );
+                """
+            )
+            self._conn = conn
+        return self._conn
+
+    def record(
+        self,
+        user_id: int,
+        kind: str,
+        plan_id: Optional[str],
+        amount: int,
+        days: int,
+        authority: Optional[str] = None,
+        at: Optional[datetime] = None,
+    ) -> bool:
+        """Append an activation; False if this authority is already recorded"""
+        at = at or datetime.now()
+        plan_id = plan_id or 'unknown'
+        amount = int(amount or 0)
+
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT INTO ledger (created_at, user_id, kind, plan_id, amount, days, authority) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (at.isoformat(), int(user_id), kind, plan_id, amount, int(days), authority),
+                )
+                self.conn.executemany(
+                    "INSERT INTO revenue_periods (granularity, period, plan_id, amount, count) "
+                    "VALUES (?, ?, ?, ?, 1) "
+                    "ON CONFLICT(granularity, period, plan_id) DO UPDATE SET "
+                    "amount = amount + excluded.amount, count = count + 1",
+                    [
+                        (DAY, at.strftime('%Y-%m-%d'), plan_id, amount),
+                        (MONTH, at.strftime('%Y-%m'), plan_id, amount),
+                    ],
+                )
+        except sqlite3.IntegrityError:
+            logger.info("Payment %s is already in the ledger", authority)
+            return False
+        return True
+
+    def has_authority(self, authority: str, user_id: Optional[int] = None) -> bool:
+        """Whether this payment is already recorded (for `user_id`, if given)"""
+        if user_id is None:
+            row = self.conn.execute("SELECT 1 FROM ledger WHERE authority = ?", (authority,)).fetchone()
+        else:
+            row = self.conn.execute(
+                "SELECT 1 FROM ledger WHERE authority = ? AND user_id = ?",
+                (authority, int(user_id)),
+            ).fetchone()
+        return row is not None
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM ledger LIMIT 1").fetchone() is None
+
+    def backfill(self, users: Dict[str, Dict], plans: List[Dict]) -> int:
+        """Seed an empty ledger from users' current premium_price
+
+        Only the latest purchase of each premium user is known; its date is
+        estimated from premium_until and the plan length.
+        """
+        if not self.is_empty():
+            return 0
+
+        plan_days = {plan.get('id'): plan.get('duration_days') or 30 for plan in plans}
+        recorded = 0
+        for user_id, user in users.items():
+            price = user.get('premium_price') or 0
+            if not price or not user.get('premium_until'):
+                continue
+            try:
+                until = datetime.fromisoformat(user['premium_until'])
+            except ValueError:
+                continue
+
+            days = plan_days.get(user.get('premium_plan_id'), 30)
+            if self.record(user_id, 'backfill', user.get('premium_plan_id'), price, days, at=until - timedelta(days=days)):
+                recorded += 1
+
+        if recorded:
+            logger.info("Backfilled payment ledger with %s activations", recorded)
+        return recorded
+
+    def total_revenue(self) -> int:
+        """All-time revenue (toman)"""
+        row = self.conn.execute(
+            "SELECT COALESCE(SUM(amount), 0) FROM revenue_periods WHERE granularity = ?",
+            (MONTH,),
+        ).fetchone()
+        return row[0]
+
+    def summary(self) -> Dict[str, int]:
+        """Revenue totals for the admin stats"""
+        now = datetime.now()
+        return {
+            'revenue': self.total_revenue(),
+            'revenue_today': self.revenue_for(DAY, now.strftime('%Y-%m-%d'))[0],
+            'revenue_month': self.revenue_for(MONTH, now.strftime('%Y-%m'))[0],
+        }
+
+    def revenue_by_period(self, granularity: str = DAY, limit: int = 30) -> List[Tuple[str, int, int]]:
+        """(period, revenue, activations) for the latest `limit` days or months"""
+        return self.conn.execute(
+            "SELECT period, SUM(amount), SUM(count) FROM revenue_periods WHERE granularity = ? "
+            "GROUP BY period ORDER BY period DESC LIMIT ?",
+            (granularity, limit),
+        ).fetchall()
+
+    def revenue_for(self, granularity: str, period: str) -> Tuple[int, int]:
+        """(revenue, activations) for one day ('YYYY-MM-DD') or month ('YYYY-MM')"""
+        return self.conn.execute(
+            "SELECT COALESCE(SUM(amount), 0), COALESCE(SUM(count), 0) FROM revenue_periods "
+            "WHERE granularity = ? AND period = ?",
+            (granularity, period),
+        ).fetchone()
+
+    def revenue_by_plan(self, since_month: Optional[str] = None) -> Dict[str, Tuple[int, int]]:
+        """plan_id -> (revenue, activations), optionally from `since_month` on"""
+        rows = self.conn.execute(
+            "SELECT plan_id, SUM(amount), SUM(count) FROM revenue_periods "
+            "WHERE granularity = ? AND period >= ? GROUP BY plan_id ORDER BY SUM(amount) DESC",
+            (MONTH, since_month or ''),
+        ).fetchall()
+        return {plan_id: (amount, count) for plan_id, amount, count in rows}
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# Initialize payment ledger
+ledger = PaymentLedger()
@@ -0,0 +1,363 @@
+# outbox.py - Persistent Notification Outbox
+# صف ماندگار نوتیفیکیشن‌ها
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+
+from config import *
+from broadcasts import is_chat_unreachable
+from database import db
+from ratelimit import LANE_NOTIFICATION
+from texts import NOTIF_DIGEST_HEADER
+
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationOutbox:
+    """Durable notification queue, drained by a background worker
+
+    Handlers call `enqueue` (one SQLite insert) and return right away. The
+    worker sends through the notification lane and retries failures with
+    backoff; a row is deleted only once delivered or given up on, so pending
+    notifications survive a restart.
+
+    Activity notifications (`enqueue_grouped`) are coalesced per recipient
+    and item: at most one goes out per `coalesce_window`, rendered as
+    "X and N others ...". Digest users get theirs in one daily message.
+    """
+
+    def __init__(
+        self,
+        path: str = OUTBOX_PATH,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+        coalesce_window: float = NOTIFICATION_COALESCE_WINDOW,
+        digest_hour: int = NOTIFICATION_DIGEST_HOUR,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.coalesce_window = coalesce_window
+        self.digest_hour = digest_hour
+        self._inflight = set()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS notifications (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    parse_mode TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_error TEXT
+                )
+                """
+            )
+            # Columns added after the first release of the outbox
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(notifications)")}
+            for column, definition in (
+                ('coalesce_key', 'TEXT'),
+                ('payload', 'TEXT'),
+                ('count', 'INTEGER NOT NULL DEFAULT 1'),
+                ('digest', 'INTEGER NOT NULL DEFAULT 0'),
+            ):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE notifications ADD COLUMN {column} {definition}")
+
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications (next_attempt_at, id)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_notifications_key ON notifications (user_id, coalesce_key)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS notification_windows (
+                    user_id INTEGER NOT NULL,
+                    coalesce_key TEXT NOT NULL,
+                    last_sent_at REAL NOT NULL,
+                    PRIMARY KEY (user_id, coalesce_key)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS notification_stats (
+                    hour INTEGER PRIMARY KEY,
+                    events INTEGER NOT NULL DEFAULT 0,
+                    saved INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            self._conn = conn
+        return self._conn
+
+    def enqueue(self, user_id: int, text: str, parse_mode: Optional[str] = ParseMode.MARKDOWN):
+        """Store notification for delivery"""
+        now = time.time()
+        self.conn.execute(
+            "INSERT INTO notifications (user_id, text, parse_mode, next_attempt_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (int(user_id), text, parse_mode, now, now),
+        )
+        self._record(events=1)
+        if self._wakeup:
+            self._wakeup.set()
+
+    def enqueue_grouped(
+        self,
+        user_id: int,
+        key: str,
+        single: str,
+        many: str,
+        params: Dict[str, Any],
+        digest: bool = False,
+    ):
+        """Queue an activity notification, merging it with pending ones for `key`
+
+        `single` and `many` are formatted with `params`; `many` also gets
+        ``others`` (how many more events were merged in).
+        """
+        now = time.time()
+        user_id = int(user_id)
+        payload = json.dumps({'single': single, 'many': many, 'params': params}, ensure_ascii=False)
+
+        row = self.conn.execute(
+            "SELECT id, count FROM notifications WHERE user_id = ? AND coalesce_key = ? "
+            "ORDER BY id DESC LIMIT 1",
+            (user_id, key),
+        ).fetchone()
+
+        if row and row[0] not in self._inflight:
+            notification_id, count = row
+            # Name the latest actor: "X and N others"
+            self.conn.execute(
+                "UPDATE notifications SET count = ?, payload = ?, text = ? WHERE id = ?",
+                (count + 1, payload, self._render(payload, count + 1), notification_id),
+            )
+            self._record(events=1, saved=1)
+            return
+
+        if digest:
+            send_at = self._next_digest_at(now)
+        elif row:
+            # The previous one for this key is being sent right now
+            send_at = now + self.coalesce_window
+        else:
+            window = self.conn.execute(
+                "SELECT last_sent_at FROM notification_windows WHERE user_id = ? AND coalesce_key = ?",
+                (user_id, key),
+            ).fetchone()
+            send_at = max(now, window[0] + self.coalesce_window) if window else now
+
+        self.conn.execute(
+            "INSERT INTO notifications "
+            "(user_id, text, parse_mode, next_attempt_at, created_at, coalesce_key, payload, digest) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (user_id, self._render(payload, 1), ParseMode.MARKDOWN, send_at, now, key, payload, int(digest)),
+        )
+        self._record(events=1)
+        if self._wakeup and send_at <= now:
+            self._wakeup.set()
+
+    @staticmethod
+    def _render(payload: str, count: int) -> str:
+        data = json.loads(payload)
+        if count > 1:
+            return data['many'].format(others=count - 1, **data['params'])
+        return data['single'].format(**data['params'])
+
+    def _next_digest_at(self, now: float) -> float:
+        current = datetime.fromtimestamp(now)
+        digest_at = current.replace(hour=self.digest_hour, minute=0, second=0, microsecond=0)
+        if digest_at <= current:
+            digest_at += timedelta(days=1)
+        return digest_at.timestamp()
+
+    def _record(self, events: int = 0, saved: int = 0):
+        self.conn.execute(
+            "INSERT INTO notification_stats (hour, events, saved) VALUES (?, ?, ?) "
+            "ON CONFLICT(hour) DO UPDATE SET events = events + excluded.events, saved = saved + excluded.saved",
+            (int(time.time() // 3600), events, saved),
+        )
+
+    def savings(self, hours: int = 24) -> Dict[str, float]:
+        """Notification events vs. messages saved by coalescing over the last `hours`"""
+        since = int(time.time() // 3600) - hours + 1
+        events, saved = self.conn.execute(
+            "SELECT COALESCE(SUM(events), 0), COALESCE(SUM(saved), 0) FROM notification_stats WHERE hour >= ?",
+            (since,),
+        ).fetchone()
+        return {
+            'hours': hours,
+            'events': events,
+            'saved': saved,
+            'saved_per_hour': saved / hours if hours else 0.0,
+        }
+
+    def pending_count(self) -> int:
+        """Number of notifications waiting for delivery"""
+        return self.conn.execute("SELECT COUNT(*) FROM notifications").fetchone()[0]
+
+    def _due(self) -> List[List[Tuple]]:
+        """Due rows grouped into messages: digest rows are combined per user
+
+        A user's digest is always taken whole, even past `batch_size`, so it
+        never goes out split across several messages.
+        """
+        now = time.time()
+        columns = "id, user_id, text, parse_mode, attempts, coalesce_key, digest"
+        rows = self.conn.execute(
+            f"SELECT {columns} FROM notifications WHERE next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (now, self.batch_size),
+        ).fetchall()
+
+        messages = [[row] for row in rows if not row[6]]
+        digest_users = list(dict.fromkeys(row[1] for row in rows if row[6]))
+        if digest_users:
+            digests = defaultdict(list)
+            placeholders = ", ".join("?" * len(digest_users))
+            for row in self.conn.execute(
+                f"SELECT {columns} FROM notifications "
+                f"WHERE digest = 1 AND next_attempt_at <= ? AND user_id IN ({placeholders}) ORDER BY id",
+                (now, *digest_users),
+            ):
+                digests[row[1]].append(row)
+            messages.extend(digests.values())
+        return messages
+
+    def _delete(self, rows: List[Tuple]):
+        self.conn.executemany("DELETE FROM notifications WHERE id = ?", [(row[0],) for row in rows])
+
+    def _retry_later(self, rows: List[Tuple], attempts: int, delay: float, error: Exception):
+        self.conn.executemany(
+            "UPDATE notifications SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            [(attempts, time.time() + delay, str(error), row[0]) for row in rows],
+        )
+
+    def _mark_sent(self, rows: List[Tuple]):
+        now = time.time()
+        self._delete(rows)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO notification_windows (user_id, coalesce_key, last_sent_at) VALUES (?, ?, ?)",
+            [(row[1], row[5], now) for row in rows if row[5] and not row[6]],
+        )
+        if len(rows) > 1:
+            self._record(saved=len(rows) - 1)
+
+    async def _deliver(self, bot, rows: List[Tuple]):
+        user_id = rows[0][1]
+        parse_mode = rows[0][3]
+        attempts = max(row[4] for row in rows)
+        if len(rows) == 1:
+            text = rows[0][2]
+        else:
+            text = "\n\n".join([NOTIF_DIGEST_HEADER] + [row[2] for row in rows])
+
+        ids = [row[0] for row in rows]
+        self._inflight.update(ids)
+        try:
+            await bot.send_message(
+                chat_id=user_id,
+                text=text,
+                parse_mode=parse_mode,
+                rate_limit_args=LANE_NOTIFICATION,
+            )
+        except Exception as exc:
+            if is_chat_unreachable(exc):
+                db.mark_user_unreachable(user_id)
+                self._delete(rows)
+                return
+
+            attempts += 1
+            if isinstance(exc, BadRequest) or attempts >= self.max_attempts:
+                logger.error("Dropping notification %s to %s: %s", ids, user_id, exc)
+                self._delete(rows)
+                return
+
+            delay = exc.retry_after if isinstance(exc, RetryAfter) else min(5 * 2 ** attempts, 600)
+            logger.warning("Notification %s to %s failed, retrying in %ss: %s", ids, user_id, delay, exc)
+            self._retry_later(rows, attempts, delay, exc)
+            return
+        finally:
+            self._inflight.difference_update(ids)
+
+        self._mark_sent(rows)
+
+    def _prune_windows(self):
+        self.conn.execute(
+            "DELETE FROM notification_windows WHERE last_sent_at < ?",
+            (time.time() - self.coalesce_window,),
+        )
+
+    async def _run(self, bot):
+        while True:
+            self._wakeup.clear()
+            try:
+                messages = self._due()
+                if messages:
+                    await asyncio.gather(*(self._deliver(bot, rows) for rows in messages))
+                    continue
+                self._prune_windows()
+            except sqlite3.Error as exc:
+                logger.error("Notification outbox error: %s", exc)
+
+            # Woken by enqueue; the timeout picks up rows scheduled for retry
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+
+    def start(self, application):
+        """Start draining the outbox in the background"""
+        if self._task and not self._task.done():
+            return
+
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(application.bot), name='notification_outbox')
+
+        pending = self.pending_count()
+        if pending:
+            logger.info("Notification outbox has %s pending notifications", pending)
+
+    async def stop(self):
+        """Stop the worker; undelivered notifications stay queued"""
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# Initialize notification outbox
+outbox = NotificationOutbox()
@@ -0,0 +1,251 @@
+# payments.py - ZarinPal Payment Gateway Client
+# کلاینت async درگاه پرداخت زرین‌پال
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+# ZarinPal v4 result codes
+CODE_OK = 100
+CODE_ALREADY_VERIFIED = 101
+
+
+class GatewayError(Exception):
+    """The gateway could not be reached or answered with a server error"""
+
+
+class GatewayUnavailable(GatewayError):
+    """The circuit breaker is open; the request wasn't sent"""
+
+
+class CircuitBreaker:
+    """Fail fast while a dependency keeps failing
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    calls are refused for `reset_timeout` seconds. Then it is half-open:
+    one probe call is let through, and its outcome closes or re-opens it.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = ZARINPAL_BREAKER_FAILURES, reset_timeout: float = ZARINPAL_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.failure_threshold:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    @property
+    def available(self) -> bool:
+        """Whether a call would be let through right now"""
+        state = self.state
+        return state == self.CLOSED or (state == self.HALF_OPEN and not self._probing)
+
+    def acquire(self):
+        """Claim permission for a call; raise GatewayUnavailable if refused"""
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        raise GatewayUnavailable("circuit open")
+
+    def release(self):
+        """Give back a probe whose call ended without a verdict (cancelled)"""
+        self._probing = False
+
+    def record_success(self):
+        if self.failures >= self.failure_threshold:
+            logger.info("Payment gateway recovered, closing circuit")
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.failure_threshold:
+            if self.failures == self.failure_threshold:
+                logger.warning("Payment gateway failing, opening circuit for %ss", self.reset_timeout)
+            self.opened_at = time.monotonic()
+
+
+class ZarinPal:
+    """Async ZarinPal client sharing one keep-alive connection pool
+
+    Connection failures, timeouts and 5xx answers are retried with backoff
+    up to `max_attempts`; a 4xx answer is final. Retrying a payment request
+    is harmless: at worst an unused authority is left to expire. Calls that
+    still fail count towards the circuit breaker, which then refuses calls
+    without touching the network until the gateway answers a probe again.
+    """
+
+    def __init__(
+        self,
+        merchant_id: str = ZARINPAL_MERCHANT_ID,
+        sandbox: bool = ZARINPAL_SANDBOX,
+        base_url: str = ZARINPAL_STUB_URL,
+        connect_timeout: float = ZARINPAL_CONNECT_TIMEOUT,
+        read_timeout: float = ZARINPAL_READ_TIMEOUT,
+        max_attempts: int = ZARINPAL_MAX_ATTEMPTS,
+        pool_size: int = ZARINPAL_POOL_SIZE,
+    ):
+        self.merchant_id = merchant_id
+        self.sandbox = sandbox
+
+        if base_url:
+            # Local stub gateway (fake_zarinpal.py)
+            base_url = base_url.rstrip('/')
+            self.request_url = f"{base_url}/pg/v4/payment/request.json"
+            self.verify_url = f"{base_url}/pg/v4/payment/verify.json"
+            self.payment_url = f"{base_url}/pg/StartPay/"
+        elif self.sandbox:
+            self.request_url = ZARINPAL_SANDBOX_REQUEST_URL
+            self.verify_url = ZARINPAL_SANDBOX_VERIFY_URL
+            self.payment_url = ZARINPAL_SANDBOX_PAYMENT_URL
+        else:
+            self.request_url = ZARINPAL_REQUEST_URL
+            self.verify_url = ZARINPAL_VERIFY_URL
+            self.payment_url = ZARINPAL_PAYMENT_URL
+
+        self.timeout = aiohttp.ClientTimeout(total=None, connect=connect_timeout, sock_read=read_timeout)
+        self.max_attempts = max(1, max_attempts)
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def available(self) -> bool:
+        """False while the circuit breaker refuses calls"""
+        return self.breaker.available
+
+    def payment_link(self, authority: str) -> str:
+        """URL the user opens to pay `authority`"""
+        return f"{self.payment_url}{authority}"
+
+    @staticmethod
+    def _to_rial(amount: int) -> int:
+        """Convert toman amount to rial for ZarinPal"""
+        return int(amount * 10)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created lazily so it binds to the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={'Accept': 'application/json'},
+            )
+        return self._session
+
+    async def close(self):
+        """Close the connection pool"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _post(self, url: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """POST JSON to the gateway through the circuit breaker"""
+        self.breaker.acquire()
+        try:
+            result = await self._post_with_retries(url, data)
+        except GatewayError:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+
+        self.breaker.record_success()
+        return result
+
+    async def _post_with_retries(self, url: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """POST JSON to the gateway, retrying transient failures"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                async with self.session.post(url, json=data) as response:
+                    if response.status >= 500:
+                        raise GatewayError(f"HTTP {response.status}")
+                    result = await response.json(content_type=None)
+                    return result if isinstance(result, dict) else {}
+            except (aiohttp.ClientError, asyncio.TimeoutError, GatewayError) as exc:
+                if isinstance(exc, aiohttp.ContentTypeError) or attempt >= self.max_attempts:
+                    raise GatewayError(str(exc) or type(exc).__name__) from exc
+                delay = 0.5 * 2 ** (attempt - 1)
+                logger.warning("ZarinPal request failed (%s/%s), retrying in %ss: %r",
+                               attempt, self.max_attempts, delay, exc)
+                await asyncio.sleep(delay)
+
+    async def create_payment(self, amount: int, description: str, user_id: int) -> Optional[Dict[str, str]]:
+        """
+        Create payment request
+        Returns: dict with payment_url and authority or None
+        """
+        data = {
+            "merchant_id": self.merchant_id,
+            "amount": self._to_rial(amount),
+            "description": description,
+            "callback_url": f"{ZARINPAL_CALLBACK_URL}?user_id={user_id}",
+        }
+
+        try:
+            result = await self._post(self.request_url, data)
+        except (GatewayError, ValueError) as e:
+            logger.error("ZarinPal Request Error: %s", e)
+            return None
+
+        payment = result.get('data') or {}
+        if payment.get('code') == CODE_OK and payment.get('authority'):
+            authority = payment['authority']
+            return {"payment_url": self.payment_link(authority), "authority": authority}
+
+        logger.error("ZarinPal Error: %s", result)
+        return None
+
+    async def verify_payment(self, authority: str, amount: int) -> Optional[bool]:
+        """
+        Verify payment after callback
+        Returns: True if paid (or already verified), False if not paid,
+        None if the gateway couldn't be reached
+        """
+        data = {
+            "merchant_id": self.merchant_id,
+            "amount": self._to_rial(amount),
+            "authority": authority,
+        }
+
+        try:
+            result = await self._post(self.verify_url, data)
+        except (GatewayError, ValueError) as e:
+            logger.error("ZarinPal Verify Error: %s", e)
+            return None
+
+        if (result.get('data') or {}).get('code') in (CODE_OK, CODE_ALREADY_VERIFIED):
+            return True
+
+        logger.info("ZarinPal payment %s not verified: %s", authority, result)
+        return False
+
+
+# Initialize ZarinPal
+zarinpal = ZarinPal()
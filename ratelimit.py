@@ -0,0 +1,298 @@
+# ratelimit.py - Token Buckets For Telegram Sends
+# محدودکننده نرخ ارسال پیام‌ها
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine, Deque, Dict, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+# Bot API methods that create a message in the target chat
+MESSAGE_ENDPOINT_PREFIXES = ('send', 'copy', 'forward')
+
+# Outbound message classes, passed to bot methods as ``rate_limit_args``
+LANE_INTERACTIVE = 'interactive'
+LANE_NOTIFICATION = 'notification'
+LANE_BULK = 'bulk'
+
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+
+    def delay(self, tokens: float = 1) -> float:
+        """Seconds until `tokens` would be available (0 if now)"""
+        self._refill()
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1):
+        """Wait until tokens are available, then consume them"""
+        async with self._lock:
+            wait = self.delay(tokens)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.delay(tokens)
+            self.tokens -= tokens
+
+
+class ChatRateLimiter:
+    """Per-chat token buckets matching Telegram's per-chat send limits"""
+
+    def __init__(
+        self,
+        private_rate: float = CHAT_SEND_RATE,
+        private_burst: float = CHAT_SEND_BURST,
+        group_rate: float = GROUP_SEND_RATE,
+        group_burst: float = GROUP_SEND_BURST,
+        idle_ttl: float = CHAT_BUCKET_IDLE_TTL,
+        prune_interval: float = CHAT_BUCKET_PRUNE_INTERVAL,
+    ):
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.idle_ttl = idle_ttl
+        self.prune_interval = prune_interval
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._pruned_at = time.monotonic()
+
+    def bucket(self, chat_id: int) -> TokenBucket:
+        """Return (creating if needed) the bucket for chat"""
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Broadcasts touch every chat once; drop idle buckets as new ones come in
+            if time.monotonic() - self._pruned_at >= self.prune_interval:
+                self.prune()
+
+            # Negative ids are groups/channels, which Telegram limits per minute
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: int):
+        """Wait for a send slot in chat"""
+        await self.bucket(int(chat_id)).acquire()
+
+    def prune(self, idle_seconds: Optional[float] = None):
+        """Drop buckets that have been full (idle) for a while"""
+        if idle_seconds is None:
+            idle_seconds = self.idle_ttl
+        now = self._pruned_at = time.monotonic()
+        for chat_id in list(self._buckets):
+            bucket = self._buckets[chat_id]
+            if now - bucket.updated_at > idle_seconds and not bucket._lock.locked():
+                del self._buckets[chat_id]
+
+
+class LaneScheduler:
+    """Weighted fair sharing of a token bucket between message lanes
+
+    Each lane gets tokens in proportion to its weight while it has waiters
+    (stride scheduling). If the oldest interactive waiter is older than
+    `max_interactive_wait`, it is served next regardless of the weights.
+    """
+
+    def __init__(
+        self,
+        bucket: TokenBucket,
+        weights: Dict[str, float] = SEND_LANE_WEIGHTS,
+        max_interactive_wait: float = INTERACTIVE_MAX_WAIT,
+    ):
+        self.bucket = bucket
+        self.weights = dict(weights)
+        self.max_interactive_wait = max_interactive_wait
+        self._queues: Dict[str, Deque[Tuple[float, asyncio.Future]]] = {
+            lane: deque() for lane in self.weights
+        }
+        self._pass: Dict[str, float] = {lane: 0.0 for lane in self.weights}
+        self._stats: Dict[str, Dict[str, float]] = {
+            lane: {'sent': 0, 'total_wait': 0.0, 'max_wait': 0.0, 'last_wait': 0.0}
+            for lane in self.weights
+        }
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def _lane(self, lane: Optional[str]) -> str:
+        return lane if lane in self._queues else LANE_INTERACTIVE
+
+    async def acquire(self, lane: Optional[str] = None):
+        """Wait until the dispatcher grants this lane a global token"""
+        lane = self._lane(lane)
+        queue = self._queues[lane]
+
+        if not queue:
+            # A lane that was idle must not bank credit from the idle period
+            active = [self._pass[name] for name, q in self._queues.items() if q]
+            if active:
+                self._pass[lane] = max(self._pass[lane], min(active))
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append((time.monotonic(), future))
+
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        await future
+
+    def _refund(self):
+        self.bucket.tokens = min(self.bucket.capacity, self.bucket.tokens + 1)
+
+    def _pick(self) -> Optional[str]:
+        interactive = self._queues.get(LANE_INTERACTIVE)
+        if interactive and time.monotonic() - interactive[0][0] >= self.max_interactive_wait:
+            return LANE_INTERACTIVE
+
+        candidates = [lane for lane, queue in self._queues.items() if queue]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda lane: self._pass[lane])
+
+    async def _dispatch(self):
+        while True:
+            lane = self._pick()
+            if lane is None:
+                return
+
+            await self.bucket.acquire()
+
+            # Re-pick: an interactive request may have arrived while waiting
+            lane = self._pick()
+            if lane is None:
+                self._refund()
+                return
+
+            enqueued_at, future = self._queues[lane].popleft()
+            if future.done():
+                # Waiter was cancelled; give the token back
+                self._refund()
+                continue
+
+            self._pass[lane] += 1 / self.weights[lane]
+
+            waited = time.monotonic() - enqueued_at
+            stats = self._stats[lane]
+            stats['sent'] += 1
+            stats['total_wait'] += waited
+            stats['last_wait'] = waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+
+            future.set_result(None)
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """Per-lane queue depth and wait times (seconds)"""
+        now = time.monotonic()
+        result = {}
+        for lane, queue in self._queues.items():
+            stats = self._stats[lane]
+            sent = stats['sent']
+            result[lane] = {
+                'depth': len(queue),
+                'oldest_wait': (now - queue[0][0]) if queue else 0.0,
+                'sent': sent,
+                'avg_wait': (stats['total_wait'] / sent) if sent else 0.0,
+                'max_wait': stats['max_wait'],
+                'last_wait': stats['last_wait'],
+            }
+        return result
+
+
+class SendScheduler(BaseRateLimiter):
+    """Outbound scheduler around the bot: global + per-chat buckets, RetryAfter aware
+
+    Installed on the Application via ``ApplicationBuilder.rate_limiter`` so every
+    ``context.bot`` call (including ``message.reply_text``) goes through it.
+    Pass ``rate_limit_args=LANE_BULK`` / ``LANE_NOTIFICATION`` to lower a
+    send's priority; unlabelled sends are interactive.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_SEND_RATE,
+        global_burst: float = GLOBAL_SEND_BURST,
+        max_retries: int = SEND_MAX_RETRIES,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.lanes = LaneScheduler(self.global_bucket)
+        self.chat_limiter = ChatRateLimiter()
+        self.max_retries = max_retries
+        self._resume = asyncio.Event()
+        self._resume.set()
+
+    async def initialize(self):
+        self._resume.set()
+
+    async def shutdown(self):
+        self._resume.set()
+
+    @staticmethod
+    def _chat_id(data: Dict[str, Any]) -> Optional[int]:
+        chat_id = data.get('chat_id')
+        with contextlib.suppress(TypeError, ValueError):
+            return int(chat_id)
+        return None
+
+    async def _throttle(self, chat_id: Optional[int], lane: Optional[str]):
+        await self.chat_limiter.acquire(chat_id)
+        await self.lanes.acquire(lane)
+
+    def lane_metrics(self) -> Dict[str, Dict[str, float]]:
+        """Per-lane queue depth and wait-time metrics"""
+        return self.lanes.metrics()
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Any],
+    ):
+        chat_id = self._chat_id(data)
+        # Only new messages count against Telegram's limits; edits, deletes,
+        # callback answers and getUpdates go straight through.
+        throttled = chat_id is not None and endpoint.lower().startswith(MESSAGE_ENDPOINT_PREFIXES)
+
+        for attempt in range(self.max_retries + 1):
+            await self._resume.wait()
+            if throttled:
+                await self._throttle(chat_id, rate_limit_args)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt == self.max_retries:
+                    raise
+                delay = exc.retry_after + 0.1
+                logger.warning("Flood control on %s (chat %s), pausing sends for %.1fs", endpoint, chat_id, delay)
+                # Telegram flood limits are bot-wide, so hold every sender
+                self._resume.clear()
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._resume.set()
+        return None
@@ -0,0 +1,89 @@
+# rendering.py - Message Escaping and Templates
+# اسکیپ متن و قالب‌های از پیش آماده‌شده‌ی پیام‌ها
+
+import re
+from string import Formatter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram.constants import ParseMode
+
+
+MARKDOWN_SPECIAL_CHARS = '_*[]()~`>#+-=|{}.!'
+HTML_SPECIAL_CHARS = '&<>'
+
+_MARKDOWN_TABLE = str.maketrans({char: f'\\{char}' for char in MARKDOWN_SPECIAL_CHARS})
+_MARKDOWN_SEARCH = re.compile(f'[{re.escape(MARKDOWN_SPECIAL_CHARS)}]').search
+
+_HTML_TABLE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+_HTML_SEARCH = re.compile('[&<>]').search
+
+
+def escape_markdown(text: str) -> str:
+    """Escape special markdown characters in a single pass"""
+    # Most names and titles have nothing to escape; the regex scan is much
+    # cheaper than building a new string
+    if _MARKDOWN_SEARCH(text) is None:
+        return text
+    return text.translate(_MARKDOWN_TABLE)
+
+
+def escape_html(text: str) -> str:
+    """Escape text for Telegram's HTML parse mode"""
+    if _HTML_SEARCH(text) is None:
+        return text
+    return text.translate(_HTML_TABLE)
+
+
+ESCAPERS: Dict[Optional[str], Optional[Callable[[str], str]]] = {
+    ParseMode.MARKDOWN: escape_markdown,
+    ParseMode.MARKDOWN_V2: escape_markdown,
+    ParseMode.HTML: escape_html,
+    None: None,
+}
+
+
+class Template:
+    """A str.format template parsed once, escaping fields for its parse mode
+
+    Every field is escaped unless it is listed in `raw` (numbers, emoji,
+    text that is already escaped). Only plain field names are supported;
+    format specs work as in str.format.
+    """
+
+    __slots__ = ('source', 'parse_mode', 'fields', '_parts')
+
+    def __init__(self, source: str, parse_mode: Optional[str] = ParseMode.MARKDOWN, raw: Iterable[str] = ()):
+        if parse_mode not in ESCAPERS:
+            raise ValueError(f"Unsupported parse mode {parse_mode!r}")
+
+        escape = ESCAPERS[parse_mode]
+        raw = frozenset(raw)
+        parts: List[Tuple[str, Optional[str], str, Optional[Callable[[str], str]]]] = []
+
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if field is not None and (not field.isidentifier() or conversion):
+                raise ValueError(f"Template field {field!r} must be a plain name")
+            if field is None:
+                parts.append((literal, None, '', None))
+            else:
+                parts.append((literal, field, spec or '', None if field in raw else escape))
+
+        self.source = source
+        self.parse_mode = parse_mode
+        self.fields = frozenset(part[1] for part in parts if part[1] is not None)
+        self._parts = tuple(parts)
+
+    def render(self, **values) -> str:
+        out = []
+        append = out.append
+        for literal, field, spec, escape in self._parts:
+            append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            text = format(value, spec) if spec else (value if type(value) is str else str(value))
+            append(escape(text) if escape else text)
+        return ''.join(out)
+
+    def __repr__(self) -> str:
+        return f"Template({self.source!r}, parse_mode={self.parse_mode!r})"
@@ -0,0 +1,135 @@
+# router.py - Callback Query Router
+# مسیریاب دکمه‌های شیشه‌ای
+
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from texts import ERROR_GENERAL
+
+
+logger = logging.getLogger(__name__)
+
+CallbackHandler = Callable[..., Awaitable[Any]]
+
+# Characters that end an action prefix in callback_data
+PREFIX_SEPARATORS = ('_', ':')
+
+
+class Route:
+    """A registered callback action with its call statistics"""
+
+    __slots__ = ('pattern', 'handler', 'args', 'calls', 'errors', 'total_time', 'max_time')
+
+    def __init__(self, pattern: str, handler: CallbackHandler, args: int):
+        self.pattern = pattern
+        self.handler = handler
+        self.args = args
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def parse_args(self, payload: str) -> Optional[Tuple[str, ...]]:
+        """Split the part after the prefix into exactly `args` values"""
+        if self.args == 0:
+            return ()
+        if self.args == 1:
+            return (payload,)
+
+        parts = payload.split(':', self.args - 1)
+        if len(parts) != self.args:
+            return None
+        return tuple(parts)
+
+
+class CallbackRouter:
+    """Dispatch callback_data to small registered handlers
+
+    A pattern ending in ``_`` or ``:`` is a prefix route: the rest of the data
+    is passed as arguments (``like_song:<playlist>:<song>`` with ``args=2``).
+    Other patterns must match the data exactly. Exact routes are a single
+    dict lookup; prefix routes are looked up only at separator positions,
+    longest first, so ``like_song:`` wins over ``like_`` regardless of the
+    order they were registered in.
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, Route] = {}
+        self._prefixes: Dict[str, Route] = {}
+        self.unmatched = 0
+
+    def route(self, pattern: str, args: Optional[int] = None):
+        """Decorator registering a handler for `pattern`"""
+        is_prefix = pattern.endswith(PREFIX_SEPARATORS)
+        if args is None:
+            args = 1 if is_prefix else 0
+
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            table = self._prefixes if is_prefix else self._exact
+            if pattern in table:
+                raise ValueError(f"Callback route {pattern!r} is already registered")
+            table[pattern] = Route(pattern, handler, args)
+            return handler
+
+        return decorator
+
+    def resolve(self, data: str) -> Tuple[Optional[Route], str]:
+        """Return the matching route and the payload after its prefix"""
+        route = self._exact.get(data)
+        if route:
+            return route, ''
+
+        for index in range(len(data) - 1, -1, -1):
+            if data[index] in PREFIX_SEPARATORS:
+                route = self._prefixes.get(data[:index + 1])
+                if route:
+                    return route, data[index + 1:]
+
+        return None, ''
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+        """Run the handler for the update's callback data; False if none matched"""
+        query = update.callback_query
+        data = query.data or ''
+
+        route, payload = self.resolve(data)
+        if route is None:
+            self.unmatched += 1
+            logger.debug("No callback route for %r", data)
+            return False
+
+        args = route.parse_args(payload)
+        if args is None:
+            await query.answer(ERROR_GENERAL, show_alert=True)
+            return True
+
+        started = time.perf_counter()
+        try:
+            await route.handler(update, context, *args)
+        except Exception:
+            route.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            route.calls += 1
+            route.total_time += elapsed
+            route.max_time = max(route.max_time, elapsed)
+
+        return True
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """Per-route call counts, errors and latency (seconds)"""
+        result = {}
+        for route in list(self._exact.values()) + list(self._prefixes.values()):
+            result[route.pattern] = {
+                'calls': route.calls,
+                'errors': route.errors,
+                'avg_time': (route.total_time / route.calls) if route.calls else 0.0,
+                'max_time': route.max_time,
+                'total_time': route.total_time,
+            }
+        return result
@@ -0,0 +1,229 @@
+# storage_gc.py - Storage Channel Garbage Collector
+# پاک کردن پیام‌های بی‌استفاده‌ی کانال ذخیره در پس‌زمینه
+
+import asyncio
+import contextlib
+import logging
+import os
+import sqlite3
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from telegram.error import BadRequest, RetryAfter
+
+from config import *
+from database import db
+
+
+logger = logging.getLogger(__name__)
+
+StorageMessage = Tuple[int, int]  # (channel_id, message_id)
+
+
+class StorageCollector:
+    """Deletes storage channel messages that no song uses anymore
+
+    Handlers `enqueue` what delete_playlist / remove_song_from_playlist hand
+    back and return right away. A background worker deletes due messages in
+    batches, retrying failures with backoff; the queue is in SQLite, so
+    pending deletions survive a restart. A message that a song references
+    again by the time it is due is kept.
+
+    Messages the bot forwards into the channel are `track`ed as well, and
+    `reconcile` queues tracked messages no song has referenced for
+    `orphan_grace` seconds: forwards whose song was never saved, or
+    deletions lost to a crash.
+    """
+
+    def __init__(
+        self,
+        path: str = STORAGE_GC_PATH,
+        batch_size: int = STORAGE_GC_BATCH_SIZE,
+        concurrency: int = STORAGE_GC_CONCURRENCY,
+        max_attempts: int = STORAGE_GC_MAX_ATTEMPTS,
+        poll_interval: float = STORAGE_GC_POLL_INTERVAL,
+        orphan_grace: float = STORAGE_GC_ORPHAN_GRACE,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.orphan_grace = orphan_grace
+        self.deleted = 0
+        self.failed = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS storage_messages (
+                    channel_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    delete_at REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    PRIMARY KEY (channel_id, message_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_storage_messages_due
+                    ON storage_messages (delete_at) WHERE delete_at IS NOT NULL;
+                """
+            )
+            self._conn = conn
+        return self._conn
+
+    def track(self, channel_id: int, message_id: int):
+        """Remember a message the bot forwarded into the storage channel"""
+        self.conn.execute(
+            "INSERT OR IGNORE INTO storage_messages (channel_id, message_id, created_at) VALUES (?, ?, ?)",
+            (int(channel_id), int(message_id), time.time()),
+        )
+
+    def enqueue(self, messages: Iterable[StorageMessage]):
+        """Queue storage messages for deletion"""
+        now = time.time()
+        rows = [(int(channel_id), int(message_id), now, now) for channel_id, message_id in messages]
+        if not rows:
+            return
+
+        self.conn.executemany(
+            "INSERT INTO storage_messages (channel_id, message_id, created_at, delete_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(channel_id, message_id) DO UPDATE SET delete_at = COALESCE(delete_at, excluded.delete_at)",
+            rows,
+        )
+        if self._wakeup:
+            self._wakeup.set()
+
+    def pending_count(self) -> int:
+        """Messages waiting to be deleted"""
+        return self.conn.execute("SELECT COUNT(*) FROM storage_messages WHERE delete_at IS NOT NULL").fetchone()[0]
+
+    def reconcile(self) -> int:
+        """Queue tracked messages that no song references; returns how many"""
+        rows = self.conn.execute(
+            "SELECT channel_id, message_id FROM storage_messages WHERE delete_at IS NULL AND created_at <= ?",
+            (time.time() - self.orphan_grace,),
+        ).fetchall()
+
+        orphans = [row for row in rows if not db.storage_message_in_use(*row)]
+        if orphans:
+            logger.info("Queueing %s orphaned storage messages for deletion", len(orphans))
+            self.enqueue(orphans)
+        return len(orphans)
+
+    def _due(self) -> List[Tuple[int, int, int]]:
+        return self.conn.execute(
+            "SELECT channel_id, message_id, attempts FROM storage_messages "
+            "WHERE delete_at IS NOT NULL AND delete_at <= ? ORDER BY delete_at LIMIT ?",
+            (time.time(), self.batch_size),
+        ).fetchall()
+
+    def _forget(self, rows: List[StorageMessage]):
+        self.conn.executemany(
+            "DELETE FROM storage_messages WHERE channel_id = ? AND message_id = ?",
+            rows,
+        )
+
+    def _keep(self, rows: List[StorageMessage]):
+        """A song uses these again: leave them tracked, not queued"""
+        self.conn.executemany(
+            "UPDATE storage_messages SET delete_at = NULL, attempts = 0, last_error = NULL "
+            "WHERE channel_id = ? AND message_id = ?",
+            rows,
+        )
+
+    async def _delete(self, bot, semaphore: asyncio.Semaphore, channel_id: int, message_id: int, attempts: int):
+        async with semaphore:
+            try:
+                await bot.delete_message(chat_id=channel_id, message_id=message_id)
+            except BadRequest as exc:
+                # Already gone, or never deletable: retrying won't help
+                logger.warning("Storage message %s in %s not deleted: %s", message_id, channel_id, exc)
+            except Exception as exc:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    self.failed += 1
+                    logger.error("Giving up deleting storage message %s in %s: %s", message_id, channel_id, exc)
+                else:
+                    delay = exc.retry_after if isinstance(exc, RetryAfter) else min(30 * 2 ** attempts, 3600)
+                    self.conn.execute(
+                        "UPDATE storage_messages SET attempts = ?, delete_at = ?, last_error = ? "
+                        "WHERE channel_id = ? AND message_id = ?",
+                        (attempts, time.time() + delay, str(exc), channel_id, message_id),
+                    )
+                    return
+            else:
+                self.deleted += 1
+
+        self._forget([(channel_id, message_id)])
+
+    async def _collect(self, bot) -> int:
+        rows = self._due()
+        if not rows:
+            return 0
+
+        in_use = [(channel_id, message_id) for channel_id, message_id, _ in rows
+                  if db.storage_message_in_use(channel_id, message_id)]
+        if in_use:
+            self._keep(in_use)
+
+        in_use = set(in_use)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(
+            self._delete(bot, semaphore, channel_id, message_id, attempts)
+            for channel_id, message_id, attempts in rows
+            if (channel_id, message_id) not in in_use
+        ))
+        return len(rows)
+
+    async def _run(self, bot):
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self._collect(bot) >= self.batch_size:
+                    continue
+            except sqlite3.Error as exc:
+                logger.error("Storage collector error: %s", exc)
+
+            # Woken by enqueue; the timeout picks up deletions scheduled for retry
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+
+    def start(self, application):
+        """Start deleting queued messages in the background"""
+        if self._task and not self._task.done():
+            return
+
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(application.bot), name='storage_gc')
+
+        pending = self.pending_count()
+        if pending:
+            logger.info("Storage collector has %s messages queued for deletion", pending)
+
+    async def stop(self):
+        """Stop the worker; queued deletions stay queued"""
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# Initialize storage collector
+storage_gc = StorageCollector()
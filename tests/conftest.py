@@ -0,0 +1,13 @@
+import pytest
+
+import database
+from cache import caches
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A Database backed by an empty file in tmp_path, with fresh caches"""
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'users.json'))
+    caches.clear()
+    yield database.Database()
+    caches.clear()
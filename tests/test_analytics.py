@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+import database
+from analytics import AnalyticsPool
+
+
+@pytest.fixture
+def pool(db, tmp_path):
+    pool = AnalyticsPool(db, snapshot_path=str(tmp_path / 'snapshot.pickle'), workers=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_search_finds_playlist_published_after_export(db, pool):
+    db.create_user(1, 'owner', "Owner")
+
+    async def scenario():
+        await pool.export_snapshot()
+        assert await pool.search_playlists("night") == []
+
+        playlist_id = db.create_playlist(1, "Night drive")
+        db.publish_playlist(playlist_id)
+        return [playlist['id'] for playlist in await pool.search_playlists("night")], playlist_id
+
+    found, playlist_id = asyncio.run(scenario())
+    assert found == [playlist_id]
+
+
+def test_unrelated_queries_reuse_snapshot(db, pool):
+    db.create_user(1, 'owner', "Owner")
+
+    async def scenario():
+        await pool.export_snapshot()
+        version = pool.version
+        db.publish_playlist(db.create_playlist(1, "Night drive"))
+        await pool.get_leaderboard()
+        return version
+
+    version = asyncio.run(scenario())
+    assert pool.version == version
+
+
+def test_plays_do_not_reexport_for_search(db, pool):
+    db.create_user(1, 'owner', "Owner")
+    playlist_id = db.create_playlist(1, "Night drive")
+    db.publish_playlist(playlist_id)
+
+    async def scenario():
+        await pool.search_playlists("night")
+        version = pool.version
+        db.increment_plays(playlist_id)
+        db.like_playlist(1, playlist_id)
+        await pool.search_playlists("night")
+        await pool.get_trending_playlists()
+        return version
+
+    version = asyncio.run(scenario())
+    assert pool.version == version
+
+
+def test_leaderboard_is_cached_per_snapshot(db, pool, monkeypatch):
+    import analytics
+
+    db.create_user(1, 'first', "First")
+    db.create_user(2, 'second', "Second")
+    playlist_id = db.create_playlist(2, "Hits")
+    db.publish_playlist(playlist_id)
+
+    runs = []
+    run = pool._run
+
+    async def counting_run(func, *args, **kwargs):
+        runs.append(func)
+        return await run(func, *args, **kwargs)
+
+    monkeypatch.setattr(pool, '_run', counting_run)
+
+    async def scenario():
+        await pool.export_snapshot()
+        first = await pool.get_leaderboard(limit=0)
+        rank = await pool.get_user_rank(2)
+        db.like_playlist(1, playlist_id)
+        cached = await pool.get_leaderboard(limit=1)
+        await pool.export_snapshot()
+        return first, rank, cached, await pool.get_leaderboard()
+
+    first, rank, cached, refreshed = asyncio.run(scenario())
+
+    assert runs == [analytics._leaderboard_task, analytics._leaderboard_task]
+    assert [row['likes'] for row in first] == [0, 0]
+    assert rank in (1, 2)
+    assert cached == first[:1]
+    assert refreshed[0]['user_id'] == '2' and refreshed[0]['likes'] == 1
+
+
+def test_sync_playlist_queries_skip_user_columns(db, monkeypatch):
+    db.create_user(1, 'owner', "Owner")
+    playlist_id = db.create_playlist(1, "Night drive")
+    db.publish_playlist(playlist_id)
+
+    def fail(data):
+        raise AssertionError("full snapshot built")
+
+    monkeypatch.setattr(database, 'build_snapshot', fail)
+    assert [playlist['id'] for playlist in db.search_playlists("NIGHT")] == [playlist_id]
+    assert [playlist['id'] for playlist in db.get_trending_playlists()] == [playlist_id]
+
+
+def test_stats_keep_premium_renewed_after_export(db, pool, tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+
+    import analytics
+    from ledger import PaymentLedger
+
+    ledger = PaymentLedger(path=str(tmp_path / 'ledger.sqlite3'))
+    monkeypatch.setattr(analytics, 'ledger', ledger)
+    db.create_user(1, 'lapsed', "Lapsed")
+    db.create_user(2, 'renewed', "Renewed")
+    expired = (datetime.now() - timedelta(days=1)).isoformat()
+    for user_id in (1, 2):
+        db.update_user(user_id, {'premium': True, 'premium_until': expired})
+
+    async def scenario():
+        await pool.export_snapshot()
+        db.update_user(2, {'premium_until': (datetime.now() + timedelta(days=30)).isoformat()})
+        return await pool.get_global_stats()
+
+    asyncio.run(scenario())
+    ledger.close()
+
+    assert not db.get_user(1)['premium']
+    assert db.is_premium(2)
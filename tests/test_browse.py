@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def screens(db, monkeypatch):
+    monkeypatch.setattr(bot, 'db', db)
+
+    async def send_response(update, text, **kwargs):
+        pass
+
+    monkeypatch.setattr(bot, 'send_response', send_response)
+
+    builds = []
+
+    def build():
+        builds.append(1)
+        return "screen", None, None
+
+    def show():
+        asyncio.run(bot.send_browse_screen(None, ('top',), build))
+        return len(builds)
+
+    return show
+
+
+def test_plays_and_likes_reuse_cached_screen(db, screens):
+    db.create_user(1, 'owner', "Owner")
+    playlist_id = db.create_playlist(1, "Night drive")
+    db.publish_playlist(playlist_id)
+
+    assert screens() == 1
+    db.increment_plays(playlist_id)
+    db.like_playlist(1, playlist_id)
+    assert screens() == 1
+
+
+def test_catalog_change_rebuilds_screen(db, screens):
+    db.create_user(1, 'owner', "Owner")
+    playlist_id = db.create_playlist(1, "Night drive")
+
+    assert screens() == 1
+    db.publish_playlist(playlist_id)
+    assert screens() == 2
@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import bot
+import broadcasts
+
+
+class RecordingBot:
+    def __init__(self):
+        self.copies = []
+        self.messages = []
+
+    async def copy_message(self, chat_id, **kwargs):
+        self.copies.append(chat_id)
+
+    async def send_message(self, chat_id, **kwargs):
+        self.messages.append(chat_id)
+
+
+@pytest.fixture
+def top_song(db, monkeypatch):
+    monkeypatch.setattr(bot, 'db', db)
+    monkeypatch.setattr(broadcasts, 'db', db)
+    for user_id in (1, 2, 3, 4):
+        db.create_user(user_id, f'user{user_id}', f"User {user_id}")
+
+    playlist_id = db.create_playlist(1, "Hits")
+    db.add_song_to_playlist(playlist_id, {
+        'title': "Track",
+        'performer': "Someone",
+        'duration': 180,
+        'channel_message_id': 7,
+        'storage_channel_id': -100,
+        'uploader_id': '1',
+    })
+    return db.get_playlist(playlist_id)['songs'][0]
+
+
+def test_fan_out_started_yesterday_is_resumed(db, top_song):
+    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    db.start_top_song_progress(yesterday, top_song, 3)
+    db.update_top_song_progress(cursor=2, sent=1)
+
+    recorder = RecordingBot()
+    asyncio.run(bot.resume_daily_top_song(recorder))
+
+    assert recorder.copies == [3, 4]
+    assert db.get_last_top_song_broadcast() == yesterday
+    assert db.get_top_song_progress() is None
+
+
+def test_nothing_to_resume(db, top_song):
+    recorder = RecordingBot()
+    asyncio.run(bot.resume_daily_top_song(recorder))
+
+    assert recorder.copies == [] and recorder.messages == []
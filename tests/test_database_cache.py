@@ -0,0 +1,26 @@
+def make_song(db, owner_id):
+    playlist_id = db.create_playlist(owner_id, "Road trip")
+    added, status = db.add_song_to_playlist(playlist_id, {
+        'title': "Track",
+        'performer': "Someone",
+        'duration': 180,
+        'file_size': 1000,
+        'channel_message_id': 1,
+        'storage_channel_id': -100,
+        'uploader_id': str(owner_id),
+    })
+    assert added, status
+    return db.get_playlist(playlist_id)['songs'][0]
+
+
+def test_existing_song_add_invalidates_users(db):
+    from cache import USERS, caches
+
+    db.create_user(1, 'owner', "Owner")
+    db.create_user(2, 'fan', "Fan")
+    song_id = make_song(db, 1)
+    target_id = db.create_playlist(2, "Mine")
+
+    version = caches.version(USERS)
+    assert db.add_existing_song_to_playlist(song_id, target_id, 2) == (True, 'added')
+    assert caches.version(USERS) > version
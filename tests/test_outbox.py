@@ -0,0 +1,38 @@
+import pytest
+
+from outbox import NotificationOutbox
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = NotificationOutbox(path=str(tmp_path / 'outbox.sqlite3'), batch_size=3)
+    yield outbox
+    outbox.conn.close()
+
+
+def queue_digest(outbox, user_id, count):
+    for index in range(count):
+        outbox.enqueue_grouped(user_id, f"like:{index}", "{name} liked", "{name} +{others}", {'name': index}, digest=True)
+    outbox.conn.execute("UPDATE notifications SET next_attempt_at = 0 WHERE user_id = ?", (user_id,))
+
+
+def test_digest_is_taken_whole_past_batch_size(outbox):
+    queue_digest(outbox, 1, 5)
+    outbox.enqueue(2, "hello")
+    queue_digest(outbox, 3, 2)
+
+    messages = outbox._due()
+
+    assert [len(rows) for rows in messages] == [5]
+    assert {row[1] for row in messages[0]} == {1}
+
+
+def test_digest_rows_not_yet_due_are_left(outbox):
+    queue_digest(outbox, 1, 2)
+    outbox.enqueue(2, "hello")
+    outbox.enqueue_grouped(1, "like:late", "late", "late +{others}", {}, digest=True)
+
+    messages = outbox._due()
+
+    assert sorted(len(rows) for rows in messages) == [1, 2]
+    assert sum(len(rows) for rows in messages) == 3
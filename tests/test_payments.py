@@ -0,0 +1,153 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from aiohttp import web
+
+import bot
+import database
+from fake_zarinpal import FakeGateway
+from ledger import PaymentLedger
+from payments import CircuitBreaker, GatewayError, GatewayUnavailable, ZarinPal
+
+
+@pytest.fixture
+def payment(db, tmp_path, monkeypatch):
+    """User 1 with a pending payment the gateway reports as paid"""
+    ledger = PaymentLedger(path=str(tmp_path / 'ledger.sqlite3'))
+    monkeypatch.setattr(database, 'ledger', ledger)
+    monkeypatch.setattr(bot, 'ledger', ledger)
+    monkeypatch.setattr(bot, 'db', db)
+
+    async def verify_payment(authority, amount):
+        return True
+
+    monkeypatch.setattr(bot.zarinpal, 'verify_payment', verify_payment)
+
+    notified = []
+
+    async def notify_premium_activated(_bot, user_id):
+        notified.append(user_id)
+
+    monkeypatch.setattr(bot, 'notify_premium_activated', notify_premium_activated)
+
+    db.create_user(1, 'buyer', "Buyer")
+    db.set_pending_payment(1, authority='A1', amount=50000, plan_id='monthly', title="Monthly", duration_days=30)
+    yield notified
+    ledger.close()
+
+
+def test_callback_activates_pending_payment(db, payment):
+    assert asyncio.run(bot.handle_payment_callback(None, 1, 'A1', 'OK'))
+    assert db.is_premium(1)
+    assert payment == [1]
+
+
+def test_callback_after_reconciler_activated_is_success(db, payment):
+    async def scenario():
+        assert await bot.confirm_pending_payment(1) is True
+        return await bot.handle_payment_callback(None, 1, 'A1', 'OK')
+
+    assert asyncio.run(scenario())
+    # The reconciler told the user already
+    assert payment == []
+
+
+def test_callback_for_another_payment_fails(payment):
+    async def scenario():
+        assert not await bot.handle_payment_callback(None, 1, 'other', 'OK')
+        assert await bot.confirm_pending_payment(1) is True
+        # Paid, but by someone else
+        return await bot.handle_payment_callback(None, 2, 'A1', 'OK')
+
+    assert not asyncio.run(scenario())
+
+
+# ===== ZarinPal client against the local stub gateway =====
+
+@asynccontextmanager
+async def serve(gateway: FakeGateway, **client_options):
+    """Run `gateway` on an ephemeral port and yield a client pointed at it"""
+    runner = web.AppRunner(gateway.build_app())
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    host, port = runner.addresses[0][:2]
+
+    client = ZarinPal(base_url=f"http://{host}:{port}", **client_options)
+    try:
+        yield client
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+def test_stub_round_trip():
+    async def scenario():
+        async with serve(FakeGateway()) as client:
+            payment = await client.create_payment(50000, "test", 1)
+            return payment, await client.verify_payment(payment['authority'], 50000)
+
+    payment, verified = asyncio.run(scenario())
+    assert payment['payment_url'].endswith(payment['authority'])
+    assert verified is True
+
+
+def test_server_errors_are_retried_then_given_up():
+    gateway = FakeGateway(fail_rate=1.0)
+
+    async def scenario():
+        async with serve(gateway, max_attempts=3) as client:
+            with pytest.raises(GatewayError):
+                await client._post(client.verify_url, {'authority': 'A1', 'amount': 1})
+            sent = gateway.requests
+            return sent, await client.verify_payment('A1', 50000)
+
+    sent, verified = asyncio.run(scenario())
+    assert sent == 3
+    assert gateway.requests == 6
+    assert verified is None
+
+
+def test_read_timeout_means_unreachable():
+    gateway = FakeGateway(latency=0.5)
+
+    async def scenario():
+        async with serve(gateway, read_timeout=0.1, max_attempts=1) as client:
+            return await client.verify_payment('A1', 50000)
+
+    assert asyncio.run(scenario()) is None
+    assert gateway.requests == 1
+
+
+def test_circuit_breaker_opens_and_lets_one_probe_through():
+    gateway = FakeGateway(fail_rate=1.0)
+
+    async def scenario():
+        async with serve(gateway, max_attempts=1) as client:
+            client.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+            for _ in range(2):
+                assert await client.verify_payment('A1', 50000) is None
+            assert client.breaker.state == CircuitBreaker.OPEN
+            assert not client.available
+
+            # Open: refused without touching the network
+            with pytest.raises(GatewayUnavailable):
+                await client._post(client.verify_url, {})
+            assert await client.verify_payment('A1', 50000) is None
+            assert gateway.requests == 2
+
+            # Half-open: of two concurrent calls only one reaches the gateway
+            client.breaker.opened_at -= 60
+            gateway.fail_rate = 0.0
+            gateway.latency = 0.2
+            payment_request = client._post(client.request_url, {'merchant_id': 'm', 'amount': 10})
+            results = await asyncio.gather(payment_request, client.verify_payment('A1', 50000),
+                                           return_exceptions=True)
+            return results, client.breaker.state
+
+    (probe, refused), state = asyncio.run(scenario())
+    assert probe['data']['code'] == 100
+    assert refused is None
+    assert gateway.requests == 3
+    assert state == CircuitBreaker.CLOSED
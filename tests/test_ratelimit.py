@@ -0,0 +1,46 @@
+import asyncio
+
+from ratelimit import ChatRateLimiter
+
+
+def test_idle_buckets_are_pruned_when_new_chats_arrive(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('ratelimit.time.monotonic', lambda: now[0])
+
+    limiter = ChatRateLimiter(idle_ttl=600, prune_interval=60)
+    for chat_id in range(100):
+        limiter.bucket(chat_id)
+    assert len(limiter._buckets) == 100
+
+    now[0] += 601
+    limiter.bucket(500)
+
+    assert list(limiter._buckets) == [500]
+
+
+def test_active_buckets_are_kept(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('ratelimit.time.monotonic', lambda: now[0])
+
+    limiter = ChatRateLimiter(idle_ttl=600, prune_interval=60)
+    limiter.bucket(1)
+    limiter.bucket(2)
+
+    now[0] += 500
+    asyncio.run(limiter.acquire(2))
+    now[0] += 200
+    limiter.bucket(3)
+
+    assert sorted(limiter._buckets) == [2, 3]
+
+
+def test_prune_waits_for_interval(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('ratelimit.time.monotonic', lambda: now[0])
+
+    limiter = ChatRateLimiter(idle_ttl=0, prune_interval=60)
+    limiter.bucket(1)
+    now[0] += 30
+    limiter.bucket(2)
+
+    assert sorted(limiter._buckets) == [1, 2]
@@ -165,6 +165,12 @@ NEED_PLAYLIST_BEFORE_ADD = (
 
 UPLOAD_SUCCESS = "آهنگ با موفقیت به «{playlist}» اضافه شد! ✅🎵"
 
+UPLOAD_BATCH_ADDED = "{count} آهنگ به «{playlist}» اضافه شد! ✅🎵"
+
+UPLOAD_BATCH_SKIPPED_FULL = "⚠️ {count} آهنگ جا نشد؛ این پلی‌لیست حداکثر {max_songs} آهنگ جا داره."
+
+UPLOAD_BATCH_FAILED = "❌ {count} آهنگ ذخیره نشد، دوباره بفرستشون."
+
 PLAYLIST_PUBLISH_NO_ACTIVE = "هیچ پلی‌لیست فعالی برای انتشار پیدا نکردم! 😕\n\nاول /newplaylist بزن یا پلی‌لیست قبلیت رو از /myplaylists انتخاب کن."
 
 PLAYLIST_PUBLISH_NO_SONGS = "برای انتشار باید حداقل یک آهنگ توی پلی‌لیست باشه! 🎵"
@@ -232,6 +238,14 @@ NOTIF_ADDED = "🔔 {user} آهنگ «{song}» تو رو به پلی‌لیست
 
 NOTIF_SONG_LIKED = "🔔 {user} آهنگ «{song}» تو رو لایک کرد! ❤️"
 
+NOTIF_LIKED_MANY = "🔔 {user} و {others} نفر دیگه پلی‌لیست «{playlist}» تو رو لایک کردن! ❤️"
+
+NOTIF_ADDED_MANY = "🔔 {user} و {others} نفر دیگه آهنگ «{song}» تو رو به پلی‌لیستشون اضافه کردن! 🎵"
+
+NOTIF_SONG_LIKED_MANY = "🔔 {user} و {others} نفر دیگه آهنگ «{song}» تو رو لایک کردن! ❤️"
+
+NOTIF_DIGEST_HEADER = "📬 *خلاصه‌ی فعالیت‌ها:*"
+
 NOTIF_SONG_LIKED_SELF = "❤️ آهنگ «{song}» رو لایک کردی!"
 
 NOTIF_SONG_ADDED_SELF = "➕ آهنگ «{song}» رو به «{playlist}» اضافه کردی!"
@@ -343,6 +357,37 @@ NEW_PLAYLISTS_HEADER = "✨ **پلی‌لیست‌های تازه:**\n\n"
 
 TOP_PLAYLISTS_HEADER = "👑 **برترین پلی‌لیست‌های همه دوران:**\n\n"
 
+MOOD_PLAYLISTS_HEADER = "{mood} **پلی‌لیست‌های این حال‌وهوا:**\n\n"
+
+SEARCH_RESULTS_HEADER = "🔍 **نتایج برای:** {query}\n\n"
+
+# ردیف‌های صفحه‌های مرور
+BROWSE_ROW_PLAYS_FIRST = "{icon} **{name}** by {owner}\n   ▶️ {plays} | ❤️ {likes}\n\n"
+
+BROWSE_ROW = "{icon} **{name}** by {owner}\n   ❤️ {likes} | ▶️ {plays}\n\n"
+
+BROWSE_ROW_DATED = "{icon} **{name}** by {owner}\n   ❤️ {likes} | ▶️ {plays} | 📅 {created}\n\n"
+
+# جزئیات پلی‌لیست
+PLAYLIST_SUMMARY = "🎧 **{name}**\n📂 دسته‌بندی: {mood}\n🎵 تعداد آهنگ‌ها: {count}\n\n{songs}"
+
+PLAYLIST_SONG_LINE = "{index}. {title} ({duration})"
+
+PLAYLIST_SONG_LINE_PERFORMER = "{index}. {title} — {performer} ({duration})"
+
+PLAYLIST_NO_SONGS = "هیچ آهنگی برای نمایش موجود نیست."
+
+# پخش صفحه‌به‌صفحه
+PLAYBACK_MORE = "🎶 {sent} از {total} آهنگ فرستاده شد."
+
+BTN_PLAYBACK_MORE = "▶️ {count} آهنگ بعدی"
+
+PLAYBACK_EXPIRED = "این پخش تموم شده! پلی‌لیست رو دوباره باز کن 🎧"
+
+SONG_GROUP_HEADER = "🎛 دکمه‌های آهنگ‌های بالا:"
+
+SONG_GROUP_LINE = "{number}. {title}"
+
 SEARCH_PROMPT = "چی دنبالشی؟ اسمش رو بنویس 🔍"
 
 SEARCH_NO_RESULTS = "چیزی پیدا نشد! 😕\n\nیه چیز دیگه سرچ کن"
@@ -423,6 +468,24 @@ PREMIUM_NO_PENDING_PAYMENT = "هنوز لینکی برای پرداختت ثبت
 
 PREMIUM_VERIFY_FAILED = "پرداخت هنوز تایید نشده یا پیدا نشد. اگر مبلغ از حسابت کم شده، چند لحظه دیگه دوباره امتحان کن یا با پشتیبانی در تماس باش." 
 
+PAYMENT_GATEWAY_DOWN = "درگاه پرداخت الان جواب نمیده 😕\n\nچند دقیقه دیگه دوباره امتحان کن. اگه پرداختی انجام دادی نگران نباش، خودکار بررسی میشه."
+
+PAYMENT_LINK_FAILED = "مشکلی در ایجاد لینک پرداخت پیش اومد! لطفاً بعداً تلاش کن."
+
+PAYMENT_CALLBACK_SUCCESS_PAGE = """<!DOCTYPE html>
+<html lang="fa" dir="rtl"><head><meta charset="utf-8"><title>پرداخت موفق</title></head>
+<body style="font-family: sans-serif; text-align: center; padding: 40px;">
+<h2>✅ پرداخت با موفقیت انجام شد!</h2>
+<p>پریمیومت فعال شد. می‌تونی به ربات برگردی 💎</p>
+</body></html>"""
+
+PAYMENT_CALLBACK_FAILED_PAGE = """<!DOCTYPE html>
+<html lang="fa" dir="rtl"><head><meta charset="utf-8"><title>پرداخت ناموفق</title></head>
+<body style="font-family: sans-serif; text-align: center; padding: 40px;">
+<h2>❌ پرداخت تایید نشد</h2>
+<p>اگر مبلغ از حسابت کم شده، چند دقیقه صبر کن یا با پشتیبانی در تماس باش.</p>
+</body></html>"""
+
 ALREADY_PREMIUM = "تو که الان پریمیومی! 💎\n\nپریمیومت تا {date} اعتباره ✅"
 
 # ===== FOLLOW SYSTEM =====
@@ -491,6 +554,26 @@ ADMIN_USER_INFO = """
 
 ADMIN_BROADCAST_SENT = "پیام به {count} کاربر ارسال شد! ✅"
 
+BROADCAST_ADMIN_MESSAGE = "📢 **پیام از ادمین:**\n\n{text}"
+
+BROADCAST_QUEUED = """📢 ارسال همگانی شروع شد!
+
+👥 گیرنده‌ها: {total}
+پیشرفت ارسال همینجا نشون داده میشه ⏳"""
+
+BROADCAST_PROGRESS = """📢 در حال ارسال...
+
+📊 پیشرفت: {done}/{total}
+✅ موفق: {sent}
+❌ ناموفق: {failed}
+🚫 رد شده (ربات بلاک شده): {skipped}"""
+
+BROADCAST_REPORT = """✅ ارسال تموم شد!
+
+موفق: {sent}
+ناموفق: {failed}
+رد شده (ربات بلاک شده): {skipped}"""
+
 ADMIN_USER_BANNED = "کاربر بن شد ⛔️"
 
 ADMIN_USER_UNBANNED = "بن کاربر برداشته شد ✅"
@@ -0,0 +1,69 @@
+# update_processor.py - Concurrent Update Processing
+# پردازش همزمان آپدیت‌ها با حفظ ترتیب برای هر کاربر
+
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import *
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Run updates concurrently, but one at a time per user (or chat)
+
+    Flows such as ``pending_song_add`` and ``awaiting_search`` in
+    ``context.user_data`` assume a user's updates are handled in order, so
+    updates sharing a key are serialized with a FIFO lock. At most
+    `concurrency` handlers run at once; updates waiting behind their own
+    user's previous one don't take a slot, so a single busy user can't
+    starve everyone else. `max_pending` bounds updates in flight overall.
+    """
+
+    __slots__ = ('concurrency', '_workers', '_locks')
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_MAX_PENDING):
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self._workers = asyncio.BoundedSemaphore(concurrency)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._locks: Dict[Hashable, List[Any]] = {}
+
+    @staticmethod
+    def update_key(update: object) -> Optional[Hashable]:
+        """Serialization key: the user if known, else the chat"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return ('user', update.effective_user.id)
+        if update.effective_chat:
+            return ('chat', update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self.update_key(update)
+        if key is None:
+            async with self._workers:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+
+        try:
+            async with entry[0]:
+                async with self._workers:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._locks.clear()
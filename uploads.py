@@ -0,0 +1,108 @@
+# uploads.py - Batched Audio Uploads
+# جمع کردن آهنگ‌هایی که پشت‌سرهم فرستاده میشن و پردازش یکجا
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+from telegram import Message
+
+from config import *
+
+
+logger = logging.getLogger(__name__)
+
+FlushCallback = Callable[[int, List[Message], Any], Awaitable[Any]]
+
+
+class UploadBatcher:
+    """Collect a user's audio messages and hand them over as one batch
+
+    An album (media group) reaches the bot as one update per file, a few
+    milliseconds apart, and users often send several files in a row. Each
+    message restarts a `window`-second timer for its user; when the timer
+    runs out, `flush(user_id, messages, context)` gets everything collected.
+    A batch is flushed right away once it reaches `max_size`, or when a
+    different album starts while the current one isn't finished.
+    """
+
+    def __init__(
+        self,
+        flush: FlushCallback,
+        window: float = UPLOAD_BATCH_WINDOW,
+        max_size: int = UPLOAD_BATCH_MAX_SIZE,
+    ):
+        self.flush = flush
+        self.window = window
+        self.max_size = max(1, max_size)
+        self._batches: Dict[int, List[Message]] = {}
+        self._contexts: Dict[int, Any] = {}
+        self._timers: Dict[int, asyncio.Task] = {}
+        self._flushing: set = set()
+
+    def add(self, user_id: int, message: Message, context: Any):
+        """Queue an audio message; its batch is processed after the window"""
+        batch = self._batches.get(user_id)
+        if batch and message.media_group_id and batch[-1].media_group_id not in (None, message.media_group_id):
+            # A new album: finish the previous one first
+            self._start_flush(user_id)
+            batch = None
+
+        if batch is None:
+            batch = self._batches[user_id] = []
+        batch.append(message)
+        self._contexts[user_id] = context
+
+        timer = self._timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+
+        if len(batch) >= self.max_size:
+            self._start_flush(user_id)
+        else:
+            self._timers[user_id] = asyncio.create_task(self._flush_later(user_id))
+
+    def pending(self, user_id: int) -> int:
+        """Messages waiting in this user's batch"""
+        return len(self._batches.get(user_id, ()))
+
+    async def _flush_later(self, user_id: int):
+        await asyncio.sleep(self.window)
+        # From here on this is a flush, not a timer: flush_all must wait for it
+        self._timers.pop(user_id, None)
+        task = asyncio.current_task()
+        self._flushing.add(task)
+        try:
+            await self._flush(user_id)
+        finally:
+            self._flushing.discard(task)
+
+    def _start_flush(self, user_id: int):
+        timer = self._timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+        task = asyncio.create_task(self._flush(user_id))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, user_id: int):
+        messages = self._batches.pop(user_id, None)
+        context = self._contexts.pop(user_id, None)
+        if not messages:
+            return
+        try:
+            await self.flush(user_id, messages, context)
+        except Exception:
+            logger.exception("Failed to process %s uploads from %s", len(messages), user_id)
+
+    async def flush_all(self):
+        """Process every waiting batch now (on shutdown)"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+
+        await asyncio.gather(
+            *(self._flush(user_id) for user_id in list(self._batches)),
+            *list(self._flushing),
+            return_exceptions=True,
+        )
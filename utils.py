@@ -1,99 +1,14 @@
-# utils.py - Helper Functions & ZarinPal Integration
-# توابع کمکی و پرداخت زرین‌پال
+# utils.py - Helper Functions
+# توابع کمکی
 
-import requests
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Dict, List, Optional, Tuple
 
 from config import *
+from rendering import escape_markdown
 from texts import BTN_ADD, BTN_LIKE, BTN_LIKED
 
 
-# ===== ZARINPAL PAYMENT =====
-
-class ZarinPal:
-    """ZarinPal payment gateway handler"""
-
-    def __init__(self):
-        self.merchant_id = ZARINPAL_MERCHANT_ID
-        self.sandbox = ZARINPAL_SANDBOX
-
-        if self.sandbox:
-            self.request_url = ZARINPAL_SANDBOX_REQUEST_URL
-            self.verify_url = ZARINPAL_SANDBOX_VERIFY_URL
-            self.payment_url = ZARINPAL_SANDBOX_PAYMENT_URL
-        else:
-            self.request_url = ZARINPAL_REQUEST_URL
-            self.verify_url = ZARINPAL_VERIFY_URL
-            self.payment_url = ZARINPAL_PAYMENT_URL
-
-    @staticmethod
-    def _to_rial(amount: int) -> int:
-        """Convert toman amount to rial for ZarinPal"""
-        return int(amount * 10)
-
-    def create_payment(self, amount: int, description: str, user_id: int) -> Optional[Dict[str, str]]:
-        """
-        Create payment request
-        Returns: dict with payment_url and authority or None
-        """
-        rial_amount = self._to_rial(amount)
-
-        data = {
-            "merchant_id": self.merchant_id,
-            "amount": rial_amount,
-            "description": description,
-            "callback_url": f"{ZARINPAL_CALLBACK_URL}?user_id={user_id}",
-        }
-
-        try:
-            response = requests.post(self.request_url, json=data, timeout=10)
-            result = response.json()
-
-            if result.get('data', {}).get('code') == 100:
-                authority = result['data']['authority']
-                payment_url = f"{self.payment_url}{authority}"
-                return {"payment_url": payment_url, "authority": authority}
-            else:
-                print(f"ZarinPal Error: {result}")
-                return None
-
-        except Exception as e:
-            print(f"ZarinPal Request Error: {e}")
-            return None
-
-    def verify_payment(self, authority: str, amount: int) -> bool:
-        """
-        Verify payment after callback
-        Returns: True if successful
-        """
-        rial_amount = self._to_rial(amount)
-
-        data = {
-            "merchant_id": self.merchant_id,
-            "amount": rial_amount,
-            "authority": authority
-        }
-
-        try:
-            response = requests.post(self.verify_url, json=data, timeout=10)
-            result = response.json()
-
-            if result.get('data', {}).get('code') == 100:
-                return True
-            else:
-                print(f"ZarinPal Verify Error: {result}")
-                return False
-
-        except Exception as e:
-            print(f"ZarinPal Verify Error: {e}")
-            return False
-
-
-# Initialize ZarinPal
-zarinpal = ZarinPal()
-
-
 # ===== FORMATTING HELPERS =====
 
 def format_number(num: int) -> str:
@@ -170,14 +85,6 @@ def truncate_text(text: str, max_length: int = 50) -> str:
     return text[:max_length - 3] + "..."
 
 
-def escape_markdown(text: str) -> str:
-    """Escape special markdown characters"""
-    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    for char in special_chars:
-        text = text.replace(char, f'\\{char}')
-    return text
-
-
 def clean_username(username: Optional[str]) -> str:
     """Clean username for display"""
     if not username:
@@ -212,7 +119,7 @@ def is_valid_audio_file(file_size: int, duration: int) -> bool:
 def should_send_notification(user_id: int, db) -> bool:
     """Check if user has notifications enabled"""
     user = db.get_user(user_id)
-    if not user:
+    if not user or user.get('unreachable_since'):
         return False
     return user.get('notifications_enabled', True)
 
@@ -318,6 +225,7 @@ def format_admin_stats(stats: Dict) -> str:
 • کاربران پریمیوم: {format_number(stats['premium_users'])}
 • سهم از کاربران فعال: {format_percentage(stats.get('premium_ratio', 0))}
 • درآمد کل: {format_number(stats['revenue'])} تومان
+• درآمد این ماه: {format_number(stats.get('revenue_month', 0))} تومان
 
 🎵 **محتوا**
 • پلی‌لیست‌های منتشر شده: {format_number(stats['total_playlists'])}
@@ -329,6 +237,83 @@ def format_admin_stats(stats: Dict) -> str:
 """
 
 
+def format_send_lanes(scheduler) -> str:
+    """Format outbound lane metrics for admin panel"""
+    if scheduler is None or not hasattr(scheduler, 'lane_metrics'):
+        return ""
+
+    lines = ["📮 **صف‌های ارسال**"]
+    for lane, metrics in scheduler.lane_metrics().items():
+        lines.append(
+            f"• {lane}: صف {metrics['depth']} | ارسال {format_number(metrics['sent'])} | "
+            f"انتظار میانگین {metrics['avg_wait']:.2f}s | بیشینه {metrics['max_wait']:.2f}s"
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+def format_notification_savings(outbox) -> str:
+    """Format notification coalescing savings for admin panel"""
+    savings = outbox.savings()
+    return (
+        f"📬 **نوتیفیکیشن‌ها ({savings['hours']} ساعت اخیر)**\n"
+        f"• رویدادها: {format_number(savings['events'])} | "
+        f"پیام‌های صرفه‌جویی‌شده: {format_number(savings['saved'])} "
+        f"({savings['saved_per_hour']:.1f} در ساعت)\n"
+        f"• در صف: {format_number(outbox.pending_count())}\n"
+    )
+
+
+def format_cache_stats(registry) -> str:
+    """Format cache hit ratios for admin panel"""
+    stats = {name: cache for name, cache in registry.stats().items() if cache['hits'] or cache['misses']}
+    if not stats:
+        return ""
+
+    lines = ["🗃 **کش**"]
+    for name, cache in sorted(stats.items()):
+        lines.append(
+            f"• {name}: {format_percentage(cache['hit_ratio'])} hit | "
+            f"{cache['size']}/{cache['maxsize']} | evict {format_number(cache['evictions'])}"
+        )
+
+    return "\n".join(lines) + "\n"
+
+
+def format_revenue_by_plan(revenue: Dict[str, tuple], plan_titles: Dict[str, str]) -> str:
+    """Format this month's revenue per plan for admin panel"""
+    if not revenue:
+        return ""
+
+    lines = ["📦 **فروش این ماه به تفکیک پلن**"]
+    for plan_id, (amount, count) in revenue.items():
+        title = escape_markdown(plan_titles.get(plan_id, plan_id))
+        lines.append(f"• {title}: {format_number(count)} خرید | {format_number(amount)} تومان")
+
+    return "\n".join(lines) + "\n"
+
+
+def format_callback_routes(router, limit: int = 8) -> str:
+    """Format the busiest callback routes for admin panel"""
+    routes = sorted(
+        ((pattern, metrics) for pattern, metrics in router.metrics().items() if metrics['calls']),
+        key=lambda item: item[1]['total_time'],
+        reverse=True,
+    )[:limit]
+    if not routes:
+        return ""
+
+    lines = ["🧭 **دکمه‌ها (پرمصرف‌ترین)**"]
+    for pattern, metrics in routes:
+        lines.append(
+            f"• {pattern}: {format_number(metrics['calls'])} بار | "
+            f"میانگین {metrics['avg_time'] * 1000:.0f}ms | بیشینه {metrics['max_time'] * 1000:.0f}ms"
+            + (f" | خطا {metrics['errors']}" if metrics['errors'] else "")
+        )
+
+    return "\n".join(lines) + "\n"
+
+
 # ===== PAGINATION =====
 
 def paginate_list(items: list, page: int = 1, per_page: int = 10) -> tuple:
@@ -391,6 +376,22 @@ def create_playlist_buttons(playlist_id: str, user_liked: bool = False):
     return InlineKeyboardMarkup(buttons)
 
 
+def song_button_labels(
+    *,
+    user_liked: bool = False,
+    already_added: bool = False,
+    like_count: int = 0,
+    add_count: int = 0,
+):
+    """Like and add button labels for a song"""
+    like_base = BTN_LIKED if user_liked else BTN_LIKE
+    like_label = f"{like_base} ({format_number(max(like_count, 0))})"
+
+    add_base = "✅ اضافه شد" if already_added else BTN_ADD
+    add_label = f"{add_base} ({format_number(max(add_count, 0))})"
+    return like_label, add_label
+
+
 def create_song_buttons(
     song_id: str,
     playlist_id: str,
@@ -404,11 +405,12 @@ def create_song_buttons(
     """Create interaction buttons for individual song"""
     from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-    like_base = BTN_LIKED if user_liked else BTN_LIKE
-    like_label = f"{like_base} ({format_number(max(like_count, 0))})"
-
-    add_base = "✅ اضافه شد" if already_added else BTN_ADD
-    add_label = f"{add_base} ({format_number(max(add_count, 0))})"
+    like_label, add_label = song_button_labels(
+        user_liked=user_liked,
+        already_added=already_added,
+        like_count=like_count,
+        add_count=add_count,
+    )
 
     buttons = [
         [
@@ -434,39 +436,59 @@ def create_song_buttons(
     return InlineKeyboardMarkup(buttons)
 
 
-# ===== ERROR HANDLING =====
-
-def handle_error(error: Exception, context: str = "") -> str:
-    """Handle and log errors"""
-    error_msg = f"Error in {context}: {str(error)}"
-    print(error_msg)
-    return "اوپس! یه مشکلی پیش اومد 😅\n\nدوباره امتحان کن"
+def create_song_group_buttons(playlist_id: str, songs: List[Tuple[str, Dict]], *, can_remove: bool = False):
+    """One keyboard for an album: a numbered row of buttons per song
 
+    `songs` holds (song_id, state) pairs, state being the like/add keyword
+    arguments of create_song_buttons.
+    """
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-# ===== CACHE HELPERS (Simple) =====
+    buttons = []
+    for number, (song_id, state) in enumerate(songs, 1):
+        like_label, add_label = song_button_labels(**state)
+        row = [
+            InlineKeyboardButton(
+                f"{number}. {like_label}",
+                callback_data=f"like_song:{playlist_id}:{song_id}",
+            ),
+            InlineKeyboardButton(
+                add_label,
+                callback_data=f"add_song:{playlist_id}:{song_id}",
+            ),
+        ]
+        if can_remove:
+            row.append(
+                InlineKeyboardButton(
+                    "🗑️",
+                    callback_data=f"remove_song:{playlist_id}:{song_id}",
+                )
+            )
+        buttons.append(row)
 
-_cache = {}
+    return InlineKeyboardMarkup(buttons)
 
 
-def cache_set(key: str, value, ttl: int = 300):
-    """Set cache with TTL in seconds"""
-    _cache[key] = {
-        'value': value,
-        'expires': datetime.now().timestamp() + ttl
-    }
+def keyboard_song_ids(reply_markup) -> List[str]:
+    """Song ids a song keyboard has like buttons for, in order"""
+    song_ids = []
+    if not reply_markup:
+        return song_ids
 
+    for row in reply_markup.inline_keyboard:
+        for button in row:
+            data = button.callback_data
+            if isinstance(data, str) and data.startswith('like_song:'):
+                song_id = data.split(':', 2)[-1]
+                if song_id not in song_ids:
+                    song_ids.append(song_id)
+    return song_ids
 
-def cache_get(key: str):
-    """Get from cache"""
-    if key in _cache:
-        item = _cache[key]
-        if datetime.now().timestamp() < item['expires']:
-            return item['value']
-        else:
-            del _cache[key]
-    return None
 
+# ===== ERROR HANDLING =====
 
-def cache_clear():
-    """Clear all cache"""
-    _cache.clear()
\ No newline at end of file
+def handle_error(error: Exception, context: str = "") -> str:
+    """Handle and log errors"""
+    error_msg = f"Error in {context}: {str(error)}"
+    print(error_msg)
+    return "اوپس! یه مشکلی پیش اومد 😅\n\nدوباره امتحان کن"
@@ -0,0 +1,162 @@
+# webserver.py - Webhook Mode HTTP Server
+# سرور HTTP برای حالت وبهوک، هلث‌چک و کال‌بک پرداخت
+
+import asyncio
+import hmac
+import logging
+import signal
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from config import *
+from texts import PAYMENT_CALLBACK_FAILED_PAGE, PAYMENT_CALLBACK_SUCCESS_PAGE
+
+
+logger = logging.getLogger(__name__)
+
+# (bot, user_id, authority, status) -> True if premium was activated
+PaymentHandler = Callable[..., Awaitable[bool]]
+
+
+class BotWebServer:
+    """Embedded aiohttp server: Telegram webhook, /healthz and payment callback
+
+    Updates posted by Telegram are verified against the secret token and put
+    on the application's update queue, exactly like polling would.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        payment_handler: Optional[PaymentHandler] = None,
+        listen: str = WEBHOOK_LISTEN,
+        port: int = WEBHOOK_PORT,
+        webhook_path: str = WEBHOOK_PATH,
+        secret_token: str = WEBHOOK_SECRET_TOKEN,
+        payment_path: str = PAYMENT_CALLBACK_PATH,
+    ):
+        self.application = application
+        self.payment_handler = payment_handler
+        self.listen = listen
+        self.port = port
+        self.webhook_path = '/' + webhook_path.strip('/')
+        self.secret_token = secret_token
+        self.payment_path = payment_path
+        self._runner: Optional[web.AppRunner] = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.webhook_path, self._telegram)
+        app.router.add_get('/healthz', self._healthz)
+        app.router.add_get(self.payment_path, self._payment)
+        return app
+
+    async def _telegram(self, request: web.Request) -> web.Response:
+        if self.secret_token:
+            header = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(header, self.secret_token):
+                return web.Response(status=403)
+
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        update = Update.de_json(data, self.application.bot)
+        if update is None:
+            return web.Response(status=400)
+
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def _healthz(self, request: web.Request) -> web.Response:
+        running = self.application.running
+        return web.json_response(
+            {
+                'status': 'ok' if running else 'starting',
+                'pending_updates': self.application.update_queue.qsize(),
+            },
+            status=200 if running else 503,
+        )
+
+    async def _payment(self, request: web.Request) -> web.Response:
+        activated = False
+
+        try:
+            user_id = int(request.query.get('user_id', ''))
+        except ValueError:
+            user_id = None
+
+        if user_id and self.payment_handler:
+            try:
+                activated = await self.payment_handler(
+                    self.application.bot,
+                    user_id,
+                    request.query.get('Authority'),
+                    request.query.get('Status'),
+                )
+            except Exception as exc:
+                logger.error("Payment callback for %s failed: %s", user_id, exc)
+
+        page = PAYMENT_CALLBACK_SUCCESS_PAGE if activated else PAYMENT_CALLBACK_FAILED_PAGE
+        return web.Response(text=page, content_type='text/html', charset='utf-8')
+
+    async def start(self):
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info("Web server listening on %s:%s", self.listen, self.port)
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def _serve(application: Application, payment_handler: Optional[PaymentHandler]):
+    server = BotWebServer(application, payment_handler)
+    stop_event = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    # run_polling/run_webhook call the post_* hooks themselves; mirror that here
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+
+    if WEBHOOK_BASE_URL:
+        await application.bot.set_webhook(
+            url=WEBHOOK_BASE_URL.rstrip('/') + server.webhook_path,
+            secret_token=WEBHOOK_SECRET_TOKEN or None,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        logger.warning("WEBHOOK_BASE_URL is empty; not registering the webhook with Telegram")
+
+    await application.start()
+    await server.start()
+
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_webhook(application: Application, payment_handler: Optional[PaymentHandler] = None):
+    """Serve the bot over a webhook until SIGINT/SIGTERM"""
+    asyncio.run(_serve(application, payment_handler))